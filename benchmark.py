@@ -0,0 +1,494 @@
+"""
+離線基準測試：以本機 HTTP 伺服器模擬 showpage.jsp / detail.jsp，
+比較單執行緒、平行與快取三種抓取模式的吞吐量、各解析後端的解析時間，以及每筆資料的記憶體用量。
+
+python benchmark.py --schools 26000 --workers 16
+python benchmark.py --schools 600 --latency 20 --jitter 10 --error-rate 0.01 --output bench_output.txt
+python benchmark.py --schools 600 --workers 8 --cookie-budget 200 --modes concurrent
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.cookies import SimpleCookie
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import scraper
+
+ITEMS_PER_PAGE = 15
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+CITIES = list(scraper.COUNTIES)
+CITY_CODES = list(scraper.COUNTIES.values())
+CATEGORIES = ['文理類', '外語類', '文理類,其他類', '音樂', '舞蹈類', '美術', '商類：珠算']
+SUBJECTS = ['數學', '英文', '英語', '美語', '自然', '國文', '國語', '社會', '理化', '美術', '作文']
+RECRUITERS = ['國小', '國中', '高中', '國小,國中', '成人']
+
+
+class SyntheticSite:
+    """依補習班序號產生固定內容的列表頁與詳細頁，欄位結構與來源網站相同"""
+
+    def __init__(self, schools, seed=0):
+        self.schools = schools
+        self.seed = seed
+
+    def record(self, i):
+        rnd = random.Random(self.seed * 1000003 + i)
+        return {
+            'id': f"S{i:07d}",
+            'city': CITIES[i % len(CITIES)],
+            'name': f"臺北市私立第{i}文理短期補習班",
+            'address': f"某某區某某路{rnd.randint(1, 999)}號{rnd.randint(1, 12)}樓",
+            'phone': f"(02){rnd.randint(20000000, 29999999)}",
+            'doc': f"府教終字第{1130000000 + i}號",
+            'date': f"{2000 + i % 26}-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            'rnd': rnd,
+        }
+
+    def total_pages(self):
+        return math.ceil(self.schools / ITEMS_PER_PAGE)
+
+    def select(self, city=None, name=None, since=None, until=None, road=None, category=None):
+        """
+        依 p_city (縣市代碼)、p_name、start_date／end_date (立案日期)、p_road／p_area (班址) 與 p_type (類別) 篩選，
+        回傳補習班序號；未篩選時回傳 None 表示全部
+        """
+        if city in (None, '', 'all') and not (name or since or until or road or category):
+            return None
+        indices = range(self.schools)
+        if city not in (None, '', 'all'):
+            try:
+                k = CITY_CODES.index(int(city))
+            except ValueError:
+                return []
+            indices = range(k, self.schools, len(CITIES))
+        if name:
+            indices = [i for i in indices if name in self.record(i)['name']]
+        if since or until:
+            dates = {i: self.record(i)['date'] for i in indices}
+            indices = [i for i in indices if (not since or dates[i] >= since) and (not until or dates[i] <= until)]
+        if road:
+            indices = [i for i in indices if road in self.record(i)['address']]
+        if category:
+            indices = [i for i in indices if category in CATEGORIES[i % len(CATEGORIES)]]
+        return list(indices)
+
+    def list_page(self, page, indices=None):
+        rows = []
+        total = self.schools if indices is None else len(indices)
+        start = (page - 1) * ITEMS_PER_PAGE
+        for n in range(start, min(start + ITEMS_PER_PAGE, total)):
+            i = n if indices is None else indices[n]
+            r = self.record(i)
+            rows.append(
+                f"<tr><th scope=\"row\">{i + 1}</th><td>{r['city']}</td><td>{r['name']}</td>"
+                f"<td>{r['address']}</td><td>{r['phone']}</td><td>{r['doc']}</td><td>{r['date']}</td>"
+                f"<td><button type=\"button\" class=\"btn btn-primary\" "
+                f"onclick=\"window.open('detail.jsp?u={r['id'][1:]}')\">詳細</button></td></tr>"
+            )
+        return (
+            "<!DOCTYPE html><html lang=\"zh-Hant\"><head><meta charset=\"utf-8\"><title>查詢結果</title>"
+            "<script>var x = 1;</script></head><body><div class=\"container\">"
+            "<table class=\"table m-2\">"
+            f"<caption id=\"result-list\">查詢結果：共 {total} 筆，第 {page}/{math.ceil(total / ITEMS_PER_PAGE)} 頁</caption>"
+            "<thead><tr><th>序號</th><th>縣市</th><th>補習班名稱</th><th>班址</th><th>電話</th>"
+            "<th>立案文號</th><th>立案日期</th><th>詳細</th></tr></thead>"
+            f"<tbody>{''.join(rows)}</tbody></table></div></body></html>"
+        )
+
+    def print_page(self, city):
+        """縣市列印頁：border=1 的單一表格，沒有詳細頁連結 (與 backup/get.py 抓取的格式相同)"""
+        rows = []
+        for n, i in enumerate(self.select(city) or []):
+            r = self.record(i)
+            rows.append(f"<tr><td>{n + 1}</td><td>{r['name']}</td><td>{r['address']}</td><td>{r['phone']}</td>"
+                        f"<td>{r['doc']}</td><td>{r['date']}</td></tr>")
+        return (
+            "<html><head><meta charset=\"utf-8\"></head><body><table border=\"1\">"
+            "<tr><th>序號</th><th>補習班名稱</th><th>班 址</th><th>電話</th><th>立案文號</th><th>立案日期</th></tr>"
+            f"{''.join(rows)}</table></body></html>"
+        )
+
+    def opendata(self, city):
+        """縣市開放資料 JSON (同 backup/city_m_all.py 讀取的 afterschool_json.jsp)"""
+        records = []
+        for i in self.select(city) or []:
+            r = self.record(i)
+            records.append({'短期補習班名稱': r['name'], '電子郵件': f"school{i}@example.com.tw",
+                            '短期補習班類別': CATEGORIES[i % len(CATEGORIES)], '地區縣市': r['city']})
+        return json.dumps(records, ensure_ascii=False)
+
+    def cancel_page(self, city, start, end):
+        """廢止／註銷列印頁：start～end (年, 月) 之間每個縣市每月兩筆 (同 backup/cancel_list.py 抓取的格式)"""
+        indices = self.select(city) or []
+        rows = []
+        y, m = start
+        while indices and (y, m) <= end:
+            for j in range(2):
+                i = indices[(y * 12 + m + j) % len(indices)]
+                r = self.record(i)
+                kind = '註銷' if j else '廢止'
+                rows.append(f"<tr><td>{len(rows) + 1}</td><td>{r['name']}</td><td>設立人{i}</td><td>班主任{i}</td>"
+                            f"<td>{r['address']}</td><td>{r['phone']}</td><td>{kind}</td><td>{y}-{m:02d}-{10 + j}</td>"
+                            f"<td>府教終字第{y}{m:02d}{j}{i:05d}號</td><td>{y}-{m:02d}-{10 + j}</td></tr>")
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        return (
+            "<html><head><meta charset=\"utf-8\"></head><body><table border=\"1\">"
+            "<tr><th>序號</th><th>補習班</th><th>設立人</th><th>班主任</th><th>班 址</th><th>電 話</th>"
+            "<th>廢止/註銷</th><th>發文日期</th><th>廢止/註銷文號</th><th>廢止/註銷日期</th></tr>"
+            f"{''.join(rows)}</table></body></html>"
+        )
+
+    def detail_page(self, school_id):
+        i = int(school_id)
+        r = self.record(i)
+        rnd = r['rnd']
+        area = rnd.randint(1000, 50000) / 100
+        fields = {
+            'th-sqnum': str(8000 + i),
+            'th-cataname': CATEGORIES[i % len(CATEGORIES)],
+            'th-legaltype': '已立案',
+            'th-fax': '(02)',
+            'th-email': f"school{i}@example.com.tw",
+            'th-roomcount': str(rnd.randint(1, 12)),
+            'th-water': '',
+            'th-roomarea': f"{area:.2f}平方公尺",
+            'th-schoolarea': f"{area * 2.5:.2f}平方公尺",
+            'th-shutnumber': '',
+            'th-shutexpire': '',
+            'th-shutclosure': '',
+            'th-incharge': f"負責人{i}",
+            'th-establish': f"設立人{i}",
+            'th-director': f"班主任{i}",
+        }
+        basic = ''.join(
+            f"<tr><th id=\"{hid}\" scope=\"row\">{hid}</th><td headers=\"{hid}\">{val}</td></tr>"
+            for hid, val in fields.items()
+        )
+        subjects = []
+        for _ in range(rnd.randint(0, 4)):
+            subjects.append(
+                f"<tr><td headers=\"th-course-name\">{rnd.choice(SUBJECTS)}</td>"
+                f"<td headers=\"th-allow-class\">{rnd.randint(1, 5)}</td>"
+                f"<td headers=\"th-allow-person\">{rnd.randint(10, 40)}</td>"
+                f"<td headers=\"th-lesson-total\">{rnd.randint(2, 20)}</td>"
+                f"<td headers=\"th-study-period\">{rnd.randint(1, 12)}個月</td>"
+                f"<td headers=\"th-allow-recruiter\">{rnd.choice(RECRUITERS)}</td></tr>"
+            )
+        vehicles = []
+        for _ in range(rnd.choice((0, 0, 0, 1, 2))):
+            vehicles.append(
+                f"<tr><td headers=\"th-permit-id\">{rnd.choice('ABCDEFG')}{rnd.choice('KLMNP')}-{rnd.randint(1000, 9999)}</td>"
+                f"<td headers=\"th-approve-doc\">{rnd.randint(1000000000, 1999999999)}</td>"
+                f"<td headers=\"th-approve-date\">20{rnd.randint(10, 25)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}</td></tr>"
+            )
+        empty = "<tr><td colspan=\"6\">無資料</td></tr>"
+        return (
+            "<!DOCTYPE html><html lang=\"zh-Hant\"><head><meta charset=\"utf-8\"><title>補習班詳細資料</title></head>"
+            "<body><div class=\"container\">"
+            f"<table class=\"table\"><caption>補習班基本資料</caption><tbody>{basic}</tbody></table>"
+            "<table class=\"table\"><caption>核准科目資料</caption><thead><tr>"
+            "<th id=\"th-course-name\">核准科目名稱</th><th id=\"th-allow-class\">核准班級數</th>"
+            "<th id=\"th-allow-person\">每班核准人數</th><th id=\"th-lesson-total\">每週總節(時)數</th>"
+            "<th id=\"th-study-period\">修業期限</th><th id=\"th-allow-recruiter\">招生對象</th></tr></thead>"
+            f"<tbody>{''.join(subjects) or empty}</tbody></table>"
+            "<table class=\"table\"><caption>交通車資料</caption><thead><tr>"
+            "<th id=\"th-permit-id\">牌照號碼</th><th id=\"th-approve-doc\">備查文號</th>"
+            "<th id=\"th-approve-date\">備查日期</th></tr></thead>"
+            f"<tbody>{''.join(vehicles) or empty}</tbody></table>"
+            "</div></body></html>"
+        )
+
+
+class SiteServer:
+    """
+    在背景執行緒提供 SyntheticSite 的本機 HTTP 伺服器。
+    latency/jitter 以毫秒計；error_rate 為回應 HTTP 500 的比例。
+    cookie_budget > 0 時模擬 TS cookie：首頁核發 cookie，每個 cookie 可用 cookie_budget 個請求，
+    沒有或用完的 cookie 會收到 HTTP 200 的驗證頁，直到重新造訪首頁。
+    """
+
+    def __init__(self, site, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, cookie_budget=0):
+        self.site = site
+        self.latency = latency / 1000.0
+        self.jitter = jitter / 1000.0
+        self.error_rate = error_rate
+        self.cookie_budget = cookie_budget
+        self.cookies = {}
+        self.issued = 0
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.bytes_sent = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.bytes_sent = 0
+
+    def check_cookie(self, handler, endpoint):
+        """回傳 (是否放行, 要核發的新 cookie)；首頁一律放行並核發新 cookie"""
+        if not self.cookie_budget:
+            return True, None
+        with self.lock:
+            if endpoint == 'index':
+                self.issued += 1
+                self.cookies[str(self.issued)] = self.cookie_budget
+                return True, str(self.issued)
+            morsel = SimpleCookie(handler.headers.get('Cookie', '')).get('TS01')
+            left = self.cookies.get(morsel.value) if morsel else None
+            if not left:
+                return False, None
+            self.cookies[morsel.value] = left - 1
+            return True, None
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        endpoint = os.path.basename(parts.path) or 'index'
+        query = parse_qs(parts.query)
+        with self.lock:
+            delay = max(0.0, self.latency + self.rnd.uniform(-self.jitter, self.jitter))
+            fail = self.rnd.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        allowed, cookie = self.check_cookie(handler, endpoint)
+
+        status = 200
+        if fail:
+            status, body = 500, "<html><body>Internal Server Error</body></html>"
+        elif not allowed:
+            endpoint = 'interstitial'
+            body = "<html><body><script>/* challenge */</script>請稍候，正在驗證您的瀏覽器…</body></html>"
+        elif endpoint == 'showpage.jsp':
+            arg = lambda name: query.get(name, [None])[0]
+            indices = self.site.select(arg('p_city'), arg('p_name'), arg('start_date'), arg('end_date'),
+                                       arg('p_road') or arg('p_area'), arg('p_type'))
+            body = self.site.list_page(int(query.get('pageno', ['1'])[0]), indices)
+        elif endpoint == 'print_showpage.jsp':
+            body = self.site.print_page(query.get('citylink', [None])[0])
+        elif endpoint == 'detail.jsp':
+            body = self.site.detail_page(query.get('u', ['0'])[0])
+        elif endpoint == 'print_cancel_list_b.jsp':
+            month = lambda prefix: (int(query[f'{prefix}_year'][0]), int(query[f'{prefix}_month'][0]))
+            body = self.site.cancel_page(query.get('city', [None])[0], month('sn'), month('end'))
+        elif endpoint == 'afterschool_json.jsp':
+            body = self.site.opendata(query.get('city', [None])[0])
+        elif endpoint in ('index', 'afterschool', 'cancel_list_b.jsp'):
+            body = "<html><body>index</body></html>"
+        else:
+            status, body = 404, "<html><body>Not Found</body></html>"
+
+        data = body.encode('utf-8')
+        with self.lock:
+            key = endpoint if status == 200 else f"{endpoint}:{status}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.bytes_sent += len(data)
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'text/html; charset=UTF-8')
+        handler.send_header('Content-Length', str(len(data)))
+        if cookie:
+            handler.send_header('Set-Cookie', f"TS01={cookie}; Path=/")
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def run_crawl(server, workdir, extra_args):
+    """
+    在 workdir 以子行程執行 scraper.py，回傳耗時、尖峰 RSS 與伺服器端請求數。
+    每秒頁數以整個網站的頁數計算，因此快取模式下即使沒有送出請求也能比較。
+    """
+    server.reset()
+    cmd = [sys.executable, os.path.join(ROOT, 'scraper.py'), '--base-url', server.url] + extra_args
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+    rss_kb = usage.ru_maxrss / 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    counts = dict(server.counts)
+    list_pages = server.site.total_pages()
+    detail_pages = server.site.schools
+    return {
+        'exit_code': proc.returncode,
+        'elapsed_s': round(elapsed, 3),
+        'list_requests': counts.get('showpage.jsp', 0),
+        'detail_requests': counts.get('detail.jsp', 0),
+        'list_pages_per_s': round(list_pages / elapsed, 2) if elapsed else 0,
+        'detail_pages_per_s': round(detail_pages / elapsed, 2) if elapsed else 0,
+        'server_errors': sum(v for k, v in counts.items() if ':' in k),
+        'interstitials': counts.get('interstitial', 0),
+        'bytes_served': server.bytes_sent,
+        'peak_rss_mb': round(rss_kb / 1024, 1),
+    }
+
+
+def bench_parsers(site, samples, repeat):
+    """在行程內量測列表頁與各詳細頁解析後端的每頁解析時間 (毫秒)"""
+    list_html = [site.list_page(p) for p in range(1, min(site.total_pages(), samples) + 1)]
+    detail_html = [(str(i), site.detail_page(str(i))) for i in range(min(site.schools, samples))]
+
+    def timed(func, pages):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for args in pages:
+                func(*args)
+        return round((time.perf_counter() - start) * 1000 / (repeat * len(pages)), 3)
+
+    result = {'list_page': timed(scraper.parse_list_page, [(h,) for h in list_html])}
+    result['detail_legacy'] = timed(scraper.parse_school_details_legacy, [(h, i) for i, h in detail_html])
+    for name in scraper.available_parsers():
+        result[f"detail_{name}"] = timed(
+            lambda h, i, name=name: scraper.parse_school_details(h, i, name),
+            [(h, i) for i, h in detail_html],
+        )
+    return result
+
+
+def traced_bytes(build):
+    """build() 回傳的資料在 tracemalloc 下新增的記憶體 (位元組)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        data = build()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0], data
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(site, samples):
+    """
+    每間補習班 (含其科目與交通車) 常駐記憶體的位元組數：
+    typed 為 parse_list_page / parse_school_details 產生的 School、Subject、Vehicle；
+    dict 為舊版每列一個 dict、每個值一個獨立字串的表示法 (由同一批資料經 JSON 來回轉換產生)。
+    """
+    pages = [site.list_page(p) for p in range(1, math.ceil(min(site.schools, samples) / ITEMS_PER_PAGE) + 1)]
+
+    def typed():
+        records = []
+        for html in pages:
+            for item in scraper.parse_list_page(html):
+                info, subjects, vehicles = scraper.parse_school_details(site.detail_page(item['補習班代碼']),
+                                                                        item['補習班代碼'])
+                item.update(info)
+                records.append((item, subjects, vehicles))
+        return records
+
+    typed_bytes, records = traced_bytes(typed)
+    text = json.dumps(records, ensure_ascii=False, default=dict)
+    dict_bytes, _ = traced_bytes(lambda: json.loads(text))
+    n = len(records)
+    return {
+        'records': n,
+        'dict': round(dict_bytes / n),
+        'typed': round(typed_bytes / n),
+        'ratio': round(dict_bytes / typed_bytes, 2),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以本機模擬網站量測抓取與解析效能")
+    parser.add_argument('--schools', type=int, default=26000, help="模擬網站的補習班數 (預設 26000)")
+    parser.add_argument('--workers', type=int, default=16, help="平行模式的 worker 數 (預設 16)")
+    parser.add_argument('--latency', type=float, default=0.0, help="每個請求的平均延遲 (毫秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="延遲的隨機抖動幅度 (毫秒)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="回應 HTTP 500 的比例 (0~1)")
+    parser.add_argument('--cookie-budget', type=int, default=0,
+                        help="每個模擬 TS cookie 可用的請求數，用完後回應驗證頁 (預設 0 表示不模擬)")
+    parser.add_argument('--seed', type=int, default=0, help="亂數種子，固定後結果可重現")
+    parser.add_argument('--parse-procs', type=int, default=os.cpu_count() or 1,
+                        help="procs 模式的解析子行程數 (預設為 CPU 核心數)")
+    parser.add_argument('--modes', default='serial,concurrent,cached',
+                        help="要量測的抓取模式，以逗號分隔 (serial, concurrent, procs, cached)")
+    parser.add_argument('--parse-samples', type=int, default=200, help="解析量測使用的頁數")
+    parser.add_argument('--parse-repeat', type=int, default=3, help="解析量測重複次數")
+    parser.add_argument('--memory-samples', type=int, default=3000, help="記憶體量測使用的補習班數")
+    parser.add_argument('--output', help="另將 JSON 結果寫入此檔案")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    site = SyntheticSite(args.schools, args.seed)
+    server = SiteServer(site, args.latency, args.jitter, args.error_rate, args.seed, args.cookie_budget).start()
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'parse_ms_per_page': bench_parsers(site, args.parse_samples, args.parse_repeat),
+        'crawl': {},
+    }
+    print(f"解析時間 (ms/頁): {report['parse_ms_per_page']}")
+    report['memory_bytes_per_record'] = bench_memory(site, args.memory_samples)
+    print(f"每間補習班的記憶體 (位元組): {report['memory_bytes_per_record']}")
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        for mode in modes:
+            if mode == 'serial':
+                result = run_crawl(server, workdir, ['--workers', '1', '--rps', '0'])
+            elif mode == 'concurrent':
+                result = run_crawl(server, workdir, ['--workers', str(args.workers), '--rps', '0'])
+            elif mode == 'procs':
+                result = run_crawl(server, workdir, ['--workers', str(args.workers), '--rps', '0',
+                                                     '--parse-procs', str(args.parse_procs)])
+            elif mode == 'cached':
+                # 先以快取模式抓取一次暖機，再量測全部命中快取的第二次抓取
+                cache_args = ['--workers', str(args.workers), '--rps', '0', '--cache']
+                run_crawl(server, workdir, cache_args)
+                result = run_crawl(server, workdir, cache_args)
+            else:
+                print(f"未知的模式: {mode}")
+                continue
+            report['crawl'][mode] = result
+            print(f"{mode}: {result}")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == "__main__":
+    main()
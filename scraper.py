@@ -1,11 +1,56 @@
 import requests
 from bs4 import BeautifulSoup
 import math
+import datetime
+import random
 import time
 import csv
+import sqlite3
 import re
 import os
+import sys
+import subprocess
+import json
+import zlib
+import gzip
+import hashlib
+import argparse
+import itertools
+import shutil
+import functools
+import threading
+import queue
+from contextlib import contextmanager, ExitStack
+import heapq
+import bisect
+from array import array
+from collections import Counter, deque, namedtuple
+from collections.abc import MutableMapping
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import urllib3
+from urllib.parse import urlencode, urlsplit, unquote, parse_qs
+from email.utils import parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from requests.adapters import HTTPAdapter
+
+# 選用的快速 HTML 解析後端
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# 選用的 Parquet 輸出
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 # 關閉 SSL 警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -14,11 +59,206 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 BASE_URL = "https://bsb.kh.edu.tw/"
 SHOWPAGE_URL = "https://bsb.kh.edu.tw/showpage.jsp"
 DETAIL_URL = "https://bsb.kh.edu.tw/detail.jsp"
+# 參考 backup/get.py：先以 usercity 選定縣市，列印頁會一次回傳該縣市的完整列表
+CITY_URL = "https://bsb.kh.edu.tw/afterschool/"
+PRINT_SHOWPAGE_URL = "https://bsb.kh.edu.tw/afterschool/register/print_showpage.jsp"
+# 參考 backup/city_m_all.py：各縣市的開放資料 JSON
+OPENDATA_URL = "https://bsb.kh.edu.tw/afterschool/opendata/afterschool_json.jsp"
+# 參考 backup/cancel_list.py：廢止／註銷名單 (查詢頁與列印頁)
+CANCEL_LIST_URL = "https://bsb.kh.edu.tw/afterschool/register/cancel_list_b.jsp"
+CANCEL_PRINT_URL = "https://bsb.kh.edu.tw/afterschool/register/print_cancel_list_b.jsp"
+
+def configure_base_url(base_url):
+    """切換來源網站 (例如本機的基準測試伺服器)"""
+    global BASE_URL, SHOWPAGE_URL, DETAIL_URL, CITY_URL, PRINT_SHOWPAGE_URL, OPENDATA_URL
+    global CANCEL_LIST_URL, CANCEL_PRINT_URL
+    BASE_URL = base_url.rstrip('/') + '/'
+    SHOWPAGE_URL = BASE_URL + "showpage.jsp"
+    DETAIL_URL = BASE_URL + "detail.jsp"
+    CITY_URL = BASE_URL + "afterschool/"
+    PRINT_SHOWPAGE_URL = BASE_URL + "afterschool/register/print_showpage.jsp"
+    OPENDATA_URL = BASE_URL + "afterschool/opendata/afterschool_json.jsp"
+    CANCEL_LIST_URL = BASE_URL + "afterschool/register/cancel_list_b.jsp"
+    CANCEL_PRINT_URL = BASE_URL + "afterschool/register/print_cancel_list_b.jsp"
+
+# 縣市代碼 (與 backup/ 中的 county_list 相同，名稱採列表頁顯示的寫法)；補習班代碼的前兩碼即為縣市代碼
+COUNTIES = {
+    "臺北市": 20, "新北市": 21, "桃園市": 33, "臺中市": 42, "臺南市": 62, "高雄市": 70,
+    "基隆市": 24, "新竹市": 35, "新竹縣": 36, "苗栗縣": 37, "彰化縣": 47, "南投縣": 49,
+    "雲林縣": 55, "嘉義市": 52, "嘉義縣": 53, "屏東縣": 87, "宜蘭縣": 39, "花蓮縣": 38,
+    "臺東縣": 89, "澎湖縣": 69, "金門縣": 82, "連江縣": 83
+}
 
 # 輸出檔案
 FILE_SCHOOLS = "schools.csv"
 FILE_SUBJECTS = "subjects.csv"
 FILE_VEHICLES = "vehicles.csv"
+FILE_JOURNAL = "crawl.journal"
+FILE_DEAD_LETTER = "dead_letter.jsonl"
+
+# 分片抓取：每個縣市一個分片，輸出於 <SHARD_DIR>/<縣市代碼>/，完成狀態記錄在分片內的 manifest
+SHARD_DIR = "shards"
+FILE_MANIFEST = "manifest.json"
+
+# 篩選抓取：命令列參數 → showpage.jsp 的查詢條件；結果預設輸出於 <FILTER_DIR>/，使用的條件記錄在 FILE_FILTERS
+LIST_FILTERS = {
+    'name': 'p_name', 'area': 'p_area', 'road': 'p_road',
+    'since': 'start_date', 'until': 'end_date', 'type': 'p_type', 'c_type': 'c_type',
+}
+FILTER_DIR = "partial"
+FILE_FILTERS = "filters.json"
+
+def configure_output_dir(directory):
+    """將輸出檔、journal、dead letter、manifest 與篩選條件檔移到指定目錄 (例如分片目錄)"""
+    global FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES, FILE_JOURNAL, FILE_DEAD_LETTER, FILE_MANIFEST, FILE_FILTERS
+    os.makedirs(directory, exist_ok=True)
+    FILE_SCHOOLS = os.path.join(directory, "schools.csv")
+    FILE_SUBJECTS = os.path.join(directory, "subjects.csv")
+    FILE_VEHICLES = os.path.join(directory, "vehicles.csv")
+    FILE_JOURNAL = os.path.join(directory, "crawl.journal")
+    FILE_DEAD_LETTER = os.path.join(directory, "dead_letter.jsonl")
+    FILE_MANIFEST = os.path.join(directory, "manifest.json")
+    FILE_FILTERS = os.path.join(directory, "filters.json")
+
+# 增量模式：上一次的輸出會先更名保存為 *.prev.csv 作為比對基準
+PREV_SUFFIX = ".prev"
+
+# 列表頁即可取得、用來判斷補習班是否有異動的欄位
+LIST_FIELDS = ['補習班名稱', '班址', '電話', '立案文號', '立案日期']
+
+# CSV 欄位
+HEADER_SCHOOLS = [
+    '縣市', '補習班名稱', '補習班代碼', '主管機關文件單位代碼', '補習班類別/科目',
+    '班址', '電話', '傳真號碼', '電子郵件', '立案情形', '立案文號', '立案日期',
+    '教室數', '飲用水設備維護管理', '教室面積', '班舍總面積',
+    '停辦文號', '停辦生效日', '停辦截止日',
+    '負責人姓名', '設立人姓名', '班主任'
+]
+HEADER_SUBJECTS = ['補習班代碼', '核准科目名稱', '核准班級數', '每班核准人數', '每週總節(時)數', '修業期限', '招生對象']
+HEADER_VEHICLES = ['補習班代碼', '牌照號碼', '備查文號', '備查日期']
+
+# 變動歷史：每月一個分割區 (<HISTORY_DIR>/YYYY-MM/)，內含當月第一次記錄時的完整快照與之後各次的差異
+HISTORY_DIR = "history"
+
+# 統計：多值欄位 (如「文理類,其他類」) 的分隔字元，以及各表預設列出的名次數
+MULTI_VALUE_RE = re.compile(r'\s*[,，]\s*')
+STATS_TOP = {'categories': 10, 'subjects': 20, 'counties': 22, 'years': 10, 'vehicles': 10}
+README_STATS_HEADING = "## 資料統計摘要"
+
+# 查詢服務：分頁大小、預設埠號，以及偵測新一次抓取完成的輪詢間隔 (秒)
+QUERY_PAGE_SIZE = 20
+QUERY_MAX_PAGE_SIZE = 200
+QUERY_PORT = 8730
+QUERY_RELOAD_INTERVAL = 10.0
+QUERY_CACHE_SIZE = 256
+
+# 廢止／註銷名單：輸出欄位 (列印頁的 序號 不保留)，以及各縣市已抓取到的月份
+FILE_CANCELLATIONS = "cancellations.csv"
+FILE_CANCEL_STATE = "cancellations.state.json"
+HEADER_CANCELLATIONS = [
+    '補習班代碼', '縣市', '補習班', '設立人', '班主任', '班址', '電話',
+    '廢止/註銷', '發文日期', '廢止/註銷文號', '廢止/註銷日期'
+]
+# 同一筆廢止／註銷的識別欄位；重疊的月份區間重抓時據此去除重複
+CANCEL_KEY = ('縣市', '補習班', '廢止/註銷文號', '廢止/註銷日期')
+# 第一次執行且未指定 --since 時的起始月份 (同 backup/cancel_list.py)
+CANCEL_START = "2024-08"
+
+# showpage.jsp 每頁筆數
+ITEMS_PER_PAGE = 15
+
+# Parquet 輸出：每累積這麼多列寫出一個 row group
+PARQUET_BATCH_ROWS = 8192
+PARQUET_DIR = "parquet"
+
+# SQLite 輸出：每累積這麼多間補習班提交一次交易
+SQLITE_BATCH = 500
+SQLITE_PATH = "schools.db"
+
+# 併發設定：預設單執行緒，並以全域每秒請求數上限保護來源網站
+DEFAULT_WORKERS = 1
+DEFAULT_RPS = 4.0
+
+# 自適應速率 (AIMD)：回應正常時每秒最多增加 RPS_INCREASE，出錯或延遲暴增時速率減半
+DEFAULT_MIN_RPS = 0.5
+DEFAULT_MAX_RPS = 16.0
+RPS_INCREASE = 0.5
+RPS_DECREASE = 0.5
+LATENCY_SPIKE = 3.0
+
+# 重試：指數退避加隨機抖動，並尊重伺服器的 Retry-After
+DEFAULT_RETRIES = 4
+DEFAULT_TIMEOUT = 30
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# 詳細頁欄位：key 為 HTML 中的 headers id，value 為輸出欄位名
+DETAIL_FIELDS = {
+    'th-sqnum': '主管機關文件單位代碼',
+    'th-cataname': '補習班類別/科目',
+    'th-legaltype': '立案情形',
+    'th-fax': '傳真號碼',
+    'th-email': '電子郵件',
+    'th-roomcount': '教室數',
+    'th-water': '飲用水設備維護管理',
+    'th-roomarea': '教室面積',
+    'th-schoolarea': '班舍總面積',
+    'th-shutnumber': '停辦文號',
+    'th-shutexpire': '停辦生效日',
+    'th-shutclosure': '停辦截止日',
+    'th-incharge': '負責人姓名',
+    'th-establish': '設立人姓名',
+    'th-director': '班主任',
+}
+SUBJECT_FIELDS = {
+    'th-course-name': '核准科目名稱',
+    'th-allow-class': '核准班級數',
+    'th-allow-person': '每班核准人數',
+    'th-lesson-total': '每週總節(時)數',
+    'th-study-period': '修業期限',
+    'th-allow-recruiter': '招生對象'
+}
+VEHICLE_FIELDS = {
+    'th-permit-id': '牌照號碼',
+    'th-approve-doc': '備查文號',
+    'th-approve-date': '備查日期'
+}
+# 開放資料 JSON 可提供的欄位：key 為 JSON 欄位名，value 為輸出欄位名
+# (地區縣市 與列表頁的 縣市 重複且寫法可能不同，例如「台」/「臺」，因此不採用)
+OPENDATA_FIELDS = {
+    '電子郵件': '電子郵件',
+    '短期補習班類別': '補習班類別/科目',
+}
+OPENDATA_NAME = '短期補習班名稱'
+SUBJECT_CAPTION = "核准科目資料"
+VEHICLE_CAPTION = "交通車資料"
+
+# 詳細頁解析後端：auto 依序選用 lxml、selectolax，皆未安裝時退回 html.parser
+PARSER_BACKENDS = ('lxml', 'selectolax', 'html.parser')
+DEFAULT_PARSER = 'auto'
+
+# 回應快取：依端點設定存活時間 (秒)，未列出的端點 (如首頁) 不快取
+CACHE_DIR = ".http_cache"
+CACHE_TTL = {
+    'showpage.jsp': 6 * 3600,
+    'print_showpage.jsp': 6 * 3600,
+    'detail.jsp': 7 * 24 * 3600,
+    'afterschool_json.jsp': 6 * 3600,
+    'print_cancel_list_b.jsp': 6 * 3600,
+}
+CACHE_MAX_MB = 2048
+
+# 各端點正常回應必定含有的結構標記 (以 bytes 比對，不需解析)；缺少時視為反爬蟲驗證頁或錯誤頁。
+# 未列出的端點 (首頁、開放資料 JSON) 不檢查
+PAGE_MARKERS = {
+    'showpage.jsp': b'result-list',
+    'detail.jsp': b'th-sqnum',
+    'print_showpage.jsp': '補習班名稱'.encode('utf-8'),
+    'print_cancel_list_b.jsp': '廢止/註銷'.encode('utf-8'),
+}
+# 未指定 --sessions 時的 Session 數 (不超過 worker 數)
+DEFAULT_SESSIONS = 4
 
 # 參考 backup/get.py 的完整 Headers
 HEADERS = {
@@ -39,27 +279,706 @@ HEADERS = {
     'sec-ch-ua-platform': '"macOS"',
 }
 
-def get_session():
-    """建立並初始化 Session"""
-    session = requests.Session()
+# 延遲直方圖的上界 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# ETA 以最近這段時間 (秒) 的完成速度估算
+ETA_WINDOW = 60.0
+
+class Histogram:
+    """固定區間的延遲直方圖，可估算百分位數"""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(LATENCY_BUCKETS) and value > LATENCY_BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """以所在區間的上界估計百分位數 (不超過實際最大值)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+class Metrics:
+    """
+    抓取過程的效能指標：各階段延遲直方圖、傳輸位元組數、依錯誤型別分類的錯誤數，以及滾動 ETA。
+    可輸出 JSON 摘要與 Prometheus textfile (供 node_exporter 的 textfile collector 收集)。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.bytes = {}
+        self.errors = {}
+        self.counters = {}
+        self.samples = deque()
+        self.done = 0
+        self.total = 0
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error(stage, e)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.observe(seconds)
+
+    def error(self, stage, exc):
+        key = (stage, type(exc).__name__)
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def add_bytes(self, endpoint, n):
+        with self.lock:
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + n
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def progress(self, done, total=None):
+        """更新完成數，並保留 ETA_WINDOW 秒內的取樣點用於估算速度"""
+        now = time.monotonic()
+        with self.lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            self.samples.append((now, done))
+            while len(self.samples) > 2 and now - self.samples[0][0] > ETA_WINDOW:
+                self.samples.popleft()
+
+    def rate(self):
+        with self.lock:
+            if len(self.samples) < 2:
+                return 0.0
+            (t0, d0), (t1, d1) = self.samples[0], self.samples[-1]
+        return (d1 - d0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def eta(self):
+        """剩餘秒數；速度未知時回傳 None"""
+        rate = self.rate()
+        if rate <= 0 or not self.total:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def summary(self):
+        with self.lock:
+            stages = {
+                name: {
+                    'count': h.count,
+                    'total_s': round(h.total, 3),
+                    'mean_ms': round(h.total / h.count * 1000, 2) if h.count else 0.0,
+                    'p50_ms': round(h.quantile(0.5) * 1000, 2),
+                    'p90_ms': round(h.quantile(0.9) * 1000, 2),
+                    'p99_ms': round(h.quantile(0.99) * 1000, 2),
+                    'max_ms': round(h.max * 1000, 2),
+                }
+                for name, h in self.stages.items()
+            }
+            errors = {f"{stage}:{kind}": n for (stage, kind), n in self.errors.items()}
+            result = {
+                'elapsed_s': round(time.time() - self.started, 3),
+                'done': self.done,
+                'total': self.total,
+                'stages': stages,
+                'bytes': dict(self.bytes),
+                'errors': errors,
+                'counters': dict(self.counters),
+            }
+        result['rate_per_s'] = round(self.rate(), 3)
+        eta = self.eta()
+        result['eta_s'] = round(eta, 1) if eta is not None else None
+        return result
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            lines += ['# HELP scraper_stage_seconds Latency of each crawl stage.',
+                      '# TYPE scraper_stage_seconds histogram']
+            for name, h in sorted(self.stages.items()):
+                seen = 0
+                for bound, n in zip(LATENCY_BUCKETS, h.counts):
+                    seen += n
+                    lines.append(f'scraper_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {seen}')
+                lines.append(f'scraper_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'scraper_stage_seconds_sum{{stage="{name}"}} {h.total:.6f}')
+                lines.append(f'scraper_stage_seconds_count{{stage="{name}"}} {h.count}')
+            lines += ['# HELP scraper_bytes_total Response bytes received per endpoint.',
+                      '# TYPE scraper_bytes_total counter']
+            for endpoint, n in sorted(self.bytes.items()):
+                lines.append(f'scraper_bytes_total{{endpoint="{endpoint}"}} {n}')
+            lines += ['# HELP scraper_errors_total Errors per stage and exception type.',
+                      '# TYPE scraper_errors_total counter']
+            for (stage, kind), n in sorted(self.errors.items()):
+                lines.append(f'scraper_errors_total{{stage="{stage}",type="{kind}"}} {n}')
+            lines += ['# HELP scraper_events_total Miscellaneous crawl events.',
+                      '# TYPE scraper_events_total counter']
+            for name, n in sorted(self.counters.items()):
+                lines.append(f'scraper_events_total{{event="{name}"}} {n}')
+            lines += ['# TYPE scraper_schools_done gauge', f'scraper_schools_done {self.done}',
+                      '# TYPE scraper_schools_total gauge', f'scraper_schools_total {self.total}',
+                      '# TYPE scraper_started_timestamp_seconds gauge',
+                      f'scraper_started_timestamp_seconds {self.started:.0f}']
+        eta = self.eta()
+        lines += ['# TYPE scraper_rate_per_second gauge', f'scraper_rate_per_second {self.rate():.3f}',
+                  '# TYPE scraper_eta_seconds gauge', f'scraper_eta_seconds {eta if eta is not None else -1:.1f}']
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        _write_text_atomic(path, json.dumps(self.summary(), ensure_ascii=False, indent=2) + '\n')
+
+    def write_prometheus(self, path):
+        _write_text_atomic(path, self.prometheus())
+
+def _write_text_atomic(path, text):
+    # textfile collector 可能隨時讀取，先寫暫存檔再更名
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def timed(stage):
+    """以 METRICS 記錄函式執行時間的裝飾器"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# 全域指標，由各熱點函式共用
+METRICS = Metrics()
+
+class RateLimiter:
+    """全域請求速率限制器：跨執行緒共用，確保每秒請求數不超過 rps"""
+
+    def __init__(self, rps):
+        self.interval = 1.0 / rps if rps and rps > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_time, now)
+            self.next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    AIMD 自適應速率限制器。
+    回應正常且延遲未暴增時逐步提高速率 (加法增加，約每秒 +RPS_INCREASE)；
+    遇到錯誤、可重試的狀態碼或延遲超過基準 LATENCY_SPIKE 倍時速率減半 (乘法減少)，
+    並可依 Retry-After 暫停所有請求。
+    """
+
+    def __init__(self, rps, min_rps=DEFAULT_MIN_RPS, max_rps=DEFAULT_MAX_RPS):
+        super().__init__(rps)
+        self.rps = rps
+        self.min_rps = min(min_rps, rps)
+        self.max_rps = max(max_rps, rps)
+        self.baseline = None
+        self.last_decrease = 0.0
+
+    def _set_rate(self, rps):
+        self.rps = min(max(rps, self.min_rps), self.max_rps)
+        self.interval = 1.0 / self.rps
+
+    def on_success(self, latency):
+        with self.lock:
+            if self.baseline is None:
+                self.baseline = latency
+            spike = latency > self.baseline * LATENCY_SPIKE
+            # 以指數移動平均追蹤正常延遲，延遲暴增時不納入基準
+            if not spike:
+                self.baseline = self.baseline * 0.9 + latency * 0.1
+        if spike:
+            self.on_error()
+            return
+        with self.lock:
+            self._set_rate(self.rps + RPS_INCREASE / self.rps)
+
+    def on_error(self, retry_after=None):
+        now = time.monotonic()
+        with self.lock:
+            # 同一波錯誤在一個請求間隔內只減速一次，避免速率瞬間崩到最低
+            if now - self.last_decrease >= max(self.interval, 1.0):
+                self._set_rate(self.rps * RPS_DECREASE)
+                self.last_decrease = now
+            if retry_after:
+                self.next_time = max(self.next_time, now + retry_after)
+
+    def current_rps(self):
+        return self.rps
+
+def build_limiter(rps, min_rps=DEFAULT_MIN_RPS, max_rps=DEFAULT_MAX_RPS):
+    """rps 為 0 時不限速；max_rps 大於 rps 時使用自適應速率，否則固定速率"""
+    if not rps or rps <= 0:
+        return None
+    if max_rps and max_rps > rps:
+        return AdaptiveRateLimiter(rps, min_rps, max_rps)
+    return RateLimiter(rps)
+
+def parse_retry_after(value):
+    """Retry-After 可為秒數或 HTTP 日期，回傳秒數"""
+    if not value:
+        return None
     try:
-        session.get(BASE_URL, headers=HEADERS, verify=False)
-    except Exception as e:
-        print(f"Error initializing session: {e}")
-    return session
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """指數退避加上完整抖動 (full jitter)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class CacheMiss(Exception):
+    """離線模式下快取中沒有對應的回應"""
+
+class InterstitialError(requests.RequestException):
+    """重新暖機後仍收到缺少結構標記的頁面 (反爬蟲驗證頁、錯誤頁或 TS cookie 失效)"""
+
+def is_expected_page(url, content):
+    """回應內容是否含有該端點的結構標記 (見 PAGE_MARKERS)"""
+    marker = PAGE_MARKERS.get(os.path.basename(urlsplit(url).path))
+    return marker is None or marker in content
+
+class CachedResponse:
+    """由快取內容重建、介面與 requests.Response 相容的回應物件"""
+
+    def __init__(self, url, content, encoding, headers=None):
+        self.url = url
+        self.status_code = 200
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers or {}
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        pass
+
+class ResponseCache:
+    """
+    以 URL + 參數為鍵的磁碟回應快取。
+    內容以 zlib 壓縮存放於 <dir>/<key 前兩碼>/<key>.body，中繼資料 (抓取時間、ETag、Last-Modified) 存於 .json。
+    總大小超過上限時，依最後使用時間淘汰最舊的項目。
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=None, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.ttl = dict(CACHE_TTL if ttl is None else ttl)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+
+    def ttl_for(self, url):
+        """回傳端點的存活時間；None 表示此端點不快取"""
+        return self.ttl.get(os.path.basename(urlsplit(url).path))
+
+    def key(self, url, params):
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        return hashlib.sha256(f"{url}?{query}".encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key[:2], key)
+        return base + '.body', base + '.json'
+
+    def get(self, key):
+        """回傳 (meta, content)；不存在或損毀時回傳 None"""
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                content = zlib.decompress(f.read())
+        except (OSError, ValueError, zlib.error):
+            return None
+        try:
+            # 更新最後使用時間供淘汰排序；唯讀的快取 (例如 --offline 讀取他人共用的目錄) 照常使用
+            os.utime(body_path)
+        except OSError:
+            pass
+        return meta, content
+
+    def is_fresh(self, url, meta):
+        ttl = self.ttl_for(url)
+        return ttl is not None and time.time() - meta['fetched_at'] < ttl
+
+    def put(self, key, url, params, response):
+        body_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        blob = zlib.compress(response.content, 6)
+        meta = {
+            'url': url,
+            'params': params or {},
+            'fetched_at': time.time(),
+            'encoding': response.encoding,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        self._write_atomic(body_path, blob)
+        self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        self._account(len(blob))
+
+    def refresh(self, key, meta):
+        """條件式請求得到 304 時，更新抓取時間以延長存活"""
+        meta['fetched_at'] = time.time()
+        _, meta_path = self._paths(key)
+        self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def _write_atomic(self, path, data):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _account(self, added):
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self.total_bytes += added
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """列出所有 (body_path, size, 最後使用時間)"""
+        if not os.path.isdir(self.directory):
+            return
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.body'):
+                    st = entry.stat()
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def _evict(self):
+        # 淘汰到上限的 90%，避免每次寫入都觸發掃描
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(self._scan(), key=lambda e: e[2]):
+            if self.total_bytes <= target:
+                break
+            for victim in (path, path[:-len('.body')] + '.json'):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            self.total_bytes -= size
+
+class ScraperSession(requests.Session):
+    """
+    每次送出請求前先經過 RateLimiter 的 Session。
+    設定 cache 時，GET 請求會優先使用未過期的快取；過期但有 ETag/Last-Modified 者改送條件式請求。
+    offline 模式只讀快取，完全不連網。
+    200 回應在寫入快取前先比對 PAGE_MARKERS；拿到驗證頁時清除 cookie 重新暖機再送一次。
+    """
+
+    def __init__(self, limiter=None, cache=None, offline=False, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.limiter = limiter
+        self.cache = cache
+        self.offline = offline
+        self.retries = retries
+        self.timeout = timeout
+        # 暖機時依序造訪的網址 (首頁之外，例如建立伺服器端狀態的查詢頁)
+        self.warmup = []
+        self.generation = 0
+        self.warm_lock = threading.Lock()
+
+    def warm(self):
+        """清除 cookie 後重新造訪首頁與 warmup 網址，取得新的 TS cookie"""
+        self.cookies.clear()
+        for url in [BASE_URL] + self.warmup:
+            self._send('GET', url, headers=HEADERS, verify=False)
+        self.generation += 1
+
+    def add_warmup(self, url):
+        """加入暖機網址並立即造訪一次"""
+        self.warmup.append(url)
+        if not self.offline:
+            self._send('GET', url, headers=HEADERS, verify=False)
+
+    def rewarm(self, generation):
+        """
+        回應驗證失敗時重新暖機。多個執行緒同時失敗只需暖機一次：
+        送出請求後 generation 已改變者表示其他執行緒已重新暖機，直接重送即可。
+        """
+        with self.warm_lock:
+            if self.generation != generation:
+                return
+            METRICS.incr('session_rewarm')
+            try:
+                self.warm()
+            except requests.RequestException as e:
+                METRICS.error('http', e)
+                self.generation += 1
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        cache = self.cache
+        if method.upper() != 'GET' or cache is None or (cache.ttl_for(url) is None and not self.offline):
+            return self._send(method, url, params=params, headers=headers, **kwargs)
+
+        key = cache.key(url, params)
+        cached = cache.get(key)
+        if self.offline:
+            if cached is None:
+                raise CacheMiss(f"{url} {params}")
+            meta, content = cached
+            METRICS.incr('cache_hit')
+            return CachedResponse(url, content, meta['encoding'])
+        if cached and cache.is_fresh(url, cached[0]):
+            meta, content = cached
+            METRICS.incr('cache_hit')
+            return CachedResponse(url, content, meta['encoding'])
+
+        headers = dict(headers or {})
+        if cached:
+            meta = cached[0]
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        response = self._send(method, url, params=params, headers=headers, **kwargs)
+        if cached and response.status_code == 304:
+            meta, content = cached
+            METRICS.incr('cache_revalidated')
+            cache.refresh(key, meta)
+            return CachedResponse(url, content, meta['encoding'])
+        if response.status_code == 200:
+            METRICS.incr('cache_miss')
+            cache.put(key, url, params, response)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        """
+        送出請求；連線錯誤、逾時與可重試的狀態碼 (429/5xx) 以指數退避重試，
+        並把延遲與錯誤回饋給自適應速率限制器。重試用盡時回傳最後的回應或拋出最後的例外。
+        缺少結構標記的 200 回應重新暖機後重送一次，仍失敗時拋出 InterstitialError。
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        limiter = self.limiter
+        adaptive = isinstance(limiter, AdaptiveRateLimiter)
+        attempt = 0
+        rewarmed = False
+        while True:
+            if limiter:
+                with METRICS.timer('rate_limit_wait'):
+                    limiter.wait()
+            generation = self.generation
+            start = time.monotonic()
+            try:
+                response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                METRICS.error('http', e)
+                if adaptive:
+                    limiter.on_error()
+                if attempt >= self.retries:
+                    raise
+                retry_after = None
+            else:
+                if response.status_code == 200 and not is_expected_page(url, response.content):
+                    METRICS.incr('interstitial')
+                    if adaptive:
+                        limiter.on_error()
+                    if rewarmed:
+                        raise InterstitialError(f"{url} 回應缺少預期的頁面結構", response=response)
+                    self.rewarm(generation)
+                    rewarmed = True
+                    continue
+                if response.status_code not in RETRY_STATUS:
+                    if adaptive:
+                        limiter.on_success(time.monotonic() - start)
+                    return response
+                METRICS.incr(f"http_{response.status_code}")
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if adaptive:
+                    limiter.on_error(retry_after)
+                if attempt >= self.retries:
+                    return response
+            METRICS.incr('retry')
+            delay = backoff_delay(attempt)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            time.sleep(delay)
+            attempt += 1
+
+class SessionPool:
+    """
+    多個各自暖機 (各有 TS cookie 與 keep-alive 連線池) 的 ScraperSession，共用速率限制器與快取。
+    每個執行緒固定使用其中一個，重用連線並保留伺服器端 session 狀態 (如列印頁前選定的縣市)；
+    某個 Session 重新暖機後仍拿到驗證頁時，該執行緒改用下一個。介面與 ScraperSession 相同。
+    """
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.local = threading.local()
+        self.assign = itertools.count()
+
+    def _index(self):
+        index = getattr(self.local, 'index', None)
+        if index is None:
+            index = self.local.index = next(self.assign) % len(self.sessions)
+        return index
+
+    def request(self, method, url, **kwargs):
+        index = self._index()
+        for tried in range(len(self.sessions)):
+            try:
+                return self.sessions[index].request(method, url, **kwargs)
+            except InterstitialError:
+                if tried == len(self.sessions) - 1:
+                    raise
+                METRICS.incr('session_rotate')
+                index = self.local.index = (index + 1) % len(self.sessions)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def add_warmup(self, url):
+        for session in self.sessions:
+            session.add_warmup(url)
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+def get_session(workers=DEFAULT_WORKERS, rps=None, cache=None, offline=False,
+                max_rps=None, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT, sessions=1):
+    """
+    建立並暖機 Session。sessions > 1 時回傳 SessionPool，
+    每個 Session 的連線池只需容納分配到它的執行緒 (worker 數 / Session 數，加上主執行緒)。
+    """
+    limiter = build_limiter(rps, max_rps=max_rps)
+    count = 1 if offline else max(1, min(sessions, workers))
+    pool = []
+    for _ in range(count):
+        session = ScraperSession(limiter, cache, offline, retries, timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=math.ceil(workers / count) + 1)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not offline:
+            try:
+                session.warm()
+            except Exception as e:
+                print(f"Error initializing session: {e}")
+        pool.append(session)
+    return pool[0] if count == 1 else SessionPool(pool)
+
+def bounded(iterable, maxsize):
+    """
+    在背景執行緒消耗 iterable，經由最多 maxsize 筆的佇列逐一交給呼叫端。
+    佇列滿時生產端會暫停 (backpressure)；呼叫端提前結束時通知生產端停止，生產端的例外會在呼叫端重新拋出。
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                items.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        error = None
+        try:
+            for value in iterable:
+                if not put((None, value)):
+                    return
+        except BaseException as e:
+            error = e
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close:
+                close()
+        put((error, end))
 
-def get_page_content(session, page_num):
-    """抓取指定頁面的內容"""
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            error, value = items.get()
+            if value is end:
+                if error:
+                    raise error
+                return
+            yield value
+    finally:
+        stop.set()
+
+def ordered_map(executor, func, iterable, window):
+    """
+    以有界視窗將 func 平行提交至 executor，並依輸入順序逐一回傳結果。
+    window 限制同時在途的工作數，避免一次把所有請求排進佇列。
+    """
+    pending = deque()
+    for arg in iterable:
+        pending.append(executor.submit(func, arg))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def get_page_content(session, page_num, filters=None):
+    """抓取指定頁面的內容；filters 可覆寫查詢條件 (如 p_city、p_name)"""
     params = {
         'pageno': page_num,
         'l': 0, 'p_name': '', 'p_area': '', 'p_road': '',
         'start_date': '', 'end_date': '', 'p_type': '', 'c_type': '',
         'p_city': 'all', 'm': 1
     }
-    
+    if filters:
+        params.update(filters)
+
     try:
-        response = session.get(SHOWPAGE_URL, params=params, headers=HEADERS, verify=False)
-        response.raise_for_status()
+        with METRICS.timer('fetch_list'):
+            response = session.get(SHOWPAGE_URL, params=params, headers=HEADERS, verify=False)
+            response.raise_for_status()
+        METRICS.add_bytes('showpage.jsp', len(response.content))
         return response.text
     except Exception as e:
         print(f"Error fetching page {page_num}: {e}")
@@ -120,62 +1039,253 @@ def parse_detail_table(soup, school_id, caption_text, headers_map):
             
     return results
 
-def get_school_details(session, school_id):
-    """抓取並解析詳細資料頁面，回傳 (info, subjects, vehicles)"""
+def parse_school_details_legacy(html_content, school_id):
+    """逐欄位以 soup.find 查找的原始解析方式，作為各解析後端的比對基準"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    info = {field: get_text_by_headers(soup, header_id) for header_id, field in DETAIL_FIELDS.items()}
+    subjects = parse_detail_table(soup, school_id, SUBJECT_CAPTION, SUBJECT_FIELDS)
+    vehicles = parse_detail_table(soup, school_id, VEHICLE_CAPTION, VEHICLE_FIELDS)
+    return info, subjects, vehicles
+
+class HeadersIndex:
+    """
+    headers id → 文字 的索引，語意與 get_text_by_headers 相同：
+    優先取第一個帶有該 id 的 td，沒有 td 才取 th；headers 屬性可含多個以空白分隔的 id。
+    """
+
+    __slots__ = ('td', 'th')
+
+    def __init__(self):
+        self.td = {}
+        self.th = {}
+
+    def add(self, tag, headers, text_fn):
+        slot = self.td if tag == 'td' else self.th
+        text = None
+        for header_id in headers.split():
+            if header_id not in slot:
+                if text is None:
+                    text = text_fn()
+                slot[header_id] = text
+
+    def get(self, header_id):
+        if header_id in self.td:
+            return self.td[header_id]
+        return self.th.get(header_id, "")
+
+class DetailDoc:
+    """
+    詳細頁的解析結果：整頁的 HeadersIndex，以及 (caption 文字, table) 清單。
+    rows_fn(table) 回傳該表 tbody 內每列的 (列文字, HeadersIndex)，沒有 tbody 時回傳 None。
+    """
+
+    def __init__(self, cells, tables, rows_fn):
+        self.cells = cells
+        self.tables = tables
+        self.rows_fn = rows_fn
+
+    def rows(self, caption_text):
+        for cap_text, table in self.tables:
+            if cap_text is not None and caption_text in cap_text:
+                return self.rows_fn(table) or []
+        return []
+
+def _detail_doc_bs4(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    def index(scope):
+        idx = HeadersIndex()
+        for el in scope.find_all(['td', 'th'], headers=True):
+            headers = el['headers']
+            if not isinstance(headers, str):
+                headers = ' '.join(headers)
+            idx.add(el.name, headers, lambda: el.get_text(strip=True))
+        return idx
+
+    def rows_fn(table):
+        tbody = table.find('tbody')
+        if not tbody:
+            return None
+        return [(row.get_text(), index(row)) for row in tbody.find_all('tr')]
+
+    tables = []
+    for t in soup.find_all('table'):
+        cap = t.find('caption')
+        tables.append((cap.get_text() if cap else None, t))
+    return DetailDoc(index(soup), tables, rows_fn)
+
+def _detail_doc_lxml(html_content):
+    root = lxml.html.document_fromstring(html_content)
+    # html.parser 的 get_text 不含 script/style 內容，先移除以保持一致
+    etree.strip_elements(root, 'script', 'style', with_tail=False)
+
+    def text(el, strip=True):
+        if strip:
+            return ''.join(t.strip() for t in el.itertext())
+        return ''.join(el.itertext())
+
+    def index(scope):
+        idx = HeadersIndex()
+        for el in scope.iter('td', 'th'):
+            headers = el.get('headers')
+            if headers:
+                idx.add(el.tag, headers, lambda: text(el))
+        return idx
+
+    def rows_fn(table):
+        tbody = table.find('.//tbody')
+        if tbody is None:
+            return None
+        return [(text(row, strip=False), index(row)) for row in tbody.iter('tr')]
+
+    tables = []
+    for t in root.iter('table'):
+        cap = t.find('.//caption')
+        tables.append((text(cap, strip=False) if cap is not None else None, t))
+    return DetailDoc(index(root), tables, rows_fn)
+
+_TABLE_TAG_RE = re.compile(r'<(/?)(table|tbody)\b', re.IGNORECASE)
+_RAW_TEXT_RE = re.compile(r'<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+
+def explicit_tbody(html_content):
+    """
+    依原始碼順序回傳每個 table 是否 (含巢狀表格) 明確寫出 <tbody>。
+    HTML5 解析器 (lexbor) 會自動補上 tbody，html.parser 與 lxml 不會；沒有 tbody 的表格在後兩者視為沒有資料列。
+    """
+    flags, open_tables = [], []
+    for closing, tag in _TABLE_TAG_RE.findall(_RAW_TEXT_RE.sub('', html_content)):
+        if tag.lower() == 'table':
+            if not closing:
+                open_tables.append(len(flags))
+                flags.append(False)
+            elif open_tables:
+                open_tables.pop()
+        elif not closing:
+            for i in open_tables:
+                flags[i] = True
+    return flags
+
+def _detail_doc_selectolax(html_content):
+    tree = LexborHTMLParser(html_content)
+    tree.strip_tags(['script', 'style'])
+
+    def index(scope):
+        idx = HeadersIndex()
+        for el in scope.css('td[headers], th[headers]'):
+            idx.add(el.tag, el.attributes.get('headers') or '',
+                    lambda: el.text(deep=True, separator='', strip=True))
+        return idx
+
+    def rows_fn(entry):
+        table, has_tbody = entry
+        tbody = table.css_first('tbody') if has_tbody else None
+        if tbody is None:
+            return None
+        return [(row.text(deep=True), index(row)) for row in tbody.css('tr')]
+
+    nodes = tree.css('table')
+    flags = explicit_tbody(html_content)
+    if len(flags) != len(nodes):
+        # 原始碼掃描與 DOM 對不上 (例如屬性值中含有 <table) 時，沿用 DOM 的 tbody
+        flags = [True] * len(nodes)
+    tables = []
+    for t, has_tbody in zip(nodes, flags):
+        cap = t.css_first('caption')
+        tables.append((cap.text(deep=True) if cap is not None else None, (t, has_tbody)))
+    return DetailDoc(index(tree.root), tables, rows_fn)
+
+DETAIL_DOC_BUILDERS = {
+    'lxml': _detail_doc_lxml,
+    'selectolax': _detail_doc_selectolax,
+    'html.parser': _detail_doc_bs4,
+}
+
+def available_parsers():
+    """回傳目前環境可用的解析後端"""
+    missing = {'lxml': lxml is None, 'selectolax': LexborHTMLParser is None}
+    return [name for name in PARSER_BACKENDS if not missing.get(name)]
+
+def resolve_parser(name):
+    """將 auto 或指定名稱解析為可用的後端；指定的後端未安裝時退回 html.parser"""
+    available = available_parsers()
+    if name == 'auto':
+        return available[0]
+    if name not in available:
+        print(f"警告: 解析後端 {name} 無法使用，改用 html.parser")
+        return 'html.parser'
+    return name
+
+# 目前使用的詳細頁解析後端，由 main() 依 --parser 設定
+PARSER = resolve_parser(DEFAULT_PARSER)
+
+def detail_rows(doc, school_id, caption_text, headers_map, record_type):
+    """由 DetailDoc 取出科目或交通車表格的資料列 (record_type 為 Subject 或 Vehicle)，規則同 parse_detail_table"""
+    results = []
+    for row_text, idx in doc.rows(caption_text):
+        if "無資料" in row_text:
+            continue
+        item = record_type()
+        item['補習班代碼'] = school_id
+        has_data = False
+        for header_id, field_name in headers_map.items():
+            val = idx.get(header_id)
+            item[field_name] = val
+            if val:
+                has_data = True
+        if has_data:
+            results.append(item)
+    return results
+
+@timed('parse_detail')
+def parse_school_details(html_content, school_id, parser=None):
+    """單次走訪解析詳細頁，回傳 (School, [Subject], [Vehicle])；School 只有詳細頁的欄位"""
+    doc = DETAIL_DOC_BUILDERS[parser or PARSER](html_content)
+    info = School((field, doc.cells.get(header_id)) for header_id, field in DETAIL_FIELDS.items())
+    subjects = detail_rows(doc, school_id, SUBJECT_CAPTION, SUBJECT_FIELDS, Subject)
+    vehicles = detail_rows(doc, school_id, VEHICLE_CAPTION, VEHICLE_FIELDS, Vehicle)
+    return info, subjects, vehicles
+
+# 未解碼的回應內容；解碼與解析留給解析階段 (可能在其他行程)
+RawPage = namedtuple('RawPage', ['content', 'encoding'])
+
+def decode_page(raw):
+    return raw.content.decode(raw.encoding or 'utf-8', errors='replace')
+
+def fetch_detail_page(session, school_id):
+    """抓取詳細資料頁面，回傳 RawPage；失敗時拋出例外"""
     params = {'u': school_id}
-    info = {}
-    subjects = []
-    vehicles = []
-    
-    try:
+    with METRICS.timer('fetch_detail'):
         response = session.get(DETAIL_URL, params=params, headers=HEADERS, verify=False)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # 1. 基本資料 (schools.csv)
-        info['主管機關文件單位代碼'] = get_text_by_headers(soup, 'th-sqnum')
-        info['補習班類別/科目'] = get_text_by_headers(soup, 'th-cataname')
-        info['立案情形'] = get_text_by_headers(soup, 'th-legaltype')
-        info['傳真號碼'] = get_text_by_headers(soup, 'th-fax')
-        info['電子郵件'] = get_text_by_headers(soup, 'th-email')
-        info['教室數'] = get_text_by_headers(soup, 'th-roomcount')
-        info['飲用水設備維護管理'] = get_text_by_headers(soup, 'th-water')
-        info['教室面積'] = get_text_by_headers(soup, 'th-roomarea')
-        info['班舍總面積'] = get_text_by_headers(soup, 'th-schoolarea')
-        info['停辦文號'] = get_text_by_headers(soup, 'th-shutnumber')
-        info['停辦生效日'] = get_text_by_headers(soup, 'th-shutexpire')
-        info['停辦截止日'] = get_text_by_headers(soup, 'th-shutclosure')
-        info['負責人姓名'] = get_text_by_headers(soup, 'th-incharge')
-        info['設立人姓名'] = get_text_by_headers(soup, 'th-establish')
-        info['班主任'] = get_text_by_headers(soup, 'th-director')
-
-        # 2. 核准科目資料 (subjects.csv)
-        subj_map = {
-            'th-course-name': '核准科目名稱',
-            'th-allow-class': '核准班級數',
-            'th-allow-person': '每班核准人數',
-            'th-lesson-total': '每週總節(時)數',
-            'th-study-period': '修業期限',
-            'th-allow-recruiter': '招生對象'
-        }
-        subjects = parse_detail_table(soup, school_id, "核准科目資料", subj_map)
+    METRICS.add_bytes('detail.jsp', len(response.content))
+    return RawPage(response.content, response.encoding)
 
-        # 3. 交通車資料 (vehicles.csv)
-        veh_map = {
-            'th-permit-id': '牌照號碼',
-            'th-approve-doc': '備查文號',
-            'th-approve-date': '備查日期'
-        }
-        vehicles = parse_detail_table(soup, school_id, "交通車資料", veh_map)
+def fetch_detail_html(session, school_id):
+    """抓取詳細資料頁面，回傳 HTML；失敗時拋出例外"""
+    return decode_page(fetch_detail_page(session, school_id))
 
-        return info, subjects, vehicles
+def parse_detail_page(raw, school_id, parser):
+    """
+    解析行程池的工作函式：解碼並解析詳細頁，回傳 (info, subjects, vehicles, 解析秒數)。
+    子行程的 METRICS 不會回傳，因此解析時間由主行程記錄；parser 需明確傳入，因為 spawn 的子行程不會繼承 PARSER。
+    """
+    start = time.perf_counter()
+    info, subjects, vehicles = parse_school_details.__wrapped__(decode_page(raw), school_id, parser)
+    return info, subjects, vehicles, time.perf_counter() - start
 
-    except Exception as e:
-        print(f"Error fetching details for {school_id}: {e}")
-        return {}, [], []
+def fetch_school_details(session, school_id):
+    """抓取並解析詳細資料頁面，回傳 (info, subjects, vehicles)；失敗時拋出例外"""
+    return parse_school_details(fetch_detail_html(session, school_id), school_id)
 
+def list_soup(html_content):
+    """列表頁的 soup；已是 BeautifulSoup 時直接沿用，讓第一頁的總筆數與列表只解析一次"""
+    if isinstance(html_content, BeautifulSoup):
+        return html_content
+    return BeautifulSoup(html_content, 'html.parser')
+
+@timed('parse_total')
 def parse_total_count(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = list_soup(html_content)
     caption = soup.find('caption', id='result-list')
     if caption:
         text = caption.get_text(strip=True)
@@ -184,10 +1294,11 @@ def parse_total_count(html_content):
             return int(match.group(1))
     return 0
 
+@timed('parse_list')
 def parse_list_page(html_content):
-    """解析列表頁的基本資料，回傳 list of items"""
+    """解析列表頁 (HTML 或 list_soup 的結果) 的基本資料，回傳只有列表欄位的 School 清單"""
     data = []
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = list_soup(html_content)
     table = soup.find('table', {'class': 'table m-2'})
     
     if not table or not table.find('tbody'):
@@ -197,7 +1308,7 @@ def parse_list_page(html_content):
     for row in rows:
         cols = row.find_all(['td', 'th'])
         if len(cols) >= 7:
-            item = {
+            item = School({
                 '縣市': cols[1].get_text(strip=True),
                 '補習班名稱': cols[2].get_text(strip=True),
                 '班址': cols[3].get_text(strip=True),
@@ -205,7 +1316,7 @@ def parse_list_page(html_content):
                 '立案文號': cols[5].get_text(strip=True),
                 '立案日期': cols[6].get_text(strip=True),
                 '補習班代碼': ''
-            }
+            })
             # 提取 ID
             action_col = cols[7]
             button = action_col.find('button')
@@ -217,89 +1328,2740 @@ def parse_list_page(html_content):
             data.append(item)
     return data
 
-def main():
-    print("開始抓取全台補習班資料 (含詳細資訊)...")
-    session = get_session()
-    
-    # 1. 取得第一頁
-    first_page_html = get_page_content(session, 1)
-    if not first_page_html:
-        print("無法取得第一頁，終止。")
-        return
+def iter_list_items(session, executor, first_page_html, total_pages, window, skip_pages=(), dead_letter=None,
+                    filters=None):
+    """
+    依頁序產生 (page, item)；第 2 頁之後的列表頁由 executor 平行預先抓取。
+    每頁資料結束後會產生一筆 (page, None) 作為該頁完成的標記；抓取失敗的頁面不會有標記，並記入 dead_letter。
+    filters 為傳給 get_page_content 的查詢條件 (如分片的 p_city)；first_page_html 也可以是 list_soup 的結果。
+    """
+    def fetch(page):
+        return page, get_page_content(session, page, filters)
 
-    total_count = parse_total_count(first_page_html)
-    if total_count == 0:
-        print("警告: 無法解析總筆數。")
-        return
+    def entries(page, html):
+        for item in parse_list_page(html):
+            yield page, item
+        yield page, None
 
-    items_per_page = 15
-    total_pages = math.ceil(total_count / items_per_page)
-    print(f"總筆數: {total_count}, 總頁數: {total_pages}")
-    
-    # 定義 CSV Headers
-    header_schools = [
-        '縣市', '補習班名稱', '補習班代碼', '主管機關文件單位代碼', '補習班類別/科目', 
-        '班址', '電話', '傳真號碼', '電子郵件', '立案情形', '立案文號', '立案日期',
-        '教室數', '飲用水設備維護管理', '教室面積', '班舍總面積',
-        '停辦文號', '停辦生效日', '停辦截止日',
-        '負責人姓名', '設立人姓名', '班主任'
-    ]
-    header_subjects = ['補習班代碼', '核准科目名稱', '核准班級數', '每班核准人數', '每週總節(時)數', '修業期限', '招生對象']
-    header_vehicles = ['補習班代碼', '牌照號碼', '備查文號', '備查日期']
-    
-    # 開啟檔案 (Append mode if resuming, but here we overwrite)
-    # 使用 ExitStack 來管理多個檔案較好，但這裡簡單用巢狀或分開開
-    f_schools = open(FILE_SCHOOLS, 'w', newline='', encoding='utf-8-sig')
-    f_subjects = open(FILE_SUBJECTS, 'w', newline='', encoding='utf-8-sig')
-    f_vehicles = open(FILE_VEHICLES, 'w', newline='', encoding='utf-8-sig')
-    
-    w_schools = csv.DictWriter(f_schools, fieldnames=header_schools)
-    w_subjects = csv.DictWriter(f_subjects, fieldnames=header_subjects)
-    w_vehicles = csv.DictWriter(f_vehicles, fieldnames=header_vehicles)
-    
-    w_schools.writeheader()
-    w_subjects.writeheader()
-    w_vehicles.writeheader()
-    
+    if 1 not in skip_pages:
+        yield from entries(1, first_page_html)
+    pages = [p for p in range(2, total_pages + 1) if p not in skip_pages]
+    for page, html in ordered_map(executor, fetch, pages, window):
+        if html:
+            yield from entries(page, html)
+        elif dead_letter:
+            dead_letter.add('page', page, "列表頁抓取失敗")
+
+def get_county_print_page(session, county_code):
+    """以列印頁一次抓取整個縣市的列表 (同 backup/get.py)，失敗時回傳 None"""
+    params = {
+        'pageno': 1, 'p_road': '', 'p_name': '', 'e_name': '', 'p_area': '', 'p_type': '',
+        'di': '', 'estab': '', 'start_year': '', 'start_month': '', 'start_day': '',
+        'end_year': '', 'end_month': '', 'end_day': '', 'p_range': 'on',
+        'citylink': county_code, 'pnt': 2,
+    }
     try:
-        # 2. 遍歷頁面
-        for page in range(1, total_pages + 1):
-            print(f"正在抓取第 {page}/{total_pages} 頁...", end='\r')
-            
-            html = first_page_html if page == 1 else get_page_content(session, page)
-            
-            if html:
-                # 1. 解析列表
-                list_items = parse_list_page(html)
-                
-                # 2. 逐筆抓取詳細資料
-                for item in list_items:
-                    school_id = item.get('補習班代碼')
-                    if school_id:
-                        det_info, det_subjs, det_vehs = get_school_details(session, school_id)
-                        
-                        # 合併基本資料
-                        item.update(det_info)
-                        w_schools.writerow(item)
-                        
-                        # 寫入科目
-                        if det_subjs:
-                            w_subjects.writerows(det_subjs)
-                            
-                        # 寫入交通車
-                        if det_vehs:
-                            w_vehicles.writerows(det_vehs)
-                    else:
-                        # 若無 ID，僅寫入列表有的資料
-                        w_schools.writerow(item)
-            
-            time.sleep(1)
+        # 選定縣市只影響伺服器端 session，失敗時仍嘗試抓取列印頁
+        try:
+            session.get(CITY_URL, params={'usercity': county_code}, headers=HEADERS, verify=False)
+        except Exception:
+            pass
+        with METRICS.timer('fetch_print_list'):
+            response = session.get(PRINT_SHOWPAGE_URL, params=params, headers=HEADERS, verify=False)
+            response.raise_for_status()
+        METRICS.add_bytes('print_showpage.jsp', len(response.content))
+        response.encoding = 'utf-8'
+        return response.text
+    except Exception as e:
+        print(f"Error fetching county list {county_code}: {e}")
+        return None
 
-    finally:
-        f_schools.close()
-        f_subjects.close()
-        f_vehicles.close()
-        print(f"\n抓取完成！資料已儲存至 {FILE_SCHOOLS}, {FILE_SUBJECTS}, {FILE_VEHICLES}")
+@timed('parse_print_list')
+def parse_print_list(html_content, county_name):
+    """
+    解析縣市列印頁的表格 (border=1，第一列為表頭)，回傳與 parse_list_page 相同欄位的 items；
+    找不到表格時回傳 None。列中若有 detail.jsp?u= 連結會直接取出補習班代碼。
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    table = soup.find('table', {'border': '1'})
+    if table is None:
+        return None
+    rows = table.find_all('tr')
+    if not rows:
+        return []
+    # 表頭可能含空白，如「班 址」
+    headers = [re.sub(r'\s+', '', th.get_text()) for th in rows[0].find_all(['th', 'td'])]
+    data = []
+    for row in rows[1:]:
+        cols = row.find_all('td')
+        if not cols:
+            continue
+        values = dict(zip(headers, (c.get_text(strip=True) for c in cols)))
+        item = School({
+            '縣市': county_name,
+            '補習班名稱': values.get('補習班名稱', ''),
+            '班址': values.get('班址', ''),
+            '電話': values.get('電話', ''),
+            '立案文號': values.get('立案文號', ''),
+            '立案日期': values.get('立案日期', ''),
+            '補習班代碼': ''
+        })
+        match = re.search(r'detail\.jsp\?u=(\d+)', str(row))
+        if match:
+            item['補習班代碼'] = match.group(1)
+        data.append(item)
+    return data
+
+def load_id_index():
+    """由既有輸出 (含 *.prev.csv) 建立 (補習班名稱, 立案文號) → 補習班代碼 的索引"""
+    index = {}
+    for path in (prev_path(FILE_SCHOOLS), FILE_SCHOOLS):
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                if row.get('補習班代碼'):
+                    index[(row.get('補習班名稱', ''), row.get('立案文號', ''))] = row['補習班代碼']
+    return index
+
+def iter_county_pages(session, executor, county_code, window, since=None):
+    """
+    以 p_city 篩選的分頁列表抓取單一縣市 (列印頁失敗時的備援)，回傳 items；任何一頁失敗時回傳 None。
+    指定 since (YYYY-MM-DD) 時只列出該日以後立案的補習班 (start_date)。
+    """
+    filters = {'p_city': county_code}
+    if since:
+        filters['start_date'] = since
+    first = get_page_content(session, 1, filters)
+    if not first:
+        return None
+    items = parse_list_page(first)
+    total_pages = math.ceil(parse_total_count(first) / ITEMS_PER_PAGE)
+
+    def fetch(page):
+        return get_page_content(session, page, filters)
+
+    for html in ordered_map(executor, fetch, range(2, total_pages + 1), window):
+        if html is None:
+            return None
+        items.extend(parse_list_page(html))
+    return items
+
+def resolve_county_ids(session, executor, county_code, window, missing):
+    """
+    以 p_city 分頁列表補回列印頁缺少的補習班代碼 (依補習班名稱與立案文號對應)，回傳仍查不到的間數。
+    缺少代碼的多半是新立案的補習班，因此先以其中最早的立案日期為 start_date 查詢，通常一頁即可；
+    查詢失敗、有無法解析的立案日期或仍有查不到的補習班時，才改抓整個縣市的分頁列表。
+    """
+    dates = [to_date(item['立案日期']) for item in missing]
+    for since in ([min(dates).isoformat()] if all(dates) else []) + [None]:
+        METRICS.incr('bulk_id_fallback' if since else 'bulk_id_county')
+        listed = iter_county_pages(session, executor, county_code, window, since)
+        if listed is None:
+            continue
+        ids = {(it['補習班名稱'], it['立案文號']): it['補習班代碼'] for it in listed}
+        for item in missing:
+            item['補習班代碼'] = ids.get((item['補習班名稱'], item['立案文號']), '')
+        missing = [item for item in missing if not item['補習班代碼']]
+        if not missing:
+            break
+    return len(missing)
+
+def iter_bulk_list_items(session, executor, window, skip_pages=(), dead_letter=None, id_index=None, counties=None):
+    """
+    以縣市列印頁取得全國列表 (約 22 個請求取代上千頁分頁)，依 COUNTIES 順序產生 (page, item)。
+    page 為縣市在 counties (預設為 COUNTIES) 中的序號 (從 1 起)，每個縣市結束後產生 (page, None) 標記。
+    列印頁沒有補習班代碼時先查既有輸出的索引；仍有查不到的補習班時，
+    由 resolve_county_ids 以該縣市的 p_city 分頁列表補回 (不逐間查詢)。列印頁失敗的縣市直接改用分頁列表。
+    """
+    id_index = id_index or {}
+
+    for page, (name, code) in enumerate((counties or COUNTIES).items(), start=1):
+        if page in skip_pages:
+            continue
+        html = get_county_print_page(session, code)
+        items = parse_print_list(html, name) if html else None
+        if items is None:
+            print(f"{name} 列印頁失敗，改用分頁列表")
+            METRICS.incr('bulk_fallback')
+            items = iter_county_pages(session, executor, code, window)
+            if items is None:
+                if dead_letter:
+                    dead_letter.add('county', code, "縣市列表抓取失敗", page)
+                continue
+        else:
+            missing = []
+            for item in items:
+                if not item['補習班代碼']:
+                    item['補習班代碼'] = id_index.get((item['補習班名稱'], item['立案文號'])) or ''
+                if not item['補習班代碼']:
+                    missing.append(item)
+            if missing:
+                unresolved = resolve_county_ids(session, executor, code, window, missing)
+                if unresolved:
+                    print(f"{name} 分頁列表失敗，{unresolved} 間補習班沒有補習班代碼")
+        for item in items:
+            yield page, item
+        yield page, None
+
+def get_county_opendata(session, county_code):
+    """抓取單一縣市的開放資料 JSON (同 backup/city_m_all.py)，回傳 list of dict；失敗時回傳 None"""
+    try:
+        with METRICS.timer('fetch_opendata'):
+            response = session.get(OPENDATA_URL, params={'city': county_code}, headers=HEADERS, verify=False)
+            response.raise_for_status()
+        METRICS.add_bytes('afterschool_json.jsp', len(response.content))
+        data = json.loads(response.content.decode('utf-8-sig'))
+    except Exception as e:
+        print(f"Error fetching open data {county_code}: {e}")
+        return None
+    if isinstance(data, dict):
+        # 部分版本以物件包住資料陣列
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    return [rec for rec in data if isinstance(rec, dict)]
+
+class OpenDataIndex:
+    """
+    各縣市開放資料 JSON 的記憶體索引：(縣市代碼, 補習班名稱) → OPENDATA_FIELDS 中的欄位。
+    JSON 沒有補習班代碼，因此同一縣市內名稱重複且內容不同的補習班視為無法對應，交由詳細頁提供。
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.failed = []
+
+    def load(self, session, executor, window, codes=None):
+        def fetch(code):
+            return code, get_county_opendata(session, code)
+
+        for code, records in ordered_map(executor, fetch, codes or COUNTIES.values(), window):
+            if records is None:
+                self.failed.append(code)
+                continue
+            for rec in records:
+                name = str(rec.get(OPENDATA_NAME) or '').strip()
+                if not name:
+                    continue
+                # 缺少或空白的欄位不列入，以免覆寫詳細頁抓到的值
+                values = {field: value for key, field in OPENDATA_FIELDS.items()
+                          if (value := str(rec.get(key) or '').strip())}
+                key = (code, name)
+                if key in self.records and self.records[key] != values:
+                    values = None
+                self.records[key] = values
+        return self
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, item):
+        """回傳補習班可由開放資料提供的欄位；找不到或無法唯一對應時回傳 None"""
+        school_id = item.get('補習班代碼') or ''
+        code = COUNTIES.get(item.get('縣市'))
+        if code is None and school_id[:2].isdigit():
+            code = int(school_id[:2])
+        values = self.records.get((code, item.get('補習班名稱', '')))
+        METRICS.incr('opendata_hit' if values else 'opendata_miss')
+        return dict(values) if values else None
+
+class DeadLetterQueue:
+    """
+    重試用盡仍失敗的項目 (JSON Lines)：kind 為 page (列表頁)、county (縣市列印頁) 或 detail (詳細頁)。
+    失敗的詳細頁仍會先寫入只有列表欄位的資料列，之後由 redrive 子命令補齊。
+    重新抓取 (非續抓) 時，上一次尚未補抓的項目除非本次已重新抓取成功 (見 settle)，否則於 close 時寫回。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = None
+        self.count = 0
+        self.previous = {}
+
+    def open(self, append):
+        if not append:
+            self.previous = {(rec['kind'], rec['key']): rec for rec in self.load()}
+        self.f = open(self.path, 'a' if append else 'w', encoding='utf-8')
+
+    def settle(self, kind, key):
+        """本次已重新抓取成功，上一次的失敗記錄不再需要補抓"""
+        with self.lock:
+            self.previous.pop((kind, str(key)), None)
+
+    def add(self, kind, key, error, page=None):
+        rec = {'kind': kind, 'key': str(key), 'page': page, 'error': str(error), 'time': time.time()}
+        with self.lock:
+            self.previous.pop((kind, rec['key']), None)
+            self.count += 1
+            METRICS.incr(f"dead_letter_{kind}")
+            if self.f:
+                self.f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+                self.f.flush()
+
+    def load(self):
+        """讀取所有失敗項目 (同一項目只保留最後一筆)，依記錄順序回傳"""
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries.pop((rec['kind'], rec['key']), None)
+                    entries[(rec['kind'], rec['key'])] = rec
+        return list(entries.values())
+
+    def rewrite(self, entries):
+        _write_text_atomic(self.path, ''.join(json.dumps(rec, ensure_ascii=False) + '\n' for rec in entries))
+
+    def close(self, finished=False):
+        """
+        寫回上一次仍未解決的項目。抓取完整完成時，本次沒有再失敗的列表頁都已重新抓取成功；
+        詳細頁則只有本次實際重新抓取成功 (呼叫過 settle) 者才算解決，沿用快照或只抓主檔時仍保留。
+        """
+        if self.f:
+            outstanding = [rec for (kind, _), rec in self.previous.items() if kind == 'detail' or not finished]
+            for rec in outstanding:
+                self.f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+            self.count += len(outstanding)
+            self.previous = {}
+            self.f.close()
+            self.f = None
+
+class CsvOutput:
+    """
+    管理三個關聯 CSV 檔案的寫入。
+    offsets 不為 None 時為續抓模式：先將檔案截斷到上次檢查點的位置，再以附加模式開啟，
+    如此可丟棄中斷時寫了一半、尚未記錄在 journal 的資料列。
+    """
+
+    def __init__(self, offsets=None):
+        paths = [FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES]
+        headers = [HEADER_SCHOOLS, HEADER_SUBJECTS, HEADER_VEHICLES]
+        self.files = []
+        self.writers = []
+        for i, (path, fieldnames) in enumerate(zip(paths, headers)):
+            if offsets is not None:
+                with open(path, 'r+b') as f:
+                    f.truncate(offsets[i])
+                f = open(path, 'a', newline='', encoding='utf-8-sig')
+            else:
+                f = open(path, 'w', newline='', encoding='utf-8-sig')
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            if offsets is None:
+                writer.writeheader()
+            self.files.append(f)
+            self.writers.append(writer)
+
+    @timed('write_csv')
+    def write(self, item, subjects, vehicles):
+        w_schools, w_subjects, w_vehicles = self.writers
+        w_schools.writerow(item)
+        if subjects:
+            w_subjects.writerows(subjects)
+        if vehicles:
+            w_vehicles.writerows(vehicles)
+
+    @timed('checkpoint')
+    def checkpoint(self, sync=False):
+        """將緩衝寫入檔案並回傳三個檔案目前的位元組位置"""
+        offsets = []
+        for f in self.files:
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+            offsets.append(f.tell())
+        return offsets
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+def prev_path(path):
+    root, ext = os.path.splitext(path)
+    return root + PREV_SUFFIX + ext
+
+def rotate_snapshot():
+    """將目前的輸出檔更名為 *.prev.csv，作為本次增量抓取的比對基準"""
+    if not os.path.exists(FILE_SCHOOLS):
+        return
+    for path in (FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES):
+        if os.path.exists(path):
+            os.replace(path, prev_path(path))
+
+def load_snapshot(exclude=()):
+    """
+    讀取上一次的快照，回傳 {補習班代碼: (School, [Subject], [Vehicle])}。
+    科目與交通車依補習班代碼分組，保留原本的列順序。exclude 中的補習班 (上一次的 dead letter) 不列入，一律重新抓取。
+    """
+    snapshot = {}
+    path = prev_path(FILE_SCHOOLS)
+    if not os.path.exists(path):
+        return snapshot
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            if row.get('補習班代碼') and row['補習班代碼'] not in exclude:
+                snapshot[row['補習班代碼']] = (School(row), [], [])
+    for path, slot, record_type in ((prev_path(FILE_SUBJECTS), 1, Subject), (prev_path(FILE_VEHICLES), 2, Vehicle)):
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                entry = snapshot.get(row.get('補習班代碼'))
+                if entry:
+                    entry[slot].append(record_type(row))
+    return snapshot
+
+def carry_forward(snapshot, item):
+    """
+    若補習班在上一次快照中存在、列表欄位皆未變動且詳細欄位完整，
+    回傳沿用的 (info, subjects, vehicles)；否則回傳 None 表示需要重新抓取詳細頁。
+    """
+    entry = snapshot.get(item.get('補習班代碼'))
+    if not entry:
+        return None
+    row, subjects, vehicles = entry
+    if any(row.get(field, '') != item.get(field, '') for field in LIST_FIELDS):
+        return None
+    # 詳細頁抓取失敗的資料列只有列表 (與開放資料) 欄位，沿用會讓不完整的資料一直不完整
+    if not any(row.get(field) for field in DETAIL_FIELDS.values() if field not in OPENDATA_FIELDS.values()):
+        return None
+    info = School((k, v) for k, v in row.items() if k not in item)
+    return info, subjects, vehicles
+
+_NUMBER_RE = re.compile(r'[-+]?\d+(?:\.\d+)?')
+_DATE_RE = re.compile(r'(\d{2,4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})')
+
+def to_float(text):
+    """取出文字中的第一個數值，例如 '30.42平方公尺' → 30.42；沒有數值時回傳 None"""
+    if not text:
+        return None
+    match = _NUMBER_RE.search(text.replace(',', ''))
+    return float(match.group()) if match else None
+
+def to_int(text):
+    value = to_float(text)
+    return int(value) if value is not None else None
+
+def to_date(text):
+    """解析 2026-01-06、2026/1/6 或民國 115-01-06 等日期；無法解析時回傳 None"""
+    if not text:
+        return None
+    match = _DATE_RE.search(text)
+    if not match:
+        return None
+    year, month, day = (int(g) for g in match.groups())
+    if year < 1911:
+        year += 1911
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+AREA_UNIT = '平方公尺'
+
+def format_number(value):
+    """數值的標準寫法：整數值不帶小數點 (2.0 → '2')，其餘為最短的十進位表示 (30.5 → '30.5')"""
+    return str(int(value)) if value == int(value) else repr(value)
+
+# 欄位型別：(由值產生標準原文, 由原文解析出值，無法解析時為 None, 值的型別)；text 與 intern 欄位直接存放原文
+RECORD_CODECS = {
+    'text': (str, str, str),
+    'intern': (str, str, str),
+    'int': (str, to_int, int),
+    'float': (format_number, to_float, float),
+    'area': (lambda value: format_number(value) + AREA_UNIT, to_float, float),
+    'date': (datetime.date.isoformat, to_date, datetime.date),
+}
+
+class Record(MutableMapping):
+    """
+    以 __slots__ 保存的資料列，取代以中文欄位名稱為鍵、每個值都是字串的 dict。
+    int、float、area (平方公尺)、date 欄位存放解析後的 int / float / datetime.date，以欄位名稱讀取
+    (record['教室面積']、csv.DictWriter) 時再由 codec 還原成標準原文；只有原文不是標準寫法
+    (例如 '030'、'30.50平方公尺'、民國日期) 而無法由值還原時才保留原文字串，因此輸出逐位元組不變。
+    縣市、類別、招生對象等重複值為 intern 字串。名稱、地址等 text 欄位幾乎每列都不同，
+    各自一個字串的物件開銷比內容還大，因此合存於 self.text 一個字串：開頭一個字元是各欄位是否設定的位元遮罩，
+    接著每個欄位一個字元記錄其結尾位置，之後是各欄位原文依序相接；讀取時依位置直接切出，不需分割。
+    屬性是實際存放的值 (值或原文；text 欄位是讀寫 self.text 的 property)，解析後型別固定的值由 typed() 取得。
+    行為與 dict 相同：未設定或設為 None 的欄位 (屬性為 None) 不在 keys() 中；不在 FIELDS 的鍵存於 extra。
+    """
+
+    __slots__ = ('extra', 'text')
+    # (欄位名稱, 屬性名稱, RECORD_CODECS 的鍵)
+    FIELDS = ()
+
+    @staticmethod
+    def slots(fields):
+        return tuple(attr for _, attr, kind in fields if kind != 'text')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.COLUMNS = {column: (attr, kind, *RECORD_CODECS[kind]) for column, attr, kind in cls.FIELDS}
+        cls.KINDS = {attr: kind for _, attr, kind in cls.FIELDS}
+        cls.TEXT = {column: i for i, column in enumerate(column for column, _, kind in cls.FIELDS if kind == 'text')}
+        for column, attr, kind in cls.FIELDS:
+            if kind == 'text':
+                setattr(cls, attr, property(lambda self, index=cls.TEXT[column]: self._text(index),
+                                            lambda self, value, column=column: self.__setitem__(column, value)))
+
+    def __init__(self, values=(), **kwargs):
+        self.extra = None
+        self.text = None
+        for attr in self.slots(self.FIELDS):
+            setattr(self, attr, None)
+        self.update(values, **kwargs)
+
+    def _text(self, index):
+        text = self.text
+        if text is None or not ord(text[0]) >> index & 1:
+            return None
+        base = len(self.TEXT) + 1
+        return text[base + (ord(text[index]) if index else 0):base + ord(text[index + 1])]
+
+    def _texts(self):
+        return [self._text(i) for i in range(len(self.TEXT))]
+
+    def _pack(self, parts):
+        mask = sum(1 << i for i, part in enumerate(parts) if part is not None)
+        if not mask:
+            self.text = None
+            return
+        ends = list(itertools.accumulate(len(part or '') for part in parts))
+        if ends[-1] > sys.maxunicode:
+            raise ValueError(f"{type(self).__name__} 的文字欄位總長超過 {sys.maxunicode} 個字元")
+        self.text = chr(mask) + ''.join(map(chr, ends)) + ''.join(part or '' for part in parts)
+
+    def typed(self, attr):
+        """
+        屬性解析後的值：int 欄位為 int、float / area 欄位為 float、date 欄位為 datetime.date，其餘為原文；
+        未設定或無法解析時為 None
+        """
+        value = getattr(self, attr)
+        if value.__class__ is str:
+            return RECORD_CODECS[self.KINDS[attr]][1](value)
+        return value
+
+    def __getitem__(self, key):
+        index = self.TEXT.get(key)
+        if index is not None:
+            value = self._text(index)
+            if value is not None:
+                return value
+            raise KeyError(key)
+        field = self.COLUMNS.get(key)
+        if field is not None:
+            value = getattr(self, field[0])
+            if value is not None:
+                return value if value.__class__ is str else field[2](value)
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        index = self.TEXT.get(key)
+        if index is not None:
+            parts = self._texts()
+            parts[index] = None if value is None else str(value)
+            self._pack(parts)
+            return
+        field = self.COLUMNS.get(key)
+        if field is None:
+            if value is not None:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+            elif self.extra:
+                self.extra.pop(key, None)
+            return
+        attr, kind, fmt, parse, cls = field
+        if value is None:
+            pass
+        elif value.__class__ is str:
+            if kind == 'intern':
+                value = sys.intern(value)
+            elif cls is not str and value:
+                # 只有能由值還原成相同原文時才存放值
+                parsed = parse(value)
+                if parsed is not None and fmt(parsed) == value:
+                    value = parsed
+        elif cls is str:
+            value = sys.intern(str(value))
+        elif not isinstance(value, cls):
+            value = cls(value)
+        setattr(self, attr, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self[key] = None
+
+    def update(self, values=(), **kwargs):
+        """與 dict.update 相同；text 欄位收齊後只重組一次 self.text"""
+        items = ((key, values[key]) for key in values.keys()) if hasattr(values, 'keys') else values
+        parts = None
+        for key, value in itertools.chain(items, kwargs.items()):
+            index = self.TEXT.get(key)
+            if index is None:
+                self[key] = value
+                continue
+            if parts is None:
+                parts = self._texts()
+            parts[index] = None if value is None else str(value)
+        if parts is not None:
+            self._pack(parts)
+
+    def __iter__(self):
+        mask = ord(self.text[0]) if self.text else 0
+        for column, attr, kind in self.FIELDS:
+            if mask >> self.TEXT[column] & 1 if kind == 'text' else getattr(self, attr) is not None:
+                yield column
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def copy(self):
+        return type(self)(self)
+
+class School(Record):
+    """補習班基本資料 (schools.csv 的一列)"""
+
+    FIELDS = (
+        ('縣市', 'county', 'intern'),
+        ('補習班名稱', 'name', 'text'),
+        ('補習班代碼', 'school_id', 'intern'),
+        ('主管機關文件單位代碼', 'authority_code', 'text'),
+        ('補習班類別/科目', 'category', 'intern'),
+        ('班址', 'address', 'text'),
+        ('電話', 'phone', 'text'),
+        ('傳真號碼', 'fax', 'intern'),
+        ('電子郵件', 'email', 'text'),
+        ('立案情形', 'status', 'intern'),
+        ('立案文號', 'permit_no', 'text'),
+        ('立案日期', 'registered', 'date'),
+        ('教室數', 'classrooms', 'int'),
+        ('飲用水設備維護管理', 'water', 'intern'),
+        ('教室面積', 'classroom_area', 'area'),
+        ('班舍總面積', 'total_area', 'area'),
+        ('停辦文號', 'suspension_no', 'text'),
+        ('停辦生效日', 'suspended_from', 'date'),
+        ('停辦截止日', 'suspended_until', 'date'),
+        ('負責人姓名', 'owner', 'text'),
+        ('設立人姓名', 'founder', 'text'),
+        ('班主任', 'director', 'text'),
+    )
+    __slots__ = Record.slots(FIELDS)
+
+class Subject(Record):
+    """核准科目 (subjects.csv 的一列)"""
+
+    FIELDS = (
+        ('補習班代碼', 'school_id', 'intern'),
+        ('核准科目名稱', 'name', 'intern'),
+        ('核准班級數', 'classes', 'int'),
+        ('每班核准人數', 'capacity', 'int'),
+        ('每週總節(時)數', 'weekly_hours', 'float'),
+        ('修業期限', 'duration', 'intern'),
+        ('招生對象', 'audience', 'intern'),
+    )
+    __slots__ = Record.slots(FIELDS)
+
+class Vehicle(Record):
+    """交通車 (vehicles.csv 的一列)"""
+
+    FIELDS = (
+        ('補習班代碼', 'school_id', 'intern'),
+        ('牌照號碼', 'plate', 'text'),
+        ('備查文號', 'filing_no', 'text'),
+        ('備查日期', 'filed', 'date'),
+    )
+    __slots__ = Record.slots(FIELDS)
+
+def _parquet_schemas():
+    """三個表的 Arrow schema 與各欄位的轉換函式；低基數欄位使用 dictionary 編碼"""
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    typed = {
+        '縣市': (dict_str, str),
+        '補習班類別/科目': (dict_str, str),
+        '立案情形': (dict_str, str),
+        '飲用水設備維護管理': (dict_str, str),
+        '立案日期': (pa.date32(), to_date),
+        '停辦生效日': (pa.date32(), to_date),
+        '停辦截止日': (pa.date32(), to_date),
+        '教室數': (pa.int32(), to_int),
+        '教室面積': (pa.float64(), to_float),
+        '班舍總面積': (pa.float64(), to_float),
+        '核准科目名稱': (dict_str, str),
+        '核准班級數': (pa.int32(), to_int),
+        '每班核准人數': (pa.int32(), to_int),
+        '每週總節(時)數': (pa.float64(), to_float),
+        '修業期限': (dict_str, str),
+        '招生對象': (dict_str, str),
+        '備查日期': (pa.date32(), to_date),
+    }
+    schemas = []
+    for header in (HEADER_SCHOOLS, HEADER_SUBJECTS, HEADER_VEHICLES):
+        fields, converters = [], []
+        for name in header:
+            arrow_type, convert = typed.get(name, (pa.string(), str))
+            fields.append(pa.field(name, arrow_type))
+            converters.append(convert)
+        schema = pa.schema(fields, metadata={'教室面積': '平方公尺', '班舍總面積': '平方公尺'}
+                           if header is HEADER_SCHOOLS else None)
+        schemas.append((schema, converters))
+    return schemas
+
+class ParquetOutput:
+    """
+    與 CsvOutput 同介面的 Parquet 輸出：日期、面積 (平方公尺)、數量轉為型別欄位，
+    每累積 PARQUET_BATCH_ROWS 列寫出一個 row group，記憶體用量固定。
+    """
+
+    def __init__(self, directory=PARQUET_DIR, batch_rows=PARQUET_BATCH_ROWS):
+        if pa is None:
+            raise RuntimeError("Parquet 輸出需要 pyarrow：pip install pyarrow")
+        os.makedirs(directory, exist_ok=True)
+        self.batch_rows = batch_rows
+        self.tables = []
+        for path, (schema, converters) in zip((FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES), _parquet_schemas()):
+            target = os.path.join(directory, os.path.splitext(path)[0] + '.parquet')
+            writer = pq.ParquetWriter(target, schema, compression='zstd')
+            self.tables.append((schema, converters, writer, [[] for _ in schema]))
+
+    def write(self, item, subjects, vehicles):
+        self._add(0, [item])
+        if subjects:
+            self._add(1, subjects)
+        if vehicles:
+            self._add(2, vehicles)
+
+    def _add(self, index, rows):
+        schema, converters, writer, columns = self.tables[index]
+        for row in rows:
+            for column, name, convert in zip(columns, schema.names, converters):
+                value = row.get(name) or ''
+                if convert is str:
+                    column.append(value)
+                else:
+                    column.append(convert(value) if value else None)
+        if len(columns[0]) >= self.batch_rows:
+            self._flush(index)
+
+    def _flush(self, index):
+        schema, _, writer, columns = self.tables[index]
+        if not columns[0]:
+            return
+        arrays = [pa.array(col, type=field.type) for col, field in zip(columns, schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        for col in columns:
+            col.clear()
+
+    def close(self):
+        for index, (_, _, writer, _) in enumerate(self.tables):
+            self._flush(index)
+            writer.close()
+
+def iter_output_records(paths=None):
+    """串流讀取三個 CSV (預設為目前的輸出檔)，依補習班順序產生 (school, subjects, vehicles)"""
+    paths = paths or (FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES)
+    files = [open(path, newline='', encoding='utf-8-sig') for path in paths]
+    try:
+        schools, *children = [csv.DictReader(f) for f in files]
+        pending = [next(r, None) for r in children]
+        for row in schools:
+            school_id = row.get('補習班代碼')
+            groups = ([], [])
+            for i in range(2):
+                while school_id and pending[i] is not None and pending[i].get('補習班代碼') == school_id:
+                    groups[i].append(pending[i])
+                    pending[i] = next(children[i], None)
+            yield row, groups[0], groups[1]
+    finally:
+        for f in files:
+            f.close()
+
+def export_parquet(directory=PARQUET_DIR):
+    """由既有的 CSV 串流轉出 Parquet (續抓或 redrive 之後使用)"""
+    output = ParquetOutput(directory)
+    count = 0
+    try:
+        for school, subjects, vehicles in iter_output_records():
+            output.write(school, subjects, vehicles)
+            count += 1
+    finally:
+        output.close()
+    return count
+
+def export_parquet_main(argv=None):
+    parser = argparse.ArgumentParser(prog="scraper.py export-parquet", description="將既有的 CSV 轉為型別化的 Parquet")
+    parser.add_argument('--output', default=PARQUET_DIR, help=f"輸出目錄 (預設 {PARQUET_DIR})")
+    args = parser.parse_args(argv)
+    count = export_parquet(args.output)
+    print(f"已轉出 {count} 間補習班至 {args.output}/")
+    return 0
+
+def _q(name):
+    """SQL 識別字 (欄位名稱含中文與符號)"""
+    return '"' + name.replace('"', '""') + '"'
+
+class SqliteOutput:
+    """
+    與 CsvOutput 同介面的 SQLite 輸出：schools 以補習班代碼為主鍵，subjects/vehicles 以外鍵關聯並建立索引。
+    資料累積 SQLITE_BATCH 間後在同一個交易內批次寫入；補習班以 upsert 就地更新，
+    其科目與交通車先刪除再重新寫入，因此重複執行不會產生重複資料。
+    """
+
+    def __init__(self, path=SQLITE_PATH, batch_size=SQLITE_BATCH):
+        self.conn = sqlite3.connect(path)
+        self.batch_size = batch_size
+        self.pending = []
+        self.skipped = 0
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self._create_schema()
+        cols = ', '.join(_q(c) for c in HEADER_SCHOOLS)
+        marks = ', '.join('?' for _ in HEADER_SCHOOLS)
+        updates = ', '.join(f"{_q(c)}=excluded.{_q(c)}" for c in HEADER_SCHOOLS if c != '補習班代碼')
+        self.sql_school = (f"INSERT INTO schools ({cols}) VALUES ({marks}) "
+                           f"ON CONFLICT({_q('補習班代碼')}) DO UPDATE SET {updates}")
+        self.sql_children = []
+        for table, header in (('subjects', HEADER_SUBJECTS), ('vehicles', HEADER_VEHICLES)):
+            self.sql_children.append((
+                f"DELETE FROM {table} WHERE {_q('補習班代碼')} = ?",
+                f"INSERT INTO {table} ({', '.join(_q(c) for c in header)}) VALUES ({', '.join('?' for _ in header)})",
+                header,
+            ))
+
+    def _create_schema(self):
+        key = _q('補習班代碼')
+        school_cols = ', '.join(f"{_q(c)} TEXT" + (" PRIMARY KEY" if c == '補習班代碼' else "")
+                                for c in HEADER_SCHOOLS)
+        statements = [f"CREATE TABLE IF NOT EXISTS schools ({school_cols})"]
+        for table, header in (('subjects', HEADER_SUBJECTS), ('vehicles', HEADER_VEHICLES)):
+            cols = ', '.join(f"{_q(c)} TEXT" for c in header if c != '補習班代碼')
+            statements.append(
+                f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, "
+                f"{key} TEXT NOT NULL REFERENCES schools({key}) ON DELETE CASCADE, {cols})"
+            )
+            statements.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_school ON {table} ({key})")
+        statements += [
+            f"CREATE INDEX IF NOT EXISTS idx_schools_city ON schools ({_q('縣市')})",
+            f"CREATE INDEX IF NOT EXISTS idx_vehicles_plate ON vehicles ({_q('牌照號碼')})",
+            f"CREATE INDEX IF NOT EXISTS idx_subjects_name ON subjects ({_q('核准科目名稱')})",
+        ]
+        with self.conn:
+            for sql in statements:
+                self.conn.execute(sql)
+
+    def write(self, item, subjects, vehicles):
+        if not item.get('補習班代碼'):
+            # 沒有代碼的補習班無法作為主鍵，只保留在 CSV
+            self.skipped += 1
+            return
+        self.pending.append((item, subjects or [], vehicles or []))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        # 同一批中重複的補習班代碼只保留最後一筆，否則先刪後插會留下兩份科目與交通車
+        if len({item['補習班代碼'] for item, _, _ in self.pending}) < len(self.pending):
+            self.pending = list({record[0]['補習班代碼']: record for record in self.pending}.values())
+        with self.conn:
+            self.conn.executemany(self.sql_school, (
+                [item.get(c, '') for c in HEADER_SCHOOLS] for item, _, _ in self.pending
+            ))
+            ids = [(item['補習班代碼'],) for item, _, _ in self.pending]
+            for i, (sql_delete, sql_insert, header) in enumerate(self.sql_children):
+                self.conn.executemany(sql_delete, ids)
+                self.conn.executemany(sql_insert, (
+                    [row.get(c, '') for c in header]
+                    for record in self.pending for row in record[i + 1]
+                ))
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+def export_sqlite(path=SQLITE_PATH):
+    """由既有的 CSV 串流匯入 SQLite (續抓之後使用)；回傳匯入的補習班數"""
+    output = SqliteOutput(path)
+    count = 0
+    try:
+        for school, subjects, vehicles in iter_output_records():
+            output.write(school, subjects, vehicles)
+            count += 1
+    finally:
+        output.close()
+    return count - output.skipped
+
+def export_sqlite_main(argv=None):
+    parser = argparse.ArgumentParser(prog="scraper.py export-sqlite", description="將既有的 CSV 匯入 SQLite (upsert)")
+    parser.add_argument('--output', default=SQLITE_PATH, help=f"資料庫路徑 (預設 {SQLITE_PATH})")
+    args = parser.parse_args(argv)
+    count = export_sqlite(args.output)
+    print(f"已匯入 {count} 間補習班至 {args.output}")
+    return 0
+
+def content_hash(row, header):
+    """資料列內容的短雜湊 (依欄位順序，64 位元)"""
+    text = json.dumps([row.get(field) or '' for field in header], ensure_ascii=False)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+def parse_when(text, end_of_day=True):
+    """'YYYY-MM-DD' 或 ISO 時間；只有日期時視為當天結束 (end_of_day) 或開始"""
+    when = datetime.datetime.fromisoformat(text)
+    if len(text) <= 10 and end_of_day:
+        when = when.replace(hour=23, minute=59, second=59)
+    return when
+
+class HistoryStore:
+    """
+    補習班資料的變動歷史。
+    index.tsv.gz 保存上一次記錄時每間補習班的內容雜湊 (基本資料一個、每筆科目與交通車各一個)；
+    每次記錄以補習班代碼對索引做串流 hash join，只把新增 (added)、消失 (removed)、內容變動 (modified) 的補習班
+    附加到當月分割區的 deltas.jsonl.gz。modified 只帶有變動的部分 (school / subjects / vehicles) 的完整新內容，
+    因此重播是冪等的。每月第一次記錄時另存 base.jsonl.gz 完整快照，「某時間點的狀態」只需讀取一個快照與當月的差異。
+    """
+
+    def __init__(self, directory=HISTORY_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.tsv.gz")
+
+    def load_index(self):
+        """回傳 {補習班代碼: (縣市, 名稱, school 雜湊, 科目雜湊 tuple, 交通車雜湊 tuple)}"""
+        index = {}
+        if not os.path.exists(self.index_path):
+            return index
+        with gzip.open(self.index_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                school_id, county, name, school_hash, subjects, vehicles = line.rstrip('\n').split('\t')
+                index[school_id] = (county, name, school_hash,
+                                    tuple(filter(None, subjects.split(','))), tuple(filter(None, vehicles.split(','))))
+        return index
+
+    def partitions(self):
+        """依時間排序的月份分割區目錄名稱"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if re.fullmatch(r'\d{4}-\d{2}', name) and os.path.exists(self._path(name, 'base')))
+
+    def _path(self, partition, kind):
+        return os.path.join(self.directory, partition, f"{kind}.jsonl.gz")
+
+    def record(self, records, when=None):
+        """
+        以 (school, subjects, vehicles) 串流比對上一次的索引並附加差異，回傳各類變動數。
+        沒有補習班代碼的資料無法比對，只計數不記錄。
+        """
+        when = when or datetime.datetime.now().replace(microsecond=0)
+        ts = when.isoformat()
+        partition = when.strftime('%Y-%m')
+        os.makedirs(os.path.join(self.directory, partition), exist_ok=True)
+        old = self.load_index()
+        new = {}
+        counts = {'added': 0, 'removed': 0, 'modified': 0, 'unchanged': 0, 'skipped': 0}
+        base_path = self._path(partition, 'base')
+        write_base = not os.path.exists(base_path)
+        deltas_tmp = self._path(partition, 'deltas') + '.tmp'
+        base = gzip.open(base_path + '.tmp', 'wt', encoding='utf-8') if write_base else None
+        with ExitStack() as stack, gzip.open(deltas_tmp, 'wt', encoding='utf-8') as deltas:
+            if base is not None:
+                stack.enter_context(base)
+                base.write(json.dumps({'ts': ts}) + '\n')
+            for school, subjects, vehicles in records:
+                school_id = school.get('補習班代碼')
+                if not school_id or school_id in new:
+                    counts['skipped'] += 1
+                    continue
+                entry = (school.get('縣市', ''), school.get('補習班名稱', ''), content_hash(school, HEADER_SCHOOLS),
+                         tuple(content_hash(r, HEADER_SUBJECTS) for r in subjects),
+                         tuple(content_hash(r, HEADER_VEHICLES) for r in vehicles))
+                new[school_id] = entry
+                if base is not None:
+                    base.write(json.dumps({'id': school_id, 'school': school, 'subjects': subjects,
+                                           'vehicles': vehicles}, ensure_ascii=False, default=dict) + '\n')
+                prev = old.pop(school_id, None)
+                if prev is None:
+                    op, parts = 'added', (school, subjects, vehicles)
+                elif prev[2:] == entry[2:]:
+                    counts['unchanged'] += 1
+                    continue
+                else:
+                    op = 'modified'
+                    parts = tuple(value if prev[i] != entry[i] else None
+                                  for i, value in zip((2, 3, 4), (school, subjects, vehicles)))
+                counts[op] += 1
+                deltas.write(json.dumps({'ts': ts, 'op': op, 'id': school_id, 'county': entry[0], 'name': entry[1],
+                                         'school': parts[0], 'subjects': parts[1], 'vehicles': parts[2]},
+                                        ensure_ascii=False, default=dict) + '\n')
+            # 索引中剩下的補習班本次沒有出現
+            for school_id, (county, name, *_) in old.items():
+                counts['removed'] += 1
+                deltas.write(json.dumps({'ts': ts, 'op': 'removed', 'id': school_id, 'county': county, 'name': name},
+                                        ensure_ascii=False) + '\n')
+        if base is not None:
+            os.replace(base_path + '.tmp', base_path)
+        # 差異以完整的 gzip 成員附加，中斷時不會留下寫了一半的資料；之後才更新索引 (重複附加的差異重播時無害)
+        with open(deltas_tmp, 'rb') as src, open(self._path(partition, 'deltas'), 'ab') as dst:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.remove(deltas_tmp)
+        with gzip.open(self.index_path + '.tmp', 'wt', encoding='utf-8') as f:
+            for school_id, (county, name, school_hash, subjects, vehicles) in new.items():
+                f.write('\t'.join((school_id, county.replace('\t', ' '), name.replace('\t', ' '), school_hash,
+                                   ','.join(subjects), ','.join(vehicles))) + '\n')
+        os.replace(self.index_path + '.tmp', self.index_path)
+        return counts
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def iter_deltas(self, since=None, until=None):
+        """依時間產生 since < ts <= until 的差異記錄"""
+        for partition in self.partitions():
+            if until and partition > until.strftime('%Y-%m'):
+                break
+            if since and partition < since.strftime('%Y-%m'):
+                continue
+            for rec in self._read(self._path(partition, 'deltas')):
+                when = datetime.datetime.fromisoformat(rec['ts'])
+                if (since is None or when > since) and (until is None or when <= until):
+                    yield rec
+
+    def state_as_of(self, when):
+        """重建某時間點的 {補習班代碼: (school, subjects, vehicles)}；只讀取一個月份快照與該月的差異"""
+        chosen = base_ts = None
+        for partition in self.partitions():
+            meta = next(self._read(self._path(partition, 'base')))
+            if datetime.datetime.fromisoformat(meta['ts']) > when:
+                break
+            chosen, base_ts = partition, datetime.datetime.fromisoformat(meta['ts'])
+        state = {}
+        if chosen is None:
+            return state
+        for rec in itertools.islice(self._read(self._path(chosen, 'base')), 1, None):
+            state[rec['id']] = (rec['school'], rec['subjects'], rec['vehicles'])
+        for rec in self._read(self._path(chosen, 'deltas')):
+            ts = datetime.datetime.fromisoformat(rec['ts'])
+            if ts <= base_ts or ts > when:
+                continue
+            if rec['op'] == 'removed':
+                state.pop(rec['id'], None)
+                continue
+            current = state.get(rec['id'], (None, [], []))
+            state[rec['id']] = tuple(new if new is not None else cur
+                                     for new, cur in zip((rec['school'], rec['subjects'], rec['vehicles']), current))
+        return state
+
+def history_main(argv=None):
+    """變動歷史子命令：record (記錄目前的輸出)、changes (列出期間內的變動)、as-of (重建某時間點的 CSV)"""
+    parser = argparse.ArgumentParser(prog="scraper.py history", description="補習班資料的變動歷史")
+    parser.add_argument('--dir', default=HISTORY_DIR, help=f"歷史資料目錄 (預設 {HISTORY_DIR})")
+    sub = parser.add_subparsers(dest='action', required=True)
+    sub.add_parser('record', help="以目前的三個 CSV 比對上一次記錄並附加差異")
+    changes = sub.add_parser('changes', help="列出期間內新增、消失與變動的補習班")
+    changes.add_argument('--since', required=True, help="起始時間 (YYYY-MM-DD 或 ISO 時間，不含)")
+    changes.add_argument('--until', default=None, help="結束時間 (含，預設現在)")
+    changes.add_argument('--output', default=None, help="另將變動清單寫入此 CSV")
+    as_of = sub.add_parser('as-of', help="重建某時間點的 schools/subjects/vehicles.csv")
+    as_of.add_argument('when', help="時間點 (YYYY-MM-DD 視為當天結束，或 ISO 時間)")
+    as_of.add_argument('--output-dir', required=True, help="輸出目錄")
+    args = parser.parse_args(argv)
+    store = HistoryStore(args.dir)
+
+    if args.action == 'record':
+        if not os.path.exists(FILE_SCHOOLS):
+            print(f"找不到 {FILE_SCHOOLS}，請先執行抓取。")
+            return 1
+        counts = store.record(iter_output_records())
+        print(f"已記錄變動：新增 {counts['added']}、消失 {counts['removed']}、變動 {counts['modified']}、"
+              f"未變 {counts['unchanged']} 間")
+        return 0
+
+    if args.action == 'changes':
+        since = parse_when(args.since, end_of_day=False)
+        until = parse_when(args.until) if args.until else None
+        counts = {'added': 0, 'removed': 0, 'modified': 0}
+        out = open(args.output, 'w', newline='', encoding='utf-8-sig') if args.output else None
+        try:
+            writer = csv.writer(out) if out else None
+            if writer:
+                writer.writerow(['時間', '變動', '補習班代碼', '縣市', '補習班名稱', '變動部分'])
+            for rec in store.iter_deltas(since, until):
+                counts[rec['op']] += 1
+                if writer:
+                    parts = [name for name in ('school', 'subjects', 'vehicles') if rec.get(name) is not None]
+                    writer.writerow([rec['ts'], rec['op'], rec['id'], rec['county'], rec['name'], ','.join(parts)])
+        finally:
+            if out:
+                out.close()
+        print(f"{args.since} 之後：新增 {counts['added']}、消失 {counts['removed']}、變動 {counts['modified']} 間")
+        return 0
+
+    state = store.state_as_of(parse_when(args.when))
+    if not state:
+        print(f"{args.when} 之前沒有任何記錄。")
+        return 1
+    configure_output_dir(args.output_dir)
+    output = CsvOutput()
+    try:
+        for school, subjects, vehicles in state.values():
+            output.write(school, subjects, vehicles)
+    finally:
+        output.close()
+    print(f"已重建 {args.when} 的狀態：{len(state)} 間補習班，輸出至 {args.output_dir}")
+    return 0
+
+def split_values(text):
+    """拆開多值欄位，例如「文理類,其他類」→ ['文理類', '其他類']"""
+    return [v for v in MULTI_VALUE_RE.split(text.strip()) if v] if text else []
+
+def registration_year(text):
+    """立案日期的西元年份 (民國年自動換算)；無法解析時回傳 None"""
+    match = _DATE_RE.search(text) if text else None
+    if not match:
+        return None
+    year = int(match.group(1))
+    return year + 1911 if year < 1911 else year
+
+class Stats:
+    """
+    以 Counter 串流累計的統計，記憶體用量只與類別、科目等相異值的數量有關。
+    可由 collect_stats 讀取 CSV，也可以作為 Pipeline 的 sink 在抓取時累計。
+    """
+
+    def __init__(self, top=None):
+        self.top = dict(STATS_TOP, **(top or {}))
+        self.schools = 0
+        self.categories = Counter()
+        self.counties = Counter()
+        self.years = Counter()
+        self.subjects = Counter()
+        self.subject_rows = 0
+        self.vehicles = 0
+        # 每間補習班的交通車數分布，以及交通車最多的補習班 (大小固定的 heap)
+        self.vehicle_counts = Counter()
+        self.top_vehicles = []
+
+    def add_school(self, category, county, date):
+        self.schools += 1
+        self.categories.update(split_values(category))
+        if county:
+            self.counties[county] += 1
+        year = registration_year(date)
+        if year:
+            self.years[year] += 1
+
+    def add_subject(self, name):
+        self.subject_rows += 1
+        if name:
+            self.subjects[name.strip()] += 1
+
+    def add_vehicles(self, school_id, count):
+        self.vehicles += count
+        self.vehicle_counts[count] += 1
+        entry = (count, school_id)
+        if len(self.top_vehicles) < self.top['vehicles']:
+            heapq.heappush(self.top_vehicles, entry)
+        elif entry > self.top_vehicles[0]:
+            heapq.heapreplace(self.top_vehicles, entry)
+
+    def write(self, school, subjects, vehicles):
+        self.add_school(school.get('補習班類別/科目'), school.get('縣市'), school.get('立案日期'))
+        for row in subjects:
+            self.add_subject(row.get('核准科目名稱'))
+        if vehicles:
+            self.add_vehicles(school.get('補習班代碼'), len(vehicles))
+
+    def close(self):
+        pass
+
+    def report(self):
+        return {
+            'schools': self.schools,
+            'subject_rows': self.subject_rows,
+            'vehicles': self.vehicles,
+            'schools_with_vehicles': sum(self.vehicle_counts.values()),
+            'categories': self.categories.most_common(self.top['categories']),
+            'subjects': self.subjects.most_common(self.top['subjects']),
+            'counties': self.counties.most_common(self.top['counties']),
+            'years': self.years.most_common(self.top['years']),
+            'vehicles_per_school': sorted(self.vehicle_counts.items()),
+            'top_vehicle_schools': [(sid, n) for n, sid in sorted(self.top_vehicles, reverse=True)],
+        }
+
+    def markdown(self, date):
+        """README 的「資料統計摘要」章節"""
+        report = self.report()
+
+        def table(title, label, rows, ranked=True):
+            lines = [f"### {title}", f"| {'排名 | ' if ranked else ''}{label} | 數量 |",
+                     f"| {'--- | ' if ranked else ''}--- | --- |"]
+            for rank, (name, count) in enumerate(rows, start=1):
+                lines.append(f"| {f'{rank} | ' if ranked else ''}{name} | {count} |")
+            return '\n'.join(lines)
+
+        y, m, d = date.year, date.month, date.day
+        sections = [
+            f"{README_STATS_HEADING} ({date.isoformat()})",
+            f"以下數據基於 {y} 年 {m} 月 {d} 日抓取的資料，由 `python scraper.py stats --update-readme` 產生。\n"
+            f"共 {report['schools']} 間補習班、{report['subject_rows']} 筆核准科目、{report['vehicles']} 輛交通車。",
+            table(f"補習班類別統計 (前 {self.top['categories']} 名)", "類別名稱", report['categories']),
+            table(f"核准科目統計 (前 {self.top['subjects']} 名)", "科目名稱", report['subjects']),
+            table("縣市統計", "縣市", report['counties']),
+            table(f"立案年度統計 (前 {self.top['years']} 名)", "立案年度", report['years']),
+            table("交通車統計", "每間交通車數", report['vehicles_per_school'], ranked=False),
+        ]
+        return '\n\n'.join(sections) + '\n'
+
+def iter_csv_rows(paths, columns):
+    """串流讀取一或多個 CSV (可為多份快照串接，重複的表頭列會略過)，只產生 columns 欄位的值"""
+    for path in paths:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                continue
+            index = [header.index(c) if c in header else None for c in columns]
+            width = len(header)
+            for row in reader:
+                if row == header:
+                    continue
+                if len(row) < width:
+                    row += [''] * (width - len(row))
+                yield [row[i] if i is not None else '' for i in index]
+
+def collect_stats(school_paths, subject_paths, vehicle_paths, top=None):
+    """單次串流讀取三種 CSV 累計統計；交通車檔依補習班連續排列，逐段計數即可得到每間的車輛數"""
+    stats = Stats(top)
+    for category, county, date in iter_csv_rows(school_paths, ['補習班類別/科目', '縣市', '立案日期']):
+        stats.add_school(category, county, date)
+    for (name,) in iter_csv_rows(subject_paths, ['核准科目名稱']):
+        stats.add_subject(name)
+    current, count = None, 0
+    for (school_id,) in iter_csv_rows(vehicle_paths, ['補習班代碼']):
+        if school_id != current:
+            if count:
+                stats.add_vehicles(current, count)
+            current, count = school_id, 0
+        count += 1
+    if count:
+        stats.add_vehicles(current, count)
+    return stats
+
+def update_readme(path, section):
+    """以新的統計章節取代 README 中的「資料統計摘要」章節 (到下一個二級標題為止)"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    start = text.find(README_STATS_HEADING)
+    if start < 0:
+        raise ValueError(f"{path} 中找不到「{README_STATS_HEADING}」章節")
+    end = text.find('\n## ', start + len(README_STATS_HEADING))
+    end = len(text) if end < 0 else end + 1
+    _write_text_atomic(path, text[:start] + section + ('\n' if end < len(text) else '') + text[end:])
+
+def stats_main(argv=None):
+    parser = argparse.ArgumentParser(prog="scraper.py stats", description="串流統計類別、科目、縣市、立案年度與交通車")
+    parser.add_argument('--schools', nargs='+', default=None, metavar='CSV', help=f"補習班檔 (預設 {FILE_SCHOOLS})")
+    parser.add_argument('--subjects', nargs='+', default=None, metavar='CSV', help=f"科目檔 (預設 {FILE_SUBJECTS})")
+    parser.add_argument('--vehicles', nargs='+', default=None, metavar='CSV', help=f"交通車檔 (預設 {FILE_VEHICLES})")
+    parser.add_argument('--top', type=int, default=None, help="各表列出的名次數 (預設類別 10、科目 20、縣市全部、年度 10)")
+    parser.add_argument('--json', metavar='PATH', help="另將統計結果寫成 JSON")
+    parser.add_argument('--update-readme', nargs='?', const='README.md', default=None, metavar='PATH',
+                        help="以統計結果更新 README 的「資料統計摘要」章節 (預設 README.md)")
+    args = parser.parse_args(argv)
+
+    paths = [args.schools or [FILE_SCHOOLS], args.subjects or [FILE_SUBJECTS], args.vehicles or [FILE_VEHICLES]]
+    paths = [[p for p in group if os.path.exists(p)] for group in paths]
+    if not paths[0]:
+        print(f"找不到 {FILE_SCHOOLS}，請先執行抓取。")
+        return 1
+    top = {key: args.top for key in STATS_TOP} if args.top else None
+    start = time.perf_counter()
+    stats = collect_stats(*paths, top=top)
+    date = datetime.date.fromtimestamp(max(os.path.getmtime(p) for p in paths[0]))
+    section = stats.markdown(date)
+    print(section)
+    print(f"(耗時 {time.perf_counter() - start:.2f} 秒)")
+    if args.json:
+        _write_text_atomic(args.json, json.dumps(stats.report(), ensure_ascii=False, indent=2) + '\n')
+    if args.update_readme:
+        update_readme(args.update_readme, section)
+        print(f"已更新 {args.update_readme}")
+    return 0
+
+class QueryIndex:
+    """
+    三個 CSV 的唯讀記憶體索引。補習班以列序號 (doc) 識別，基本資料存為 tuple，科目與交通車依 doc 分組；
+    補習班代碼與牌照號碼為雜湊索引，縣市、類別 (多值拆開)、核准科目名稱為倒排索引，
+    補習班名稱與班址建立單字與雙字 n-gram 索引供子字串搜尋。倒排串列為遞增的 array('I')。
+    最近查詢的完整結果保留在 LRU 中，翻頁時不必重新交集；重新載入時連同索引一起替換。
+    """
+
+    TERMS = {'county': '縣市', 'category': '補習班類別/科目', 'subject': '核准科目名稱'}
+    TEXT = {'name': '補習班名稱', 'address': '班址'}
+
+    def __init__(self, records):
+        self.schools = []
+        self.subjects = []
+        self.vehicles = []
+        self.by_id = {}
+        self.by_plate = {}
+        self.terms = {key: {} for key in self.TERMS}
+        self.grams = {key: {} for key in self.TEXT}
+        self.texts = {key: [] for key in self.TEXT}
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        school_id = HEADER_SCHOOLS.index('補習班代碼')
+        county = HEADER_SCHOOLS.index('縣市')
+        category = HEADER_SCHOOLS.index('補習班類別/科目')
+        for school, subjects, vehicles in records:
+            doc = len(self.schools)
+            row = tuple(sys.intern(school.get(f) or '') if i in (county, category) else school.get(f) or ''
+                        for i, f in enumerate(HEADER_SCHOOLS))
+            self.schools.append(row)
+            self.subjects.append(tuple(tuple(sys.intern(r.get(f) or '') for f in HEADER_SUBJECTS[1:]) for r in subjects))
+            self.vehicles.append(tuple(tuple(r.get(f) or '' for f in HEADER_VEHICLES[1:]) for r in vehicles))
+            if row[school_id]:
+                self.by_id.setdefault(row[school_id], doc)
+            for r in self.vehicles[doc]:
+                if r[0]:
+                    self.by_plate.setdefault(r[0], doc)
+            self._post('county', [row[county]], doc)
+            self._post('category', split_values(row[category]), doc)
+            self._post('subject', [r[0] for r in self.subjects[doc]], doc)
+            for key, field in self.TEXT.items():
+                text = row[HEADER_SCHOOLS.index(field)].lower()
+                self.texts[key].append(text)
+                postings = self.grams[key]
+                for gram in set(text) | {text[i:i + 2] for i in range(len(text) - 1)}:
+                    postings.setdefault(gram, array('I')).append(doc)
+
+    def _post(self, key, values, doc):
+        postings = self.terms[key]
+        for value in values:
+            if not value:
+                continue
+            lst = postings.setdefault(value, array('I'))
+            if not lst or lst[-1] != doc:
+                lst.append(doc)
+
+    def __len__(self):
+        return len(self.schools)
+
+    def record(self, doc):
+        school = dict(zip(HEADER_SCHOOLS, self.schools[doc]))
+        school['subjects'] = [dict(zip(HEADER_SUBJECTS[1:], r)) for r in self.subjects[doc]]
+        school['vehicles'] = [dict(zip(HEADER_VEHICLES[1:], r)) for r in self.vehicles[doc]]
+        return school
+
+    def get(self, school_id=None, plate=None):
+        doc = self.by_id.get(school_id) if school_id else self.by_plate.get(plate)
+        return None if doc is None else self.record(doc)
+
+    def _substring(self, key, query):
+        """
+        子字串的候選 doc：查詢字串中最少見的兩個雙字 (單字查詢用單字) 的倒排串列。
+        長於兩字時候選可能不相鄰或不完整，需再比對原文。
+        """
+        query = query.lower()
+        grams = {query[i:i + 2] for i in range(len(query) - 1)} or {query}
+        lists = sorted((self.grams[key].get(gram, ()) for gram in grams), key=len)[:2]
+        return lists, (query if len(query) > 2 else None)
+
+    @staticmethod
+    def _intersect(lists):
+        """
+        遞增串列的交集。對方遠大於目前結果時逐一二分搜尋，否則以 set 在 C 層比對整個串列；
+        結果維持遞增 (即 CSV 順序)，分頁才穩定。
+        """
+        lists = sorted(lists, key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            if not result:
+                break
+            n = len(other)
+            if len(result) * 16 < n:
+                result = [doc for doc in result
+                          if (i := bisect.bisect_left(other, doc)) < n and other[i] == doc]
+            else:
+                result = sorted(set(result).intersection(other))
+        return result
+
+    def search(self, page=1, limit=QUERY_PAGE_SIZE, **filters):
+        """
+        依條件查詢，各條件取交集。filters：id、plate (完全相符)；county、category、subject (完全相符，縣市的「台」視同「臺」)；
+        name、address (子字串)。未給任何條件時列出全部。回傳 (符合總數, 該頁的補習班)。
+        """
+        key = tuple(sorted((k, v) for k, v in filters.items() if v))
+        with self._cache_lock:
+            docs = self._cache.pop(key, None)
+        if docs is None:
+            docs = self._match(filters)
+        with self._cache_lock:
+            self._cache[key] = docs
+            if len(self._cache) > QUERY_CACHE_SIZE:
+                del self._cache[next(iter(self._cache))]
+        start = (max(page, 1) - 1) * limit
+        return len(docs), [self.record(doc) for doc in docs[start:start + limit]]
+
+    def _match(self, filters):
+        """符合全部條件的 doc (遞增)"""
+        if filters.get('id') or filters.get('plate'):
+            doc = self.by_id.get(filters['id']) if filters.get('id') else self.by_plate.get(filters['plate'])
+            docs = [] if doc is None else [doc]
+            if filters.get('id') and filters.get('plate') and self.by_plate.get(filters['plate']) != doc:
+                docs = []
+            filters = {k: v for k, v in filters.items() if k not in ('id', 'plate')}
+            lists = [docs]
+        else:
+            lists = []
+        verify = []
+        for key, value in filters.items():
+            if not value:
+                continue
+            if key in self.TERMS:
+                if key == 'county':
+                    value = value.replace('台', '臺')
+                lists.append(self.terms[key].get(value, ()))
+            elif key in self.TEXT:
+                grams, query = self._substring(key, value)
+                lists.extend(grams)
+                if query:
+                    verify.append((self.texts[key], query))
+            else:
+                raise ValueError(f"不支援的查詢條件：{key}")
+        docs = self._intersect(lists) if lists else range(len(self.schools))
+        if verify:
+            docs = [doc for doc in docs if all(query in texts[doc] for texts, query in verify)]
+        return docs
+
+    def summary(self):
+        return {
+            'schools': len(self.schools),
+            'subjects': sum(map(len, self.subjects)),
+            'vehicles': len(self.by_plate),
+            'counties': len(self.terms['county']),
+            'categories': len(self.terms['category']),
+            'subject_names': len(self.terms['subject']),
+        }
+
+class QueryService:
+    """
+    持有目前的 QueryIndex，並在新一次抓取完成時重新載入。
+    只以 journal 的 end 記錄 (抓取或補抓完整結束後寫入) 作為完成訊號，且三個 CSV 的大小須與記錄相符；
+    抓取進行中、中斷或剛截斷輸出檔時都不會重新載入。
+    新索引在背景建好後才替換參照，查詢中的請求繼續使用舊索引，不會看到寫了一半的資料。
+    """
+
+    def __init__(self, paths=None, journal=None):
+        self.paths = paths or (FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES)
+        # 預設為輸出檔所在目錄的 journal
+        self.journal = journal or os.path.join(os.path.dirname(self.paths[0]), os.path.basename(FILE_JOURNAL))
+        self.index = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.completed = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _completion(self):
+        """目前輸出檔對應的 end 記錄；沒有完成訊號或檔案已不是該次抓取的結果時回傳 None"""
+        rec = CrawlJournal.completion(self.journal)
+        if rec is None:
+            return None
+        try:
+            sizes = [os.path.getsize(path) for path in self.paths]
+        except OSError:
+            return None
+        return rec if sizes == rec.get('offsets') else None
+
+    def load(self):
+        """(重新) 建立索引並以單一參照替換；回傳新索引。重新載入期間輸出檔又被改寫時保留舊索引並回傳 None"""
+        with self._lock:
+            completed = self._completion()
+            start = time.perf_counter()
+            index = QueryIndex(iter_output_records(self.paths))
+            if self.index is not None and self._completion() != completed:
+                return None
+            if self.index is not None:
+                self.reloads += 1
+            self.index, self.completed = index, completed
+            self.loaded_at = datetime.datetime.now().isoformat(timespec='seconds')
+            METRICS.observe('query_load', time.perf_counter() - start)
+            return index
+
+    def poll(self):
+        """出現新的完成訊號時重新載入；回傳是否已重新載入"""
+        completed = self._completion()
+        if completed is None or completed == self.completed:
+            return False
+        try:
+            if self.load() is None:
+                return False
+        except (OSError, csv.Error) as e:
+            print(f"重新載入失敗，繼續使用舊索引：{e}")
+            return False
+        print(f"已重新載入 {len(self.index)} 間補習班")
+        return True
+
+    def watch(self, interval=QUERY_RELOAD_INTERVAL):
+        def run():
+            while not self._stop.wait(interval):
+                self.poll()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self._stop.set()
+
+    def info(self):
+        return dict(self.index.summary(), loaded_at=self.loaded_at, reloads=self.reloads)
+
+def query_params(params):
+    """由查詢參數 (多值時取第一個) 取出 search() 的條件與分頁"""
+    filters = {key: values[0] for key, values in params.items() if values and values[0]}
+    page = int(filters.pop('page', 1))
+    limit = min(int(filters.pop('limit', QUERY_PAGE_SIZE)), QUERY_MAX_PAGE_SIZE)
+    return page, limit, filters
+
+def run_query(index, page, limit, filters):
+    start = time.perf_counter()
+    total, results = index.search(page=page, limit=limit, **filters)
+    took = time.perf_counter() - start
+    METRICS.observe('query', took)
+    return {'total': total, 'page': page, 'limit': limit, 'took_ms': round(took * 1000, 3), 'results': results}
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    GET /search?county=&category=&subject=&name=&address=&id=&plate=&page=&limit=
+    GET /schools/<補習班代碼>、/vehicles/<牌照號碼>、/info；回應皆為 JSON
+    """
+
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/')]
+        index = self.service.index
+        try:
+            if parts == ['search']:
+                return self._send(200, run_query(index, *query_params(parse_qs(url.query))))
+            if len(parts) == 2 and parts[0] in ('schools', 'vehicles') and parts[1]:
+                record = index.get(**{'school_id' if parts[0] == 'schools' else 'plate': parts[1]})
+                return self._send(200, record) if record else self._send(404, {'error': f"找不到 {parts[1]}"})
+            if parts == ['info']:
+                return self._send(200, self.service.info())
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        self._send(404, {'error': f"未知的路徑 {url.path}"})
+
+def query_main(argv=None):
+    """查詢子命令：search (單次查詢並輸出 JSON)、serve (本機 HTTP 查詢服務，新抓取完成時自動重新載入)"""
+    parser = argparse.ArgumentParser(prog="scraper.py query", description="以記憶體索引查詢抓取結果")
+    parser.add_argument('--output-dir', default=None, help="讀取此目錄下的三個 CSV (預設目前目錄)")
+    sub = parser.add_subparsers(dest='action', required=True)
+    search = sub.add_parser('search', help="單次查詢")
+    for key, help in (('id', "補習班代碼"), ('plate', "交通車牌照號碼"), ('county', "縣市"),
+                      ('category', "補習班類別"), ('subject', "核准科目名稱"),
+                      ('name', "補習班名稱 (子字串)"), ('address', "班址 (子字串)")):
+        search.add_argument(f'--{key}', default=None, help=help)
+    search.add_argument('--page', type=int, default=1, help="頁碼 (從 1 開始)")
+    search.add_argument('--limit', type=int, default=QUERY_PAGE_SIZE, help=f"每頁筆數 (預設 {QUERY_PAGE_SIZE})")
+    serve = sub.add_parser('serve', help="啟動本機 HTTP 查詢服務")
+    serve.add_argument('--host', default='127.0.0.1', help="監聽位址 (預設 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=QUERY_PORT, help=f"埠號 (預設 {QUERY_PORT})")
+    serve.add_argument('--reload-interval', type=float, default=QUERY_RELOAD_INTERVAL,
+                       help=f"檢查新一次抓取是否完成的間隔秒數，0 表示不自動重新載入 (預設 {QUERY_RELOAD_INTERVAL:g})")
+    args = parser.parse_args(argv)
+    if args.output_dir:
+        configure_output_dir(args.output_dir)
+    if not os.path.exists(FILE_SCHOOLS):
+        print(f"找不到 {FILE_SCHOOLS}，請先執行抓取。")
+        return 1
+
+    service = QueryService()
+    start = time.perf_counter()
+    index = service.load()
+
+    if args.action == 'search':
+        filters = {key: getattr(args, key) for key in ('id', 'plate', *QueryIndex.TERMS, *QueryIndex.TEXT)}
+        try:
+            result = run_query(index, args.page, min(args.limit, QUERY_MAX_PAGE_SIZE), filters)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"已載入 {len(index)} 間補習班 ({time.perf_counter() - start:.2f} 秒)，"
+          f"查詢服務位於 http://{args.host}:{args.port}/search")
+    if args.reload_interval > 0:
+        service.watch(args.reload_interval)
+    handler = type('Handler', (QueryHandler,), {'service': service})
+    httpd = ThreadingHTTPServer((args.host, args.port), handler)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        httpd.server_close()
+    return 0
+
+def parse_month(text):
+    """'YYYY-MM' → (年, 月)；argparse 型別"""
+    match = re.fullmatch(r'(\d{4})-(\d{1,2})', text.strip())
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise argparse.ArgumentTypeError(f"月份格式應為 YYYY-MM：{text}")
+    return int(match.group(1)), int(match.group(2))
+
+def format_month(month):
+    return f"{month[0]:04d}-{month[1]:02d}"
+
+def get_cancel_list(session, county_code, start, end):
+    """抓取單一縣市在 start～end 月份 (含) 的廢止／註銷列印頁，失敗時回傳 None"""
+    params = {
+        'pageno': 1, 'citylink': '', 'unit': '', 'c_type': '', 'area': '', 'road': '',
+        'sn_year': start[0], 'sn_month': f"{start[1]:02d}", 'end_year': end[0], 'end_month': f"{end[1]:02d}",
+        'city': county_code, 'pnt': 2, 'local': '',
+    }
+    try:
+        with METRICS.timer('fetch_cancel_list'):
+            response = session.get(CANCEL_PRINT_URL, params=params, verify=False,
+                                   headers=dict(HEADERS, Referer=CANCEL_LIST_URL))
+            response.raise_for_status()
+        METRICS.add_bytes('print_cancel_list_b.jsp', len(response.content))
+        response.encoding = 'utf-8'
+        return response.text
+    except Exception as e:
+        print(f"Error fetching cancellations {county_code}: {e}")
+        return None
+
+@timed('parse_cancel_list')
+def parse_cancel_list(html_content, county_name):
+    """解析廢止／註銷列印頁的表格 (第一列為表頭)，回傳 HEADER_CANCELLATIONS 欄位的 list；找不到表格時回傳 None"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    table = soup.find('table')
+    if table is None:
+        return None
+    rows = table.find_all('tr')
+    # 表頭含空白，如「班 址」「電 話」
+    headers = [re.sub(r'\s+', '', th.get_text()) for th in rows[0].find_all(['th', 'td'])] if rows else []
+    data = []
+    for row in rows[1:]:
+        cols = row.find_all('td')
+        if not cols:
+            continue
+        values = dict(zip(headers, (c.get_text(strip=True) for c in cols)))
+        record = {field: values.get(field, '') for field in HEADER_CANCELLATIONS}
+        record['縣市'] = county_name
+        data.append(record)
+    return data
+
+def load_name_index():
+    """由既有輸出 (含 *.prev.csv) 建立 (縣市, 補習班名稱) → 補習班代碼 的索引，用來替廢止名單補上代碼"""
+    index = {}
+    for path in (prev_path(FILE_SCHOOLS), FILE_SCHOOLS):
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                if row.get('補習班代碼'):
+                    index[(row.get('縣市', ''), row.get('補習班名稱', ''))] = row['補習班代碼']
+    return index
+
+def cancellations_main(argv=None):
+    """
+    增量抓取各縣市的廢止／註銷名單並附加至 cancellations.csv。
+    每個縣市記錄已抓到的最後月份，下次只從該月 (可能未滿一個月，因此含該月) 抓到本月；重疊部分以 CANCEL_KEY 去除重複。
+    """
+    parser = argparse.ArgumentParser(prog="scraper.py cancellations", description="增量抓取各縣市的廢止／註銷名單")
+    add_session_args(parser)
+    parser.add_argument('--output', default=FILE_CANCELLATIONS, help=f"輸出 CSV (預設 {FILE_CANCELLATIONS})")
+    parser.add_argument('--state', default=FILE_CANCEL_STATE,
+                        help=f"記錄各縣市已抓取月份的檔案 (預設 {FILE_CANCEL_STATE})")
+    parser.add_argument('--since', type=parse_month, default=None, metavar='YYYY-MM',
+                        help=f"起始月份；未指定時接續上次的月份，第一次執行為 {CANCEL_START}")
+    parser.add_argument('--until', type=parse_month, default=None, metavar='YYYY-MM', help="結束月份 (預設本月)")
+    parser.add_argument('--counties', type=parse_county, nargs='+', default=None, metavar='COUNTY',
+                        help="只抓取這些縣市 (預設全部)")
+    args = parser.parse_args(argv)
+
+    today = datetime.date.today()
+    until = args.until or (today.year, today.month)
+    state = {}
+    if os.path.exists(args.state):
+        with open(args.state, encoding='utf-8') as f:
+            state = json.load(f)
+    windows = []
+    for name, code in args.counties or COUNTIES.items():
+        start = args.since or parse_month(state.get(str(code), CANCEL_START))
+        if start > until:
+            continue
+        windows.append((name, code, start))
+    if not windows:
+        print("沒有需要抓取的月份。")
+        return 0
+
+    # 既有資料只保留識別欄位在記憶體中
+    seen = set()
+    exists = os.path.exists(args.output)
+    if exists:
+        with open(args.output, newline='', encoding='utf-8-sig') as f:
+            seen = {tuple(row.get(k, '') for k in CANCEL_KEY) for row in csv.DictReader(f)}
+    ids = load_name_index()
+
+    session, workers = open_session(args)
+    # 查詢頁會建立列印頁所需的伺服器端 session (取代 backup/ 中寫死的 Cookie)；每個 Session 重新暖機時也會再造訪
+    try:
+        session.add_warmup(CANCEL_LIST_URL)
+    except Exception as e:
+        print(f"Error initializing cancellation list: {e}")
+
+    def fetch(window):
+        name, code, start = window
+        html = get_cancel_list(session, code, start, until)
+        return window, parse_cancel_list(html, name) if html else None
+
+    added = 0
+    failed = []
+    with open(args.output, 'a', newline='', encoding='utf-8-sig') as f, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        writer = csv.DictWriter(f, fieldnames=HEADER_CANCELLATIONS)
+        if not exists:
+            writer.writeheader()
+        for (name, code, start), rows in ordered_map(executor, fetch, windows, workers * 4):
+            if rows is None:
+                failed.append(name)
+                continue
+            new = 0
+            for row in rows:
+                key = tuple(row[k] for k in CANCEL_KEY)
+                if key in seen:
+                    continue
+                seen.add(key)
+                row['補習班代碼'] = ids.get((name, row['補習班']), '')
+                writer.writerow(row)
+                new += 1
+            f.flush()
+            added += new
+            # 本月尚未結束，下次從結束月份重新抓取；回補較早的月份時不倒退既有進度
+            previous = state.get(str(code))
+            state[str(code)] = format_month(max(until, parse_month(previous)) if previous else until)
+            _write_text_atomic(args.state, json.dumps(state, ensure_ascii=False, indent=2) + '\n')
+            print(f"{name}：{format_month(start)}～{format_month(until)} 共 {len(rows)} 筆，新增 {new} 筆")
+    print(f"完成：新增 {added} 筆廢止／註銷資料至 {args.output}")
+    if failed:
+        print(f"{len(failed)} 個縣市抓取失敗：{'、'.join(failed)}；下次執行會重抓其月份")
+        return 1
+    return 0
+
+SchoolRecord = namedtuple('SchoolRecord', ['school', 'subjects', 'vehicles'])
+
+class Pipeline:
+    """
+    可匯入使用的串流抓取流程，各階段皆為產生器：
+    list_entries (列表頁) → detail_entries (抓取詳細頁 → 解析) → records / subjects / vehicles。
+    詳細頁在 executor 的執行緒中抓取 (最多 window 個在途)，在背景執行緒解析，再經由最多 queue_size 筆的佇列交給呼叫端；
+    呼叫端處理較慢時上游會暫停，記憶體用量與資料總量無關。
+    parse_procs > 0 時，抓取執行緒只取回未解碼的內容，由該數量的子行程平行解析，結果仍依列表順序產生。
+
+    sink 為任何具有 write(school, subjects, vehicles) 與 close() 的物件，例如 CsvOutput、ParquetOutput、SqliteOutput：
+
+        session = get_session(8, rps=8)
+        with Pipeline(session, workers=8, filters={'p_city': 20}) as pipe:
+            for school, subjects, vehicles in pipe.records():
+                ...
+    """
+
+    def __init__(self, session, workers=DEFAULT_WORKERS, window=None, queue_size=None, filters=None,
+                 bulk=False, counties=None, id_index=None, opendata=None, snapshot=None, master_only=False,
+                 dead_letter=None, skip_pages=(), skip_keys=(), parse_procs=0):
+        self.session = session
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        # 以 spawn 建立子行程，避免在已有執行緒的行程中 fork
+        self.parse_pool = None
+        self.parse_window = max(parse_procs, 1) * 4
+        if parse_procs > 0:
+            self.parse_pool = ProcessPoolExecutor(parse_procs, mp_context=multiprocessing.get_context('spawn'))
+        self.window = window or max(workers, 1) * 4
+        self.queue_size = queue_size or self.window
+        self.filters = filters
+        self.bulk = bulk
+        self.counties = counties
+        self.id_index = id_index
+        self.opendata = opendata
+        self.snapshot = snapshot or {}
+        self.master_only = master_only
+        self.dead_letter = dead_letter
+        self.skip_pages = skip_pages
+        self.skip_keys = skip_keys
+        self.first_page = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.parse_pool:
+            self.parse_pool.shutdown(wait=False, cancel_futures=True)
+
+    def total_count(self):
+        """抓取第一頁並回傳總筆數；第一頁抓取失敗時回傳 None。第一頁只建立一次 soup，列表解析時沿用"""
+        if self.first_page is None:
+            html = get_page_content(self.session, 1, self.filters)
+            if not html:
+                return None
+            self.first_page = list_soup(html)
+        return parse_total_count(self.first_page)
+
+    def total_pages(self):
+        if self.bulk:
+            return len(self.counties or COUNTIES)
+        return math.ceil((self.total_count() or 0) / ITEMS_PER_PAGE)
+
+    def list_entries(self):
+        """依頁序產生 (page, item)，每頁結束時產生 (page, None) 標記 (見 iter_list_items)"""
+        if self.bulk:
+            return iter_bulk_list_items(self.session, self.executor, self.window, skip_pages=self.skip_pages,
+                                        dead_letter=self.dead_letter, id_index=self.id_index, counties=self.counties)
+        total_pages = self.total_pages()
+        if not self.first_page:
+            raise RuntimeError("無法取得第一頁")
+        return iter_list_items(self.session, self.executor, self.first_page, total_pages, self.window,
+                               skip_pages=self.skip_pages, dead_letter=self.dead_letter, filters=self.filters)
+
+    def list_items(self):
+        """只有列表欄位的補習班 (不抓詳細頁)"""
+        for _, item in self.list_entries():
+            if item is not None:
+                yield item
+
+    def _pending(self):
+        # 略過已完成的補習班 (無代碼者以 頁碼#序號 識別)
+        index = 0
+        for page, item in self.list_entries():
+            if item is None:
+                index = 0
+                yield page, None, None
+                continue
+            key = item.get('補習班代碼') or f"{page}#{index}"
+            index += 1
+            if key not in self.skip_keys:
+                yield page, key, item
+
+    def _fetch(self, entry):
+        """抓取階段 (executor 執行緒)：回傳詳細頁 HTML，或不需抓取時直接回傳 (info, subjects, vehicles)"""
+        page, key, item = entry
+        if item is None:
+            return page, key, item, None, None
+        school_id = item.get('補習班代碼')
+        # 開放資料可提供的欄位以 JSON 為準，詳細頁只用來補齊其餘欄位、科目與交通車
+        known = self.opendata.lookup(item) if self.opendata else None
+        if self.master_only or not school_id:
+            return page, key, item, known, (School(), [], [])
+        carried = carry_forward(self.snapshot, item) if self.snapshot else None
+        if carried:
+            METRICS.incr('delta_carried')
+            return page, key, item, known, carried
+        if self.snapshot:
+            METRICS.incr('delta_fetched')
+        try:
+            detail = fetch_detail_page(self.session, school_id)
+        except Exception as e:
+            self._failed(page, school_id, e)
+            return page, key, item, known, (School(), [], [])
+        if self.dead_letter:
+            self.dead_letter.settle('detail', school_id)
+        return page, key, item, known, detail
+
+    def _failed(self, page, school_id, error):
+        print(f"Error fetching details for {school_id}: {error}")
+        if self.dead_letter:
+            self.dead_letter.add('detail', school_id, error, page)
+
+    def _parse(self, fetched):
+        """解析階段：依序解析抓取階段的結果 (或交給行程池，最多 parse_window 頁在途)，並套用開放資料欄位"""
+        pending = deque()
+        for entry in fetched:
+            page, key, item, known, detail = entry
+            future = None
+            if self.parse_pool and isinstance(detail, RawPage):
+                future = self.parse_pool.submit(parse_detail_page, detail, item['補習班代碼'], PARSER)
+            pending.append((entry, future))
+            if len(pending) >= self.parse_window:
+                yield self._parsed(*pending.popleft())
+        while pending:
+            yield self._parsed(*pending.popleft())
+
+    def _parsed(self, entry, future):
+        page, key, item, known, detail = entry
+        if item is None:
+            return page, key, None, {}, [], []
+        try:
+            if future:
+                *detail, seconds = future.result()
+                METRICS.observe('parse_detail', seconds)
+            elif isinstance(detail, RawPage):
+                detail = parse_school_details(decode_page(detail), item['補習班代碼'])
+        except Exception as e:
+            if future:
+                METRICS.error('parse_detail', e)
+            self._failed(page, item['補習班代碼'], e)
+            detail = (School(), [], [])
+        info, subjects, vehicles = detail
+        if known:
+            info.update(known)
+        return page, key, item, info, subjects, vehicles
+
+    def detail_entries(self):
+        """依列表順序產生 (page, key, item, info, subjects, vehicles)；item 為 None 時為頁面完成標記"""
+        fetched = ordered_map(self.executor, self._fetch, self._pending(), self.window)
+        return bounded(self._parse(fetched), self.queue_size)
+
+    def records(self):
+        """依列表順序產生 SchoolRecord(school, subjects, vehicles)，school 已合併詳細欄位"""
+        for _, _, item, info, subjects, vehicles in self.detail_entries():
+            if item is not None:
+                item.update(info)
+                yield SchoolRecord(item, subjects, vehicles)
+
+    def subjects(self):
+        for record in self.records():
+            yield from record.subjects
+
+    def vehicles(self):
+        for record in self.records():
+            yield from record.vehicles
+
+    def run(self, *sinks):
+        """把所有補習班寫入 sinks，結束時關閉 sinks，回傳寫入的補習班數"""
+        count = 0
+        try:
+            for record in self.records():
+                for sink in sinks:
+                    sink.write(*record)
+                count += 1
+        finally:
+            for sink in sinks:
+                sink.close()
+        return count
+
+class CrawlJournal:
+    """
+    續抓用的檢查點日誌 (JSON Lines)。
+    每寫完一間補習班記錄一筆 school，每頁完成記錄一筆 page，兩者都附上當下三個 CSV 的檔案位置；
+    續抓時以最後一筆記錄的位置截斷輸出檔，並略過已完成的頁面與補習班。
+    抓取完整結束時記錄一筆 end，查詢服務以它作為輸出檔已寫完的訊號。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done_pages = set()
+        self.done_keys = set()
+        self.offsets = None
+        self.mode = None
+        self.ended = False
+        self.f = None
+
+    def load(self):
+        """讀取既有 journal，回傳是否有可續抓的檢查點"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # 中斷時寫了一半的最後一行
+                    break
+                if rec['type'] == 'start':
+                    self.mode = rec.get('mode')
+                elif rec['type'] == 'school':
+                    self.done_keys.add(rec['key'])
+                elif rec['type'] == 'page':
+                    self.done_pages.add(rec['page'])
+                if rec['type'] != 'rewrite':
+                    self.ended = rec['type'] == 'end'
+                if 'offsets' in rec:
+                    self.offsets = rec['offsets']
+        return self.offsets is not None
+
+    def open(self, resume, offsets, mode=None):
+        self.f = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        if not resume:
+            self._append({'type': 'start', 'mode': mode, 'offsets': offsets}, sync=True)
+
+    def school_done(self, page, key, offsets):
+        self.done_keys.add(key)
+        self._append({'type': 'school', 'page': page, 'key': key, 'offsets': offsets})
+
+    def page_done(self, page, offsets):
+        self.done_pages.add(page)
+        self._append({'type': 'page', 'page': page, 'offsets': offsets}, sync=True)
+
+    def rewritten(self, offsets):
+        """輸出檔被整個改寫 (例如 redrive) 後，記錄新的檔案位置，避免續抓時截斷到舊位置"""
+        self._append({'type': 'rewrite', 'offsets': offsets}, sync=True)
+
+    def finished(self, offsets):
+        """輸出檔已完整寫出 (offsets 為最終的檔案大小)"""
+        self.ended = True
+        self._append({'type': 'end', 'offsets': offsets, 'time': time.time()}, sync=True)
+
+    @staticmethod
+    def completion(path):
+        """journal 的最後一筆若為 end 則回傳該記錄，否則 (抓取進行中、中斷或沒有 journal) 回傳 None"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(max(0, f.seek(0, os.SEEK_END) - 4096))
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return None
+        try:
+            rec = json.loads(lines[-1]) if lines else None
+        except ValueError:
+            return None
+        return rec if rec and rec.get('type') == 'end' else None
+
+    def _append(self, rec, sync=False):
+        self.f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+        self.f.flush()
+        if sync:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+def count_rows(path):
+    """CSV 資料列數 (不含表頭)；檔案不存在時回傳 0"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+def load_manifest(path=None):
+    path = path or FILE_MANIFEST
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(county, code, complete, **extra):
+    """記錄分片的縣市、完成狀態與各輸出檔列數；merge 只合併 complete 為 true 的分片"""
+    manifest = {
+        'county': county,
+        'code': code,
+        'complete': complete,
+        'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+        'rows': {os.path.basename(path): count_rows(path) for path in (FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES)},
+    }
+    manifest.update(extra)
+    _write_text_atomic(FILE_MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2) + '\n')
+    return manifest
+
+def parse_county(value):
+    """argparse 型別：接受縣市代碼或名稱 (台/臺 皆可)，回傳 (名稱, 代碼)"""
+    name = value.strip().replace('台', '臺')
+    if name in COUNTIES:
+        return name, COUNTIES[name]
+    for county, code in COUNTIES.items():
+        if name == str(code):
+            return county, code
+    raise argparse.ArgumentTypeError(f"未知的縣市：{value}")
+
+def parse_day(text):
+    """argparse 型別：YYYY-MM-DD，原樣回傳"""
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式應為 YYYY-MM-DD：{text}")
+
+def add_filter_args(parser):
+    """篩選抓取的查詢條件，由網站端篩選後只抓取符合的列表頁與詳細頁"""
+    group = parser.add_argument_group("篩選抓取 (showpage.jsp 查詢條件)")
+    group.add_argument('--city', type=parse_county, default=None, metavar='COUNTY', help="縣市 (代碼或名稱)")
+    group.add_argument('--name', default=None, help="補習班名稱關鍵字 (p_name)")
+    group.add_argument('--area', default=None, help="鄉鎮市區 (p_area)")
+    group.add_argument('--road', default=None, help="路名 (p_road)")
+    group.add_argument('--since', type=parse_day, default=None, metavar='YYYY-MM-DD', help="立案日期起 (start_date)")
+    group.add_argument('--until', type=parse_day, default=None, metavar='YYYY-MM-DD', help="立案日期迄 (end_date)")
+    group.add_argument('--type', default=None, help="補習班類別 (p_type)，例如 文理類")
+    group.add_argument('--c-type', default=None, help="c_type 查詢條件，原樣傳給網站")
+
+def list_filters(args):
+    """由篩選參數組出 showpage.jsp 的查詢條件；沒有任何條件時回傳 None"""
+    filters = {param: getattr(args, key) for key, param in LIST_FILTERS.items() if getattr(args, key)}
+    if args.city:
+        filters['p_city'] = args.city[1]
+    return filters or None
+
+def load_filters():
+    """篩選抓取的輸出目錄中記錄的查詢條件；不是篩選抓取時回傳 None"""
+    if not os.path.exists(FILE_FILTERS):
+        return None
+    with open(FILE_FILTERS, encoding='utf-8') as f:
+        return json.load(f)
+
+def add_output_args(parser):
+    """輸出位置與分片參數 (抓取與 redrive 共用)"""
+    parser.add_argument('--output-dir', default=None,
+                        help=f"輸出目錄 (預設為目前目錄；--shard 時為 <shard-dir>/<縣市代碼>；篩選抓取時為 {FILTER_DIR})")
+    parser.add_argument('--shard', type=parse_county, default=None, metavar='COUNTY',
+                        help="只處理單一縣市 (代碼或名稱)，輸出至分片目錄並寫入 manifest")
+    parser.add_argument('--shard-dir', default=SHARD_DIR,
+                        help=f"分片根目錄 (預設 {SHARD_DIR})")
+
+def configure_outputs(args):
+    """依 --output-dir / --shard / 篩選條件切換輸出目錄，並補上預設的 journal 與 dead letter 路徑"""
+    directory = args.output_dir
+    if directory is None and args.shard:
+        directory = os.path.join(args.shard_dir, str(args.shard[1]))
+    elif directory is None and getattr(args, 'filters', None):
+        # 部分結果不覆寫全國資料 (增量快照、查詢服務與變動歷史都以它為準)
+        directory = FILTER_DIR
+    if directory:
+        configure_output_dir(directory)
+    args.journal = args.journal or FILE_JOURNAL
+    args.dead_letter = args.dead_letter or FILE_DEAD_LETTER
+
+def add_session_args(parser):
+    """抓取相關子命令共用的連線、快取與解析參數"""
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"平行抓取的執行緒數 (預設 {DEFAULT_WORKERS})")
+    parser.add_argument('--rps', type=float, default=DEFAULT_RPS,
+                        help=f"全域每秒請求數 (自適應模式下為起始速率)，0 表示不限制 (預設 {DEFAULT_RPS})")
+    parser.add_argument('--max-rps', type=float, default=DEFAULT_MAX_RPS,
+                        help=f"自適應速率上限；不大於 --rps 時改用固定速率 (預設 {DEFAULT_MAX_RPS})")
+    parser.add_argument('--sessions', type=int, default=None,
+                        help=f"各自暖機的 Session 數，執行緒平均分配；拿到驗證頁時自動重新暖機或換用其他 Session "
+                             f"(預設 min(--workers, {DEFAULT_SESSIONS}))")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f"連線錯誤或 429/5xx 時的重試次數 (預設 {DEFAULT_RETRIES})")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f"單一請求逾時秒數 (預設 {DEFAULT_TIMEOUT})")
+    parser.add_argument('--dead-letter', default=None,
+                        help=f"重試後仍失敗的項目記錄檔 (預設為輸出目錄中的 {FILE_DEAD_LETTER})")
+    parser.add_argument('--cache', action='store_true',
+                        help=f"啟用磁碟回應快取 (目錄預設 {CACHE_DIR})")
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help="回應快取目錄")
+    parser.add_argument('--cache-ttl', action='append', default=[], metavar='ENDPOINT=SECONDS',
+                        help="覆寫端點快取存活時間，例如 detail.jsp=86400 (可重複指定)")
+    parser.add_argument('--cache-max-mb', type=int, default=CACHE_MAX_MB,
+                        help=f"快取大小上限 MB，超過時淘汰最久未使用的項目 (預設 {CACHE_MAX_MB})")
+    parser.add_argument('--offline', action='store_true',
+                        help="離線模式：只從快取讀取並重新解析，不連網")
+    parser.add_argument('--base-url', default=None,
+                        help=f"來源網站網址 (預設 {BASE_URL})")
+    parser.add_argument('--parser', default=DEFAULT_PARSER, choices=('auto',) + PARSER_BACKENDS,
+                        help="詳細頁解析後端 (預設 auto：lxml > selectolax > html.parser)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="抓取全台補習班資料 (含詳細資訊)")
+    add_session_args(parser)
+    add_output_args(parser)
+    parser.add_argument('--parse-procs', type=int, default=0,
+                        help="以多少個子行程平行解析詳細頁 (0 表示在抓取行程內解析，預設 0)")
+    parser.add_argument('--resume', action='store_true',
+                        help="從 journal 檢查點續抓，附加至既有輸出檔且不重複寫入")
+    parser.add_argument('--journal', default=None,
+                        help=f"檢查點日誌路徑 (預設為輸出目錄中的 {FILE_JOURNAL})")
+    parser.add_argument('--bulk-list', action='store_true',
+                        help="以各縣市列印頁 (print_showpage.jsp) 取得列表，約 22 個請求取代逐頁抓取")
+    parser.add_argument('--opendata', action='store_true',
+                        help="預先載入各縣市開放資料 JSON，電子郵件與補習班類別改由 JSON 提供")
+    parser.add_argument('--master-only', action='store_true',
+                        help="只輸出補習班主檔：列表欄位加上開放資料 JSON，不抓取詳細頁 (隱含 --opendata)")
+    parser.add_argument('--delta', action='store_true',
+                        help="增量模式：僅對新增或列表欄位有異動的補習班抓取詳細頁，其餘沿用上一次的資料")
+    parser.add_argument('--parquet', metavar='DIR',
+                        help="同時輸出型別化的 Parquet 檔至此目錄 (需要 pyarrow)")
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help="同時寫入 SQLite 資料庫 (以補習班代碼 upsert，可重複執行)")
+    parser.add_argument('--history', nargs='?', const=HISTORY_DIR, default=None, metavar='DIR',
+                        help=f"抓取完整完成後，將與上一次的差異記錄至變動歷史 (預設目錄 {HISTORY_DIR})")
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help="結束時 (及每隔 --metrics-interval 秒) 輸出 JSON 效能指標摘要")
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help="輸出 Prometheus textfile 格式的效能指標")
+    parser.add_argument('--metrics-interval', type=float, default=30.0,
+                        help="抓取過程中更新指標檔的間隔秒數，0 表示只在結束時輸出 (預設 30)")
+    add_filter_args(parser)
+    args = parser.parse_args(argv)
+    args.filters = list_filters(args)
+    if args.filters and args.bulk_list:
+        parser.error("篩選抓取使用 showpage.jsp 分頁列表，不能與 --bulk-list 同時使用")
+    if args.city and args.shard:
+        parser.error("--city 與 --shard 不能同時使用")
+    return args
+
+def open_session(args):
+    """依共用參數設定解析後端與來源網址，回傳 (session, workers)"""
+    global PARSER
+    PARSER = resolve_parser(args.parser)
+    if args.base_url:
+        configure_base_url(args.base_url)
+    workers = max(args.workers, 1)
+    cache = build_cache(args)
+    if args.offline:
+        print(f"離線模式：僅使用快取 {args.cache_dir}")
+    sessions = args.sessions if args.sessions else min(workers, DEFAULT_SESSIONS)
+    session = get_session(workers, args.rps, cache, args.offline, max_rps=args.max_rps,
+                          retries=args.retries, timeout=args.timeout, sessions=sessions)
+    return session, workers
+
+def build_cache(args):
+    if not (args.cache or args.offline):
+        return None
+    ttl = dict(CACHE_TTL)
+    for spec in args.cache_ttl:
+        endpoint, _, seconds = spec.partition('=')
+        ttl[endpoint] = int(seconds)
+    return ResponseCache(args.cache_dir, ttl, args.cache_max_mb * 1024 * 1024)
+
+def format_progress(done, total):
+    """進度、速度與滾動 ETA 的簡短文字"""
+    eta = METRICS.eta()
+    eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+    return f"{done}/{total} 間，{METRICS.rate():.1f} 間/秒，預計剩餘 {eta_text}"
+
+def export_metrics(args):
+    if args.metrics_json:
+        METRICS.write_json(args.metrics_json)
+    if args.metrics_prom:
+        METRICS.write_prometheus(args.metrics_prom)
+
+def iter_cached_details(cache_dir):
+    """從回應快取中列出所有詳細頁，產生 (補習班代碼, html)"""
+    cache = ResponseCache(cache_dir)
+    for body_path, _, _ in cache._scan():
+        key = os.path.basename(body_path)[:-len('.body')]
+        cached = cache.get(key)
+        if not cached:
+            continue
+        meta, content = cached
+        if cache.ttl_for(meta['url']) is not None and meta['url'].endswith('detail.jsp'):
+            yield str(meta['params'].get('u', '')), content.decode(meta['encoding'] or 'utf-8', errors='replace')
+
+def parity(argv=None):
+    """
+    比對各解析後端與原始 html.parser 逐欄位查找的輸出是否完全相同。
+    來源為回應快取中的詳細頁，或直接指定的 HTML 檔 (檔名即補習班代碼)。
+    """
+    parser = argparse.ArgumentParser(prog="scraper.py parity", description="檢查各解析後端的輸出一致性")
+    parser.add_argument('files', nargs='*', help="詳細頁 HTML 檔；未指定時使用快取目錄中的詳細頁")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="回應快取目錄")
+    parser.add_argument('--show', type=int, default=5, help="每個後端最多列出幾筆差異")
+    args = parser.parse_args(argv)
+
+    if args.files:
+        def pages():
+            for path in args.files:
+                with open(path, encoding='utf-8') as f:
+                    yield os.path.splitext(os.path.basename(path))[0], f.read()
+        source = pages()
+    else:
+        source = iter_cached_details(args.cache_dir)
+
+    backends = available_parsers()
+    mismatches = {name: [] for name in backends}
+    total = 0
+    for school_id, html in source:
+        total += 1
+        expected = parse_school_details_legacy(html, school_id)
+        for name in backends:
+            if parse_school_details(html, school_id, name) != expected:
+                mismatches[name].append(school_id)
+
+    print(f"共比對 {total} 頁詳細資料")
+    for name in backends:
+        bad = mismatches[name]
+        status = "一致" if not bad else f"{len(bad)} 頁不一致"
+        print(f"  {name}: {status}")
+        for school_id in bad[:args.show]:
+            print(f"    - {school_id}")
+    return 1 if any(mismatches.values()) else 0
+
+def merge_redriven(patched, appended):
+    """
+    將補抓結果合併回三個輸出檔 (先寫暫存檔再整批更名)：
+    patched 為 {補習班代碼: (info, subjects, vehicles)}，就地更新該補習班並把科目／交通車插回原本的位置；
+    appended 為補抓到的列表頁中新出現的 (item, subjects, vehicles)，依序附加在最後。
+    科目與交通車檔依補習班順序排列，因此可以與 schools.csv 同步串流合併。
+    """
+    paths = [FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES]
+    headers = [HEADER_SCHOOLS, HEADER_SUBJECTS, HEADER_VEHICLES]
+    sources = [open(path, newline='', encoding='utf-8-sig') for path in paths]
+    targets = [open(path + '.tmp', 'w', newline='', encoding='utf-8-sig') for path in paths]
+    try:
+        readers = [csv.DictReader(f) for f in sources]
+        writers = [csv.DictWriter(f, fieldnames=h) for f, h in zip(targets, headers)]
+        for w in writers:
+            w.writeheader()
+        children = [readers[1], readers[2]]
+        pending = [next(r, None) for r in children]
+
+        for row in readers[0]:
+            school_id = row.get('補習班代碼')
+            result = patched.get(school_id) if school_id else None
+            if result:
+                row.update(result[0])
+            writers[0].writerow(row)
+            for i in range(2):
+                # 取出原檔中屬於這間補習班的連續資料列；補抓成功者以新資料取代
+                while pending[i] is not None and pending[i].get('補習班代碼') == school_id:
+                    if not result:
+                        writers[i + 1].writerow(pending[i])
+                    pending[i] = next(children[i], None)
+                if result and result[i + 1]:
+                    writers[i + 1].writerows(result[i + 1])
+
+        for item, subjects, vehicles in appended:
+            writers[0].writerow(item)
+            writers[1].writerows(subjects)
+            writers[2].writerows(vehicles)
+        # 與 schools.csv 順序對不上的剩餘資料列原樣保留
+        for i in range(2):
+            while pending[i] is not None:
+                writers[i + 1].writerow(pending[i])
+                pending[i] = next(children[i], None)
+    finally:
+        for f in sources + targets:
+            f.close()
+    for path in paths:
+        os.replace(path + '.tmp', path)
+    return [os.path.getsize(path) for path in paths]
+
+def redrive(argv=None):
+    """重新抓取 dead letter 中的失敗項目，成功者合併回既有的輸出檔，仍失敗者留在 dead letter"""
+    parser = argparse.ArgumentParser(prog="scraper.py redrive", description="補抓重試後仍失敗的列表頁與詳細頁")
+    add_session_args(parser)
+    add_output_args(parser)
+    parser.add_argument('--journal', default=None,
+                        help=f"檢查點日誌路徑，補抓後會記錄新的檔案位置 (預設為輸出目錄中的 {FILE_JOURNAL})")
+    args = parser.parse_args(argv)
+    configure_outputs(args)
+    # 分片目錄或篩選抓取的失敗列表頁需以相同條件重新抓取
+    manifest = load_manifest()
+    filters = dict(load_filters() or {}, **({'p_city': manifest['code']} if manifest else {})) or None
+
+    dead_letter = DeadLetterQueue(args.dead_letter)
+    entries = dead_letter.load()
+    if not entries:
+        print("沒有需要補抓的項目。")
+        return 0
+    if not os.path.exists(FILE_SCHOOLS):
+        print(f"找不到 {FILE_SCHOOLS}，請先執行抓取。")
+        return 1
+    with open(FILE_SCHOOLS, newline='', encoding='utf-8-sig') as f:
+        existing = {row['補習班代碼'] for row in csv.DictReader(f) if row.get('補習班代碼')}
+
+    session, workers = open_session(args)
+    print(f"補抓 {len(entries)} 個失敗項目...")
+    remaining = []
+    patched = {}
+    appended = []
+    recovered_pages = []
+
+    def fetch(item_or_entry):
+        school_id = item_or_entry.get('補習班代碼') or item_or_entry.get('key')
+        try:
+            return item_or_entry, fetch_school_details(session, school_id), None
+        except Exception as e:
+            return item_or_entry, None, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window = workers * 4
+        details = [e for e in entries if e['kind'] == 'detail']
+        for entry, result, error in ordered_map(executor, fetch, details, window):
+            if result is None:
+                remaining.append(dict(entry, error=str(error), time=time.time()))
+            else:
+                patched[entry['key']] = result
+
+        for entry in (e for e in entries if e['kind'] in ('page', 'county')):
+            if entry['kind'] == 'page':
+                page = int(entry['key'])
+                html = get_page_content(session, page, filters)
+                listed = parse_list_page(html) if html else None
+            else:
+                page = entry.get('page')
+                listed = iter_county_pages(session, executor, entry['key'], window)
+            if listed is None:
+                remaining.append(dict(entry, time=time.time()))
+                continue
+            if page is not None:
+                recovered_pages.append(page)
+            items = [it for it in listed
+                     if it['補習班代碼'] and it['補習班代碼'] not in existing]
+            for item, result, error in ordered_map(executor, fetch, items, window):
+                existing.add(item['補習班代碼'])
+                if result is None:
+                    remaining.append({'kind': 'detail', 'key': item['補習班代碼'], 'page': page,
+                                      'error': str(error), 'time': time.time()})
+                    result = (School(), [], [])
+                item.update(result[0])
+                appended.append((item, result[1], result[2]))
+
+    offsets = merge_redriven(patched, appended)
+    if os.path.exists(args.journal):
+        journal = CrawlJournal(args.journal)
+        journal.load()
+        ended = journal.ended
+        journal.open(True, offsets)
+        for page in recovered_pages:
+            journal.page_done(page, offsets)
+        for item, _, _ in appended:
+            journal.school_done(None, item['補習班代碼'], offsets)
+        journal.rewritten(offsets)
+        # 原本已完整結束的抓取，補抓後仍視為完成 (查詢服務據此重新載入)
+        if ended:
+            journal.finished(offsets)
+        journal.close()
+    dead_letter.rewrite(remaining)
+    if manifest:
+        write_manifest(manifest['county'], manifest['code'], not remaining,
+                       total_count=manifest.get('total_count'), dead_letter=len(remaining))
+    print(f"補抓完成：詳細頁 {len(patched)} 筆、列表頁 {len(recovered_pages)} 頁 (新增 {len(appended)} 間)，"
+          f"仍失敗 {len(remaining)} 筆")
+    return 0 if not remaining else 1
+
+def shard_paths(shard_dir, code):
+    """回傳分片的 (目錄, manifest 路徑, [schools, subjects, vehicles 路徑])"""
+    directory = os.path.join(shard_dir, str(code))
+    names = ("schools.csv", "subjects.csv", "vehicles.csv")
+    return directory, os.path.join(directory, "manifest.json"), [os.path.join(directory, name) for name in names]
+
+def run_shards(argv=None):
+    """
+    在本機以子行程平行執行各縣市分片 (每個分片各自的 session、journal 與 dead letter)。
+    manifest 已標記完成的分片會略過，因此重新執行只會重抓失敗的縣市；其餘參數原樣傳給每個分片。
+    """
+    parser = argparse.ArgumentParser(prog="scraper.py shards", description="以子行程平行抓取各縣市分片",
+                                     epilog="未列出的參數 (如 --workers、--rps、--bulk-list) 會傳給每個分片")
+    parser.add_argument('--procs', type=int, default=4, help="同時執行的分片數 (預設 4)")
+    parser.add_argument('--counties', type=parse_county, nargs='+', default=None, metavar='COUNTY',
+                        help="只執行這些縣市 (預設全部)")
+    parser.add_argument('--shard-dir', default=SHARD_DIR, help=f"分片根目錄 (預設 {SHARD_DIR})")
+    parser.add_argument('--force', action='store_true', help="重新執行已完成的分片")
+    parser.add_argument('--merge', action='store_true', help="全部完成後執行 merge")
+    args, passthrough = parser.parse_known_args(argv)
+
+    queue = []
+    skipped = []
+    for name, code in args.counties or COUNTIES.items():
+        directory, manifest_path, _ = shard_paths(args.shard_dir, code)
+        manifest = load_manifest(manifest_path)
+        if manifest and manifest.get('complete') and not args.force:
+            skipped.append(name)
+            continue
+        queue.append((name, code, directory, manifest_path))
+    if skipped:
+        print(f"略過 {len(skipped)} 個已完成的分片：{'、'.join(skipped)}")
+
+    running = []
+    failed = []
+    while queue or running:
+        while queue and len(running) < max(args.procs, 1):
+            name, code, directory, manifest_path = queue.pop(0)
+            os.makedirs(directory, exist_ok=True)
+            log = open(os.path.join(directory, "crawl.log"), 'w', encoding='utf-8')
+            cmd = [sys.executable, os.path.abspath(__file__), '--shard', str(code),
+                   '--shard-dir', args.shard_dir] + passthrough
+            proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+            running.append((proc, name, code, log, manifest_path))
+            print(f"啟動分片 {name} ({code})")
+        for entry in [e for e in running if e[0].poll() is not None]:
+            running.remove(entry)
+            proc, name, code, log, manifest_path = entry
+            log.close()
+            # 以 manifest 判斷是否完成 (分片有 dead letter 時結束碼仍為 0)
+            manifest = load_manifest(manifest_path)
+            ok = bool(manifest and manifest.get('complete'))
+            if not ok:
+                failed.append(name)
+            print(f"{name} ({code})：{'完成' if ok else '未完成'}，結束碼 {proc.returncode}，記錄於 {log.name}")
+        if running:
+            time.sleep(0.2)
+
+    if failed:
+        print(f"{len(failed)} 個分片未完成：{'、'.join(failed)}；再次執行 `python scraper.py shards` 只會重抓這些縣市")
+        return 1
+    if args.merge:
+        return merge_shards(['--shard-dir', args.shard_dir])
+    return 0
+
+def merge_shards(argv=None):
+    """
+    依 COUNTIES 順序合併各分片的三個 CSV 為正式輸出檔，分片內保持原本的列順序，因此結果與分片完成順序無關。
+    同一補習班代碼出現多次時只保留第一筆 (連同其科目與交通車)，並列出內容不一致的重複項。
+    """
+    parser = argparse.ArgumentParser(prog="scraper.py merge", description="合併各縣市分片為 schools/subjects/vehicles.csv")
+    parser.add_argument('--shard-dir', default=SHARD_DIR, help=f"分片根目錄 (預設 {SHARD_DIR})")
+    parser.add_argument('--output-dir', default=None, help="輸出目錄 (預設為目前目錄)")
+    parser.add_argument('--partial', action='store_true', help="有分片缺漏或未完成時仍合併其餘分片")
+    args = parser.parse_args(argv)
+
+    shards = []
+    missing = []
+    for name, code in COUNTIES.items():
+        _, manifest_path, paths = shard_paths(args.shard_dir, code)
+        manifest = load_manifest(manifest_path)
+        if not manifest or not manifest.get('complete') or not os.path.exists(paths[0]):
+            missing.append(f"{name} ({code})")
+            continue
+        rows = manifest.get('rows', {}).get('schools.csv')
+        if rows is not None and rows != count_rows(paths[0]):
+            print(f"警告：{name} 的 schools.csv 列數與 manifest 不符 ({count_rows(paths[0])} != {rows})")
+        shards.append((name, paths))
+    if missing:
+        print(f"{len(missing)} 個分片缺漏或未完成：{'、'.join(missing)}")
+        if not args.partial:
+            print("請重新執行這些縣市，或加上 --partial 只合併已完成的分片。")
+            return 1
+
+    if args.output_dir:
+        configure_output_dir(args.output_dir)
+    targets = [FILE_SCHOOLS, FILE_SUBJECTS, FILE_VEHICLES]
+    headers = [HEADER_SCHOOLS, HEADER_SUBJECTS, HEADER_VEHICLES]
+    files = [open(path + '.tmp', 'w', newline='', encoding='utf-8-sig') for path in targets]
+    seen = {}
+    duplicates = conflicts = 0
+    counts = [0, 0, 0]
+    try:
+        writers = [csv.DictWriter(f, fieldnames=h, extrasaction='ignore') for f, h in zip(files, headers)]
+        for w in writers:
+            w.writeheader()
+        for name, paths in shards:
+            for school, subjects, vehicles in iter_output_records(paths):
+                school_id = school.get('補習班代碼')
+                if school_id:
+                    first = seen.get(school_id)
+                    if first is not None:
+                        duplicates += 1
+                        if first[1] != school:
+                            conflicts += 1
+                            print(f"重複且內容不同：{school_id} ({first[0]} / {name})，保留 {first[0]} 的資料")
+                        continue
+                    seen[school_id] = (name, school)
+                writers[0].writerow(school)
+                writers[1].writerows(subjects)
+                writers[2].writerows(vehicles)
+                counts[0] += 1
+                counts[1] += len(subjects)
+                counts[2] += len(vehicles)
+    finally:
+        for f in files:
+            f.close()
+    for path in targets:
+        os.replace(path + '.tmp', path)
+    print(f"合併 {len(shards)} 個分片：{counts[0]} 間補習班、{counts[1]} 筆科目、{counts[2]} 筆交通車；"
+          f"略過重複 {duplicates} 筆 (其中內容不同 {conflicts} 筆)")
+    return 0 if not missing else 1
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    return crawl(argv)
+
+def crawl(argv=None):
+    args = parse_args(argv)
+    configure_outputs(args)
+    session, workers = open_session(args)
+    # 分片模式只抓取單一縣市；篩選抓取只抓取網站端篩選後的結果
+    counties = dict([args.shard or args.city]) if args.shard or args.city else None
+    filters = dict(args.filters or {}, **({'p_city': args.shard[1]} if args.shard else {})) or None
+    scope = f"{args.shard[0]} ({args.shard[1]}) 分片" if args.shard else "全台補習班資料"
+    if args.filters:
+        scope = "篩選結果 " + ', '.join(f"{k}={v}" for k, v in args.filters.items())
+        _write_text_atomic(FILE_FILTERS, json.dumps(args.filters, ensure_ascii=False, indent=2) + '\n')
+    elif os.path.exists(FILE_FILTERS):
+        os.remove(FILE_FILTERS)
+    print(f"開始抓取{scope} (含詳細資訊)... workers={workers}, rps={args.rps or '不限'}, parser={PARSER}")
+    pipe = Pipeline(session, workers, filters=filters, bulk=args.bulk_list, counties=counties,
+                    master_only=args.master_only, parse_procs=args.parse_procs)
+    
+    # 1. 取得第一頁
+    total_count = pipe.total_count()
+    if total_count == 0 and args.filters and pipe.first_page.find('caption', id='result-list'):
+        # 篩選結果為空是正常情況 (例如這段期間沒有新立案)，輸出只有表頭的檔案
+        pipe.close()
+        CsvOutput().close()
+        print("沒有符合篩選條件的補習班。")
+        return 0
+    if total_count is None:
+        print("無法取得第一頁，終止。")
+        error = "無法取得第一頁"
+    elif total_count == 0:
+        print("警告: 無法解析總筆數。")
+        error = "無法解析總筆數"
+    if not total_count:
+        pipe.close()
+        if args.shard:
+            write_manifest(*args.shard, False, error=error)
+        return 1
+
+    total_pages = math.ceil(total_count / ITEMS_PER_PAGE)
+    print(f"總筆數: {total_count}, 總頁數: {total_pages}")
+    
+    mode = 'bulk' if args.bulk_list else 'paged'
+    if args.master_only:
+        mode += '+master'
+    if args.shard:
+        mode += f"@{args.shard[1]}"
+    if args.filters:
+        mode += '?' + urlencode(sorted(args.filters.items()))
+    journal = CrawlJournal(args.journal)
+    resume = args.resume and journal.load()
+    if args.resume and not resume:
+        print("找不到可續抓的檢查點，改為重新抓取。")
+    if resume and (journal.mode or 'paged') != mode:
+        print(f"檢查點為 {journal.mode} 模式，與本次的 {mode} 模式不同，改為重新抓取。")
+        journal = CrawlJournal(args.journal)
+        resume = False
+    if resume:
+        print(f"續抓：已完成 {len(journal.done_pages)} 頁、{len(journal.done_keys)} 間補習班")
+    pipe.skip_pages = journal.done_pages
+    pipe.skip_keys = journal.done_keys
+
+    if args.delta:
+        if not resume:
+            rotate_snapshot()
+        failed = {rec['key'] for rec in DeadLetterQueue(args.dead_letter).load() if rec['kind'] == 'detail'}
+        pipe.snapshot = load_snapshot(exclude=failed)
+        print(f"增量模式：上一次快照共 {len(pipe.snapshot)} 間補習班")
+    # 列印頁沒有補習班代碼時，先以既有輸出對照 (須在輸出檔被覆寫前讀取)
+    if args.bulk_list:
+        pipe.id_index = load_id_index()
+    if args.opendata or args.master_only:
+        opendata = OpenDataIndex().load(session, pipe.executor, pipe.window, counties and counties.values())
+        print(f"開放資料：{len(opendata)} 間補習班" + (f"，{len(opendata.failed)} 個縣市載入失敗" if opendata.failed else ""))
+        pipe.opendata = opendata
+
+    output = CsvOutput(journal.offsets if resume else None)
+    journal.open(resume, output.checkpoint(sync=True), mode)
+    # Parquet 無法附加，續抓時於結束後由完整的 CSV 重新轉出。
+    # SQLite 批次寫入，中斷時最後一批可能已記錄在 journal 卻尚未寫入資料庫，續抓時同樣於結束後由 CSV 重新匯入
+    sinks = []
+    if args.parquet and not resume:
+        sinks.append(ParquetOutput(args.parquet))
+    if args.sqlite and not resume:
+        sinks.append(SqliteOutput(args.sqlite))
+    dead_letter = DeadLetterQueue(args.dead_letter)
+    dead_letter.open(append=resume)
+    pipe.dead_letter = dead_letter
+
+    finished = False
+    try:
+        # 2. 遍歷頁面：列表頁與詳細頁皆平行抓取、在背景解析，但依原始順序寫出
+        total_pages = pipe.total_pages()
+        last_page = 0
+        done = len(journal.done_keys)
+        METRICS.progress(done, total_count)
+        next_export = time.monotonic() + args.metrics_interval
+        for page, key, item, det_info, det_subjs, det_vehs in pipe.detail_entries():
+            if page != last_page:
+                print(f"正在抓取第 {page}/{total_pages} 頁... {format_progress(done, total_count)}", end='\r')
+                last_page = page
+            if args.metrics_interval and time.monotonic() >= next_export:
+                export_metrics(args)
+                next_export = time.monotonic() + args.metrics_interval
+
+            if item is None:
+                journal.page_done(page, output.checkpoint(sync=True))
+                continue
+
+            # 合併基本資料 (若無 ID，僅寫入列表有的資料)
+            item.update(det_info)
+            output.write(item, det_subjs, det_vehs)
+            for sink in sinks:
+                sink.write(item, det_subjs, det_vehs)
+            journal.school_done(page, key, output.checkpoint())
+            done += 1
+            METRICS.progress(done)
+        journal.finished(output.checkpoint(sync=True))
+        finished = True
+
+    finally:
+        pipe.close()
+        output.close()
+        for sink in sinks:
+            sink.close()
+        journal.close()
+        dead_letter.close(finished)
+        if args.parquet and resume:
+            export_parquet(args.parquet)
+        if args.sqlite and resume:
+            export_sqlite(args.sqlite)
+        # 分片與篩選只有部分補習班；只抓主檔時沒有詳細欄位、科目與交通車，與完整抓取比對會被誤判為全部變動
+        if args.history and not args.shard and not args.filters and not args.master_only:
+            # 有失敗項目時詳細欄位不完整，記錄會被誤判為變動
+            if finished and not dead_letter.count:
+                counts = HistoryStore(args.history).record(iter_output_records())
+                print(f"\n變動歷史：新增 {counts['added']}、消失 {counts['removed']}、變動 {counts['modified']} 間")
+            else:
+                print("\n抓取未完整完成，略過變動歷史記錄 (redrive 後可執行 `python scraper.py history record`)")
+        elif args.history and args.master_only:
+            print("\n只抓主檔時不記錄變動歷史")
+        if dead_letter.count:
+            print(f"\n{dead_letter.count} 個項目重試後仍失敗，已記錄於 {args.dead_letter}，可執行 `python scraper.py redrive` 補抓")
+        if args.delta:
+            counters = METRICS.summary()['counters']
+            print(f"\n增量模式：重新抓取 {counters.get('delta_fetched', 0)} 間，沿用 {counters.get('delta_carried', 0)} 間")
+        export_metrics(args)
+        if args.shard:
+            write_manifest(*args.shard, finished and not dead_letter.count, mode=mode,
+                           total_count=total_count, dead_letter=dead_letter.count)
+        print(f"\n抓取完成！資料已儲存至 {FILE_SCHOOLS}, {FILE_SUBJECTS}, {FILE_VEHICLES}")
+
+# 子命令；未指定時執行抓取
+COMMANDS = {
+    'parity': parity,
+    'redrive': redrive,
+    'export-parquet': export_parquet_main,
+    'export-sqlite': export_sqlite_main,
+    'shards': run_shards,
+    'merge': merge_shards,
+    'cancellations': cancellations_main,
+    'history': history_main,
+    'stats': stats_main,
+    'query': query_main,
+}
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import benchmark  # noqa: E402
+
+OUTPUTS = ('schools.csv', 'subjects.csv', 'vehicles.csv')
+
+
+@pytest.fixture(scope='session')
+def site():
+    return benchmark.SyntheticSite(120, seed=3)
+
+
+@pytest.fixture
+def server(site):
+    server = benchmark.SiteServer(site).start()
+    yield server
+    server.stop()
+
+
+class ChangedSite(benchmark.SyntheticSite):
+    """與 SyntheticSite 相同，但 changed 中的補習班電話不同"""
+
+    def __init__(self, schools, seed, changed):
+        super().__init__(schools, seed)
+        self.changed = set(changed)
+
+    def record(self, i):
+        record = super().record(i)
+        if i in self.changed:
+            record['phone'] = '(02)00000000'
+        return record
+
+
+class FlakyServer(benchmark.SiteServer):
+    """對 failing 中的補習班代碼，詳細頁一律回應 HTTP 500"""
+
+    def __init__(self, site, failing):
+        super().__init__(site)
+        self.failing = set(failing)
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        if parts.path.endswith('detail.jsp') and parse_qs(parts.query).get('u', [''])[0] in self.failing:
+            handler.send_response(500)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        super().handle(handler)
+
+
+@pytest.fixture
+def flaky_server(site):
+    """回傳建立 FlakyServer 的函式；測試結束時一併關閉"""
+    servers = []
+
+    def start(failing):
+        servers.append(FlakyServer(site, failing).start())
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def run(workdir, *args, server=None):
+    """在指定目錄以子行程執行 scraper.py (模組層級的輸出路徑與設定不會互相影響)；指定 server 時連到模擬網站"""
+    os.makedirs(workdir, exist_ok=True)
+    cmd = [sys.executable, os.path.join(ROOT, 'scraper.py'), *args]
+    if server:
+        cmd += ['--base-url', server.url, '--rps', '0', '--workers', '4']
+    return subprocess.run(cmd, cwd=workdir, capture_output=True, text=True, timeout=300)
+
+
+@pytest.fixture
+def crawl(server):
+    """對模擬網站執行 scraper.py，回傳 CompletedProcess"""
+    def invoke(workdir, *args, server=server):
+        return run(workdir, *args, server=server)
+    return invoke
+
+
+def read_outputs(workdir):
+    result = []
+    for name in OUTPUTS:
+        with open(os.path.join(workdir, name), 'rb') as f:
+            result.append(f.read())
+    return result
@@ -0,0 +1,157 @@
+"""--bulk-list：以各縣市的 print_showpage.jsp 取得列表，補回補習班代碼後內容與逐頁抓取相同 (依縣市排列)"""
+import csv
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import benchmark
+import scraper
+from conftest import OUTPUTS
+
+
+class PrintFailingServer(benchmark.SiteServer):
+    """指定縣市代碼的列印頁一律回應 HTTP 500"""
+
+    def __init__(self, site, cities):
+        super().__init__(site)
+        self.cities = {str(code) for code in cities}
+        self.failed = 0
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        if parts.path.endswith('print_showpage.jsp') and parse_qs(parts.query).get('citylink', [''])[0] in self.cities:
+            self.failed += 1
+            handler.send_response(500)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        super().handle(handler)
+
+
+class DateFilterFailingServer(benchmark.SiteServer):
+    """帶 start_date 的分頁列表一律回應 HTTP 500"""
+
+    def __init__(self, site):
+        super().__init__(site)
+        self.failed = 0
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        if parts.path.endswith('showpage.jsp') and parse_qs(parts.query).get('start_date'):
+            self.failed += 1
+            handler.send_response(500)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        super().handle(handler)
+
+
+def read_rows(workdir):
+    """三個輸出檔的資料列，依補習班代碼排序 (bulk-list 依縣市順序輸出)"""
+    result = []
+    for name in OUTPUTS:
+        with open(os.path.join(workdir, name), newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.DictReader(f))
+        result.append(sorted(rows, key=lambda row: row['補習班代碼']))
+    return result
+
+
+@pytest.fixture
+def reference(tmp_path, crawl):
+    path = tmp_path / 'reference'
+    assert crawl(path).returncode == 0
+    return read_rows(path)
+
+
+def test_bulk_list_matches_paged_crawl(tmp_path, crawl, server, reference):
+    work = tmp_path / 'work'
+    server.reset()
+    result = crawl(work, '--bulk-list')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert server.counts['print_showpage.jsp'] == len(scraper.COUNTIES)
+    assert read_rows(work) == reference
+
+
+def test_missing_ids_are_resolved_per_county(tmp_path, crawl, server, reference):
+    work = tmp_path / 'work'
+    server.reset()
+    assert crawl(work, '--bulk-list').returncode == 0
+    # 第一次執行沒有可對照的輸出：每個縣市一次分頁列表 (模擬網站每縣市不到一頁)，不逐間查詢
+    assert server.counts['showpage.jsp'] <= 1 + len(scraper.COUNTIES)
+    assert read_rows(work) == reference
+
+
+def test_previous_outputs_resolve_ids(tmp_path, crawl, server, reference):
+    work = tmp_path / 'work'
+    crawl(work, '--bulk-list')
+    server.reset()
+    assert crawl(work, '--bulk-list').returncode == 0
+    # 只剩取得總筆數的第一頁，不再逐間查詢代碼
+    assert server.counts.get('showpage.jsp', 0) <= 1
+    assert read_rows(work) == reference
+
+
+def test_failed_print_page_falls_back_to_paging(tmp_path, crawl, site, reference):
+    code = next(iter(scraper.COUNTIES.values()))
+    server = PrintFailingServer(site, [code]).start()
+    try:
+        work = tmp_path / 'work'
+        result = crawl(work, '--bulk-list', '--retries', '0', server=server)
+        assert result.returncode == 0
+        assert server.failed == 1
+    finally:
+        server.stop()
+    assert read_rows(work) == reference
+
+
+@pytest.fixture
+def large_site():
+    # 每個縣市約 36 間補習班，分頁列表超過一頁
+    return benchmark.SyntheticSite(800, seed=3)
+
+
+def bulk_items(server, monkeypatch, site, since):
+    """
+    以列印頁抓取第一個縣市；立案日期早於 since 的補習班由索引取得代碼，其餘須由分頁列表補回。
+    回傳 (items, 縣市的補習班序號)
+    """
+    for name in [n for n in vars(scraper) if n.endswith('_URL')]:
+        monkeypatch.setattr(scraper, name, getattr(scraper, name))
+    scraper.configure_base_url(server.url)
+    county, code = next(iter(scraper.COUNTIES.items()))
+    indices = site.select(code)
+    records = [site.record(i) for i in indices]
+    id_index = {(r['name'], r['doc']): r['id'][1:] for r in records if r['date'] < since}
+    session = scraper.get_session(4, rps=0, retries=0)
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            items = [item for _, item in scraper.iter_bulk_list_items(session, executor, 4, id_index=id_index,
+                                                                      counties={county: code}) if item]
+    finally:
+        session.close()
+    assert [item['補習班代碼'] for item in items] == [r['id'][1:] for r in records]
+    return items, indices
+
+
+def test_missing_ids_use_start_date_query(large_site, monkeypatch):
+    server = benchmark.SiteServer(large_site).start()
+    try:
+        items, _ = bulk_items(server, monkeypatch, large_site, '2024-01-01')
+    finally:
+        server.stop()
+    assert len(items) > scraper.ITEMS_PER_PAGE
+    # 只列出 2024 年以後立案的補習班，一頁即可，不抓整個縣市的分頁列表
+    assert server.counts['showpage.jsp'] == 1
+
+
+def test_failed_start_date_query_falls_back_to_county_listing(large_site, monkeypatch):
+    server = DateFilterFailingServer(large_site).start()
+    try:
+        _, indices = bulk_items(server, monkeypatch, large_site, '2024-01-01')
+    finally:
+        server.stop()
+    assert server.failed == 1
+    assert server.counts['showpage.jsp'] == math.ceil(len(indices) / scraper.ITEMS_PER_PAGE)
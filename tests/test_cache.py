@@ -0,0 +1,177 @@
+"""ResponseCache：TTL 內直接使用快取、過期時以 ETag 重新驗證、超過大小上限時淘汰最久未使用的項目，--offline 只讀快取"""
+import errno
+import json
+import os
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import scraper
+from conftest import read_outputs
+
+# 含有 detail.jsp 的結構標記，不會被當成驗證頁
+BODY = '<html><body><table><tr><th id="th-sqnum">序號</th></tr></table>內容</body></html>'
+
+
+class EtagServer:
+    """detail.jsp 回應固定的 ETag；收到相符的 If-None-Match 時回 304"""
+
+    def __init__(self):
+        self.statuses = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.headers.get('If-None-Match') == '"v1"':
+                    server.statuses.append(304)
+                    self.send_response(304)
+                    self.send_header('ETag', '"v1"')
+                    self.end_headers()
+                    return
+                server.statuses.append(200)
+                data = BODY.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=UTF-8')
+                self.send_header('ETag', '"v1"')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/detail.jsp"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def etag_server():
+    server = EtagServer()
+    yield server
+    server.stop()
+
+
+def cached_session(directory, ttl=3600):
+    return scraper.ScraperSession(cache=scraper.ResponseCache(str(directory), ttl={'detail.jsp': ttl}))
+
+
+def expire(cache, key, validators=True):
+    """把快取項目的抓取時間往前調一天；validators 為 False 時一併移除 ETag 與 Last-Modified"""
+    meta, _ = cache.get(key)
+    meta['fetched_at'] -= 86400
+    if not validators:
+        meta['etag'] = meta['last_modified'] = None
+    _, meta_path = cache._paths(key)
+    cache._write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+
+def test_fresh_entries_are_served_from_cache(tmp_path, etag_server):
+    session = cached_session(tmp_path)
+    first = session.get(etag_server.url, params={'u': '1'})
+    second = session.get(etag_server.url, params={'u': '1'})
+    assert first.text == second.text == BODY
+    assert etag_server.statuses == [200]
+    # 參數不同即為不同的快取項目
+    session.get(etag_server.url, params={'u': '2'})
+    assert etag_server.statuses == [200, 200]
+
+
+def test_expired_entries_are_revalidated(tmp_path, etag_server):
+    session = cached_session(tmp_path)
+    session.get(etag_server.url, params={'u': '1'})
+    key = session.cache.key(etag_server.url, {'u': '1'})
+    expire(session.cache, key)
+
+    response = session.get(etag_server.url, params={'u': '1'})
+    assert response.status_code == 200 and response.text == BODY
+    assert etag_server.statuses == [200, 304]
+    # 304 之後存活時間重新計算
+    assert session.cache.is_fresh(etag_server.url, session.cache.get(key)[0])
+    session.get(etag_server.url, params={'u': '1'})
+    assert etag_server.statuses == [200, 304]
+
+
+def test_expired_entries_without_validators_are_refetched(tmp_path, etag_server):
+    session = cached_session(tmp_path, ttl=60)
+    session.get(etag_server.url, params={'u': '1'})
+    key = session.cache.key(etag_server.url, {'u': '1'})
+    expire(session.cache, key, validators=False)
+    assert not session.cache.is_fresh(etag_server.url, session.cache.get(key)[0])
+
+    assert session.get(etag_server.url, params={'u': '1'}).text == BODY
+    assert etag_server.statuses == [200, 200]
+    assert session.cache.is_fresh(etag_server.url, session.cache.get(key)[0])
+
+
+def test_uncached_endpoints_always_hit_the_network(tmp_path, etag_server):
+    session = scraper.ScraperSession(cache=scraper.ResponseCache(str(tmp_path), ttl={}))
+    session.get(etag_server.url)
+    session.get(etag_server.url)
+    assert etag_server.statuses == [200, 200]
+    assert os.listdir(tmp_path) == []
+
+
+def test_eviction_drops_least_recently_used_entries(tmp_path):
+    cache = scraper.ResponseCache(str(tmp_path), ttl={}, max_bytes=2500)
+    response = types.SimpleNamespace(content=os.urandom(1000), encoding='utf-8', headers={})
+    keys = [cache.key('http://x/detail.jsp', {'u': i}) for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        cache.put(key, 'http://x/detail.jsp', {'u': i}, response)
+    # 第二個項目最久未使用，第一個項目剛被讀取過
+    old = time.time() - 60
+    os.utime(cache._paths(keys[1])[0], (old, old))
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], 'http://x/detail.jsp', {'u': 2}, response)
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+
+
+def test_offline_reparse_matches_online_crawl(tmp_path, crawl, server):
+    work = tmp_path / 'work'
+    assert crawl(work, '--cache').returncode == 0
+    expected = read_outputs(work)
+    for name in os.listdir(work):
+        if name.endswith('.csv'):
+            os.remove(work / name)
+
+    server.reset()
+    assert crawl(work, '--offline').returncode == 0
+    assert server.counts == {}
+    assert read_outputs(work) == expected
+
+
+def test_offline_miss_is_reported(tmp_path):
+    session = scraper.ScraperSession(cache=scraper.ResponseCache(str(tmp_path)), offline=True)
+    with pytest.raises(scraper.CacheMiss):
+        session.get('http://127.0.0.1:9/detail.jsp', params={'u': '1'})
+
+
+def test_offline_reads_from_read_only_cache(tmp_path, etag_server, monkeypatch):
+    cached_session(tmp_path).get(etag_server.url, params={'u': '1'})
+    for root, dirs, files in os.walk(tmp_path):
+        for name in files:
+            os.chmod(os.path.join(root, name), 0o444)
+        os.chmod(root, 0o555)
+
+    # 以 root 執行時權限不會阻止寫入，直接模擬唯讀檔案系統
+    def read_only(*args, **kwargs):
+        raise OSError(errno.EROFS, "Read-only file system")
+    monkeypatch.setattr(os, 'utime', read_only)
+    try:
+        session = scraper.ScraperSession(cache=scraper.ResponseCache(str(tmp_path)), offline=True)
+        assert session.get(etag_server.url, params={'u': '1'}).text == BODY
+    finally:
+        for root, dirs, files in os.walk(tmp_path):
+            os.chmod(root, 0o755)
+    assert etag_server.statuses == [200]
@@ -0,0 +1,88 @@
+"""cancellations：各縣市記錄已抓到的月份，下次只抓之後的月份並去除重複，補習班代碼由 schools.csv 補上"""
+import csv
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import benchmark
+import scraper
+
+
+class CancelFailingServer(benchmark.SiteServer):
+    """指定縣市的廢止／註銷列印頁一律回應 HTTP 500"""
+
+    def __init__(self, site, city):
+        super().__init__(site)
+        self.city = str(city)
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        if parts.path.endswith('print_cancel_list_b.jsp') and parse_qs(parts.query).get('city', [''])[0] == self.city:
+            handler.send_response(500)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        super().handle(handler)
+
+
+def read_rows(workdir):
+    with open(workdir / 'cancellations.csv', newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def read_state(workdir):
+    with open(workdir / 'cancellations.state.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+COUNTIES = len(scraper.COUNTIES)
+
+
+def test_incremental_runs_append_only_new_rows(tmp_path, crawl):
+    result = crawl(tmp_path, 'cancellations', '--since', '2026-01', '--until', '2026-03')
+    assert result.returncode == 0, result.stdout + result.stderr
+    # 模擬網站每縣市每月兩筆
+    assert len(read_rows(tmp_path)) == COUNTIES * 3 * 2
+    assert set(read_state(tmp_path).values()) == {'2026-03'}
+
+    # 從記錄的月份 (含) 接續，重疊的 2026-03 不重複寫入
+    assert crawl(tmp_path, 'cancellations', '--until', '2026-04').returncode == 0
+    rows = read_rows(tmp_path)
+    assert len(rows) == COUNTIES * 4 * 2
+    assert len({tuple(row[k] for k in scraper.CANCEL_KEY) for row in rows}) == len(rows)
+    assert set(read_state(tmp_path).values()) == {'2026-04'}
+
+
+def test_school_ids_come_from_schools_csv(tmp_path, crawl):
+    crawl(tmp_path, 'cancellations', '--since', '2026-01', '--until', '2026-01')
+    assert not any(row['補習班代碼'] for row in read_rows(tmp_path))
+
+    other = tmp_path / 'with-schools'
+    crawl(other)
+    crawl(other, 'cancellations', '--since', '2026-01', '--until', '2026-01')
+    with open(other / 'schools.csv', newline='', encoding='utf-8-sig') as f:
+        ids = {(row['縣市'], row['補習班名稱']): row['補習班代碼'] for row in csv.DictReader(f)}
+    rows = read_rows(other)
+    assert all(row['補習班代碼'] == ids[(row['縣市'], row['補習班'])] for row in rows)
+
+
+def test_failed_county_keeps_its_month(tmp_path, crawl, site):
+    crawl(tmp_path, 'cancellations', '--since', '2026-01', '--until', '2026-02')
+    code = scraper.COUNTIES['臺北市']
+    server = CancelFailingServer(site, code).start()
+    try:
+        result = crawl(tmp_path, 'cancellations', '--until', '2026-03', '--retries', '0', server=server)
+    finally:
+        server.stop()
+    assert result.returncode == 1
+    assert "1 個縣市抓取失敗：臺北市" in result.stdout
+    state = read_state(tmp_path)
+    assert state[str(code)] == '2026-02'
+    assert sum(1 for value in state.values() if value == '2026-03') == COUNTIES - 1
+
+
+def test_backfill_does_not_rewind_state(tmp_path, crawl):
+    crawl(tmp_path, 'cancellations', '--since', '2026-01', '--until', '2026-03')
+    result = crawl(tmp_path, 'cancellations', '--since', '2025-01', '--until', '2025-02')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert len(read_rows(tmp_path)) == COUNTIES * 5 * 2
+    assert set(read_state(tmp_path).values()) == {'2026-03'}
@@ -0,0 +1,51 @@
+"""ordered_map 與 RateLimiter：平行抓取時維持輸入順序、限制在途工作數與全域請求速率"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import scraper
+
+
+def test_ordered_map_keeps_input_order():
+    def work(i):
+        # 越前面的工作越晚完成
+        time.sleep((10 - i) * 0.002)
+        return i * i
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(scraper.ordered_map(executor, work, range(10), 4)) == [i * i for i in range(10)]
+
+
+def test_ordered_map_bounds_in_flight_work():
+    lock = threading.Lock()
+    state = {'running': 0, 'peak': 0}
+
+    def work(i):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        time.sleep(0.005)
+        with lock:
+            state['running'] -= 1
+        return i
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(scraper.ordered_map(executor, work, range(30), 3)) == list(range(30))
+    assert state['peak'] <= 3
+
+
+def test_rate_limiter_spaces_requests_across_threads():
+    limiter = scraper.RateLimiter(50)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: limiter.wait(), range(11)))
+    # 11 個請求之間至少間隔 10 個 1/50 秒
+    assert time.monotonic() - start >= 0.19
+
+
+def test_rate_limiter_zero_means_unlimited():
+    limiter = scraper.RateLimiter(0)
+    start = time.monotonic()
+    for _ in range(100):
+        limiter.wait()
+    assert time.monotonic() - start < 0.05
@@ -0,0 +1,57 @@
+"""重試與 dead_letter.jsonl：暫時性錯誤重試後成功，重新抓取不會遺失尚未補抓的項目，redrive 補齊後與完整抓取相同"""
+import json
+
+import benchmark
+from conftest import read_outputs
+
+FAILING = ['0000008', '0000031']
+
+
+def dead_keys(workdir):
+    with open(workdir / 'dead_letter.jsonl', encoding='utf-8') as f:
+        return sorted(json.loads(line)['key'] for line in f)
+
+
+def test_fresh_run_keeps_unresolved_entries(tmp_path, crawl, flaky_server):
+    work = tmp_path / 'work'
+    assert crawl(work, '--retries', '0', server=flaky_server(FAILING)).returncode == 0
+    assert dead_keys(work) == FAILING
+    # 只抓主檔不會抓詳細頁，失敗的項目仍待補抓
+    assert crawl(work, '--master-only').returncode == 0
+    assert dead_keys(work) == FAILING
+    # 重新抓取成功後才移除
+    assert crawl(work).returncode == 0
+    assert dead_keys(work) == []
+
+
+def test_entries_failing_again_are_not_duplicated(tmp_path, crawl, flaky_server):
+    work = tmp_path / 'work'
+    server = flaky_server(FAILING)
+    crawl(work, '--retries', '0', server=server)
+    crawl(work, '--retries', '0', server=server)
+    assert dead_keys(work) == FAILING
+
+
+def test_redrive_restores_complete_output(tmp_path, crawl, flaky_server):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    work = tmp_path / 'work'
+    crawl(work, '--retries', '0', server=flaky_server(FAILING))
+    result = crawl(work, 'redrive')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert dead_keys(work) == []
+    assert read_outputs(work) == read_outputs(reference)
+
+
+def test_transient_errors_are_retried(tmp_path, crawl, site):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    server = benchmark.SiteServer(site, error_rate=0.1, seed=1).start()
+    try:
+        work = tmp_path / 'work'
+        assert crawl(work, '--retries', '8', server=server).returncode == 0
+        assert server.counts.get('detail.jsp:500', 0) > 0
+    finally:
+        server.stop()
+    assert read_outputs(work) == read_outputs(reference)
+    assert dead_keys(work) == []
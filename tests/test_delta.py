@@ -0,0 +1,75 @@
+"""--delta：只對新增、列表欄位變動或上一次抓取不完整的補習班抓取詳細頁，其餘沿用快照"""
+import csv
+import os
+
+import pytest
+
+import benchmark
+from conftest import ChangedSite, read_outputs
+
+FAILING = ['0000005', '0000017', '0000042']
+
+
+@pytest.fixture
+def reference(tmp_path, crawl):
+    path = tmp_path / 'reference'
+    assert crawl(path).returncode == 0
+    return read_outputs(path)
+
+
+def detail_columns_empty(workdir, school_id):
+    with open(os.path.join(workdir, 'schools.csv'), newline='', encoding='utf-8-sig') as f:
+        row = next(r for r in csv.DictReader(f) if r['補習班代碼'] == school_id)
+    return not row['主管機關文件單位代碼'] and not row['負責人姓名']
+
+
+def test_unchanged_schools_are_carried(tmp_path, crawl, server, reference):
+    work = tmp_path / 'work'
+    assert crawl(work).returncode == 0
+    server.reset()
+    result = crawl(work, '--delta')
+    assert result.returncode == 0
+    assert server.counts.get('detail.jsp', 0) == 0
+    assert read_outputs(work) == reference
+    assert os.path.exists(work / 'schools.prev.csv')
+
+
+def test_changed_list_fields_are_refetched(tmp_path, crawl, site):
+    work = tmp_path / 'work'
+    assert crawl(work).returncode == 0
+    changed = ChangedSite(site.schools, site.seed, [3, 50, 99])
+    server = benchmark.SiteServer(changed).start()
+    try:
+        result = crawl(work, '--delta', server=server)
+        assert result.returncode == 0
+        assert server.counts['detail.jsp'] == 3
+        expected = tmp_path / 'expected'
+        crawl(expected, server=server)
+    finally:
+        server.stop()
+    assert read_outputs(work) == read_outputs(expected)
+
+
+def test_failed_details_are_refetched(tmp_path, crawl, server, flaky_server, reference):
+    work = tmp_path / 'work'
+    result = crawl(work, '--retries', '0', server=flaky_server(FAILING))
+    assert result.returncode == 0
+    assert all(detail_columns_empty(work, school_id) for school_id in FAILING)
+
+    server.reset()
+    result = crawl(work, '--delta')
+    assert result.returncode == 0
+    assert server.counts['detail.jsp'] == len(FAILING)
+    assert read_outputs(work) == reference
+    assert os.path.getsize(work / 'dead_letter.jsonl') == 0
+
+
+def test_rows_with_empty_details_are_refetched_without_dead_letter(tmp_path, crawl, server, flaky_server, reference):
+    work = tmp_path / 'work'
+    crawl(work, '--retries', '0', server=flaky_server(FAILING))
+    os.remove(work / 'dead_letter.jsonl')
+
+    server.reset()
+    assert crawl(work, '--delta').returncode == 0
+    assert server.counts['detail.jsp'] == len(FAILING)
+    assert read_outputs(work) == reference
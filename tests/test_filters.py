@@ -0,0 +1,71 @@
+"""篩選抓取：只抓網站端篩選後的列表頁與詳細頁，結果寫到 partial/ 並記錄條件"""
+import csv
+import json
+
+import pytest
+
+import benchmark
+import scraper
+from conftest import OUTPUTS, run
+
+
+@pytest.fixture(scope='module')
+def full(tmp_path_factory, site):
+    workdir = tmp_path_factory.mktemp('full')
+    server = benchmark.SiteServer(site).start()
+    try:
+        assert run(workdir, server=server).returncode == 0
+    finally:
+        server.stop()
+    with open(workdir / 'schools.csv', newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def read_ids(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return sorted(row['補習班代碼'] for row in csv.DictReader(f))
+
+
+def test_filtered_crawl_matches_subset(tmp_path, crawl, server, full):
+    county = full[0]['縣市']
+    since = '2010-01-01'
+    result = crawl(tmp_path, '--city', county, '--since', since)
+    assert result.returncode == 0, result.stdout + result.stderr
+    expected = sorted(row['補習班代碼'] for row in full if row['縣市'] == county and row['立案日期'] >= since)
+    assert 0 < len(expected) < len(full)
+    assert read_ids(tmp_path / 'partial' / 'schools.csv') == expected
+    # 全國資料不受影響
+    assert not any((tmp_path / name).exists() for name in OUTPUTS)
+    # 只抓符合的詳細頁
+    assert server.counts['detail.jsp'] == len(expected)
+    with open(tmp_path / 'partial' / 'filters.json', encoding='utf-8') as f:
+        assert json.load(f) == {'start_date': since, 'p_city': scraper.COUNTIES[county]}
+
+
+def test_filters_combine(tmp_path, crawl, full):
+    result = crawl(tmp_path, '--type', '外語類', '--output-dir', 'out')
+    assert result.returncode == 0, result.stdout + result.stderr
+    expected = sorted(row['補習班代碼'] for row in full if '外語類' in row['補習班類別/科目'])
+    assert expected and read_ids(tmp_path / 'out' / 'schools.csv') == expected
+
+
+def test_empty_result_writes_headers(tmp_path, crawl, server):
+    result = crawl(tmp_path, '--since', '2099-01-01')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "沒有符合篩選條件的補習班" in result.stdout
+    with open(tmp_path / 'partial' / 'schools.csv', newline='', encoding='utf-8-sig') as f:
+        assert list(csv.reader(f)) == [scraper.HEADER_SCHOOLS]
+    assert 'detail.jsp' not in server.counts
+
+
+def test_unfiltered_crawl_removes_stale_filters(tmp_path, crawl):
+    assert crawl(tmp_path, '--since', '2099-01-01', '--output-dir', '.').returncode == 0
+    assert (tmp_path / 'filters.json').exists()
+    assert crawl(tmp_path).returncode == 0
+    assert not (tmp_path / 'filters.json').exists()
+
+
+def test_filters_conflict_with_bulk_list(tmp_path):
+    result = run(tmp_path, '--bulk-list', '--since', '2020-01-01')
+    assert result.returncode != 0
+    assert "--bulk-list" in result.stderr
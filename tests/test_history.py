@@ -0,0 +1,94 @@
+"""HistoryStore：串流比對內容雜湊、只附加差異，並能重建任一時間點的狀態"""
+import csv
+import datetime
+
+import benchmark
+import scraper
+from conftest import ChangedSite, read_outputs, run
+
+T1 = datetime.datetime(2026, 9, 30, 12, 0)
+T2 = datetime.datetime(2026, 10, 1, 12, 0)
+T3 = datetime.datetime(2026, 10, 2, 12, 0)
+
+
+def school(school_id, phone='(02)12345678', subjects=('數學',)):
+    info = scraper.School({'縣市': '臺北市', '補習班名稱': f"第{school_id}補習班", '補習班代碼': school_id,
+                           '電話': phone, '教室數': '3'})
+    rows = [scraper.Subject({'補習班代碼': school_id, '核准科目名稱': name, '核准班級數': '2'}) for name in subjects]
+    return info, rows, []
+
+
+def test_unchanged_data_records_no_deltas(tmp_path):
+    store = scraper.HistoryStore(str(tmp_path))
+    data = [school('A'), school('B')]
+    assert store.record(data, T1)['added'] == 2
+    counts = store.record([school('A'), school('B')], T2)
+    assert counts == {'added': 0, 'removed': 0, 'modified': 0, 'unchanged': 2, 'skipped': 0}
+    assert [rec['op'] for rec in store.iter_deltas()] == ['added', 'added']
+
+
+def test_modified_delta_carries_only_changed_parts(tmp_path):
+    store = scraper.HistoryStore(str(tmp_path))
+    store.record([school('A'), school('B'), school('C')], T1)
+    counts = store.record([school('A', phone='(02)87654321'), school('B', subjects=('英文',)), school('D')], T2)
+    assert (counts['added'], counts['removed'], counts['modified'], counts['unchanged']) == (1, 1, 2, 0)
+    deltas = {rec['id']: rec for rec in store.iter_deltas(since=T1)}
+    assert deltas['A']['op'] == 'modified'
+    assert deltas['A']['school']['電話'] == '(02)87654321' and deltas['A']['subjects'] is None
+    assert deltas['B']['school'] is None and deltas['B']['subjects'][0]['核准科目名稱'] == '英文'
+    assert deltas['C']['op'] == 'removed' and deltas['D']['op'] == 'added'
+
+
+def test_state_as_of_replays_base_and_deltas(tmp_path):
+    store = scraper.HistoryStore(str(tmp_path))
+    store.record([school('A'), school('B')], T1)
+    store.record([school('A', phone='(02)87654321'), school('C')], T2)
+    store.record([school('A', phone='(02)87654321', subjects=('英文',)), school('C')], T3)
+
+    state = store.state_as_of(T1)
+    assert sorted(state) == ['A', 'B'] and state['A'][0]['電話'] == '(02)12345678'
+    state = store.state_as_of(T2)
+    assert sorted(state) == ['A', 'C']
+    assert state['A'][0]['電話'] == '(02)87654321' and state['A'][1][0]['核准科目名稱'] == '數學'
+    state = store.state_as_of(T3)
+    assert state['A'][1][0]['核准科目名稱'] == '英文'
+    assert store.state_as_of(T1 - datetime.timedelta(days=1)) == {}
+
+
+def test_crawls_record_changes_and_rebuild_past_state(tmp_path, crawl, site):
+    history = str(tmp_path / 'history')
+    work = tmp_path / 'work'
+    result = crawl(work, '--history', history)
+    assert "新增 120" in result.stdout
+    first = read_outputs(work)
+
+    server = benchmark.SiteServer(ChangedSite(site.schools, site.seed, [3, 50])).start()
+    try:
+        result = crawl(work, '--history', history, server=server)
+    finally:
+        server.stop()
+    assert "新增 0、消失 0、變動 2 間" in result.stdout
+
+    result = run(work, 'history', '--dir', history, 'changes', '--since', '2000-01-01', '--output', 'changes.csv')
+    assert "新增 120、消失 0、變動 2 間" in result.stdout
+    with open(work / 'changes.csv', newline='', encoding='utf-8-sig') as f:
+        modified = [row for row in csv.DictReader(f) if row['變動'] == 'modified']
+    assert sorted(row['補習班代碼'] for row in modified) == ['0000003', '0000050']
+    assert {row['變動部分'] for row in modified} == {'school'}
+
+    # 重建第一次抓取後的狀態
+    when = next(scraper.HistoryStore(history).iter_deltas())['ts']
+    result = run(work, 'history', '--dir', history, 'as-of', when, '--output-dir', 'past')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert read_outputs(work / 'past') == first
+
+
+def test_master_only_crawl_does_not_record_history(tmp_path, crawl):
+    history = str(tmp_path / 'history')
+    work = tmp_path / 'work'
+    result = crawl(work, '--history', history)
+    assert "新增 120" in result.stdout
+    result = crawl(work, '--master-only', '--history', history)
+    assert "只抓主檔時不記錄變動歷史" in result.stdout
+    result = crawl(work, '--history', history)
+    assert "新增 0、消失 0、變動 0 間" in result.stdout
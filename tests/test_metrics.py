@@ -0,0 +1,20 @@
+"""--metrics-json / --metrics-prom：各階段延遲、位元組數與進度在抓取結束時寫出"""
+import json
+
+
+def test_metrics_exports_cover_the_crawl(tmp_path, crawl, site, server):
+    work = tmp_path / 'work'
+    result = crawl(work, '--metrics-json', 'metrics.json', '--metrics-prom', 'metrics.prom')
+    assert result.returncode == 0
+
+    with open(work / 'metrics.json', encoding='utf-8') as f:
+        summary = json.load(f)
+    assert summary['done'] == summary['total'] == site.schools
+    assert summary['stages']['fetch_detail']['count'] == site.schools
+    assert summary['stages']['fetch_list']['count'] == server.counts['showpage.jsp']
+    assert summary['bytes']['detail.jsp'] > 0
+    assert summary['errors'] == {}
+
+    prom = (work / 'metrics.prom').read_text(encoding='utf-8')
+    assert f'scraper_stage_seconds_count{{stage="fetch_detail"}} {site.schools}' in prom
+    assert 'scraper_stage_seconds_bucket{stage="fetch_detail",le="+Inf"}' in prom
@@ -0,0 +1,96 @@
+"""--opendata / --master-only：電子郵件與補習班類別由各縣市開放資料 JSON 提供，--master-only 不抓詳細頁"""
+import csv
+import json
+
+import benchmark
+import scraper
+from conftest import read_outputs
+
+
+class RenamedSite(benchmark.SyntheticSite):
+    """開放資料的電子郵件與詳細頁不同，用來確認以 JSON 為準"""
+
+    def opendata(self, city):
+        records = json.loads(super().opendata(city))
+        for rec in records:
+            rec['電子郵件'] = rec['電子郵件'].replace('@example.com.tw', '@opendata.tw')
+        return json.dumps(records, ensure_ascii=False)
+
+
+class BlankSite(benchmark.SyntheticSite):
+    """開放資料缺少部分補習班的電子郵件 (空字串或 null) 與類別"""
+
+    def opendata(self, city):
+        records = json.loads(super().opendata(city))
+        for i, rec in enumerate(records):
+            if i % 2:
+                rec['電子郵件'] = '' if i % 4 == 1 else None
+                rec['短期補習班類別'] = None
+        return json.dumps(records, ensure_ascii=False)
+
+
+def read_schools(workdir):
+    with open(workdir / 'schools.csv', newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def test_opendata_matches_detail_pages(tmp_path, crawl, server):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    work = tmp_path / 'work'
+    server.reset()
+    result = crawl(work, '--opendata')
+    assert result.returncode == 0
+    assert server.counts['afterschool_json.jsp'] == len(scraper.COUNTIES)
+    assert read_outputs(work) == read_outputs(reference)
+
+
+def test_opendata_values_take_precedence(tmp_path, crawl, site):
+    server = benchmark.SiteServer(RenamedSite(site.schools, site.seed)).start()
+    try:
+        assert crawl(tmp_path, '--opendata', server=server).returncode == 0
+    finally:
+        server.stop()
+    rows = read_schools(tmp_path)
+    assert all(row['電子郵件'].endswith('@opendata.tw') for row in rows)
+    # 其餘詳細欄位仍來自詳細頁
+    assert all(row['負責人姓名'] for row in rows)
+
+
+def test_empty_opendata_fields_keep_detail_values(tmp_path, crawl, site):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    server = benchmark.SiteServer(BlankSite(site.schools, site.seed)).start()
+    try:
+        assert crawl(tmp_path / 'work', '--opendata', server=server).returncode == 0
+    finally:
+        server.stop()
+    assert read_outputs(tmp_path / 'work') == read_outputs(reference)
+
+
+def test_master_only_skips_detail_pages(tmp_path, crawl, server, site):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    work = tmp_path / 'work'
+    server.reset()
+    assert crawl(work, '--master-only').returncode == 0
+    assert 'detail.jsp' not in server.counts
+
+    expected = read_schools(reference)
+    rows = read_schools(work)
+    assert len(rows) == site.schools
+    keep = ('縣市', '補習班名稱', '補習班代碼', '班址', '電話', '立案文號', '立案日期', '電子郵件', '補習班類別/科目')
+    for row, full in zip(rows, expected):
+        assert {k: row[k] for k in keep} == {k: full[k] for k in keep}
+        assert not row['負責人姓名']
+    _, subjects, vehicles = read_outputs(work)
+    assert subjects.count(b'\n') == vehicles.count(b'\n') == 1
+
+
+def test_master_only_checkpoint_is_not_resumed_by_full_crawl(tmp_path, crawl):
+    assert crawl(tmp_path, '--master-only').returncode == 0
+    result = crawl(tmp_path, '--resume')
+    assert "改為重新抓取" in result.stdout
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    assert read_outputs(tmp_path) == read_outputs(reference)
@@ -0,0 +1,66 @@
+"""Parquet 輸出：型別轉換、由 CSV 串流轉出，以及未安裝 pyarrow 時的錯誤訊息"""
+import csv
+import datetime
+import os
+
+import pytest
+
+import scraper
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def test_converters():
+    assert scraper.to_float('30.42平方公尺') == 30.42
+    assert scraper.to_float('1,234.5') == 1234.5
+    assert scraper.to_float('') is None and scraper.to_float('無') is None
+    assert scraper.to_int('12') == 12
+    assert scraper.to_date('2026-01-06') == datetime.date(2026, 1, 6)
+    assert scraper.to_date('2026/1/6') == datetime.date(2026, 1, 6)
+    assert scraper.to_date('115-01-06') == datetime.date(2026, 1, 6)
+    assert scraper.to_date('2026-02-30') is None and scraper.to_date('') is None
+
+
+def test_output_records_group_children_by_school(tmp_path, crawl, monkeypatch):
+    assert crawl(tmp_path).returncode == 0
+    monkeypatch.chdir(tmp_path)
+    records = list(scraper.iter_output_records())
+    assert [school for school, _, _ in records] == read_csv('schools.csv')
+    assert [row for _, subjects, _ in records for row in subjects] == read_csv('subjects.csv')
+    assert [row for _, _, vehicles in records for row in vehicles] == read_csv('vehicles.csv')
+    for school, subjects, vehicles in records:
+        assert all(row['補習班代碼'] == school['補習班代碼'] for row in subjects + vehicles)
+
+
+@pytest.mark.skipif(scraper.pa is not None, reason="已安裝 pyarrow")
+def test_parquet_requires_pyarrow(tmp_path, crawl):
+    result = crawl(tmp_path, '--parquet', 'parquet')
+    assert result.returncode != 0
+    assert "pip install pyarrow" in result.stderr
+
+
+def test_parquet_output_is_typed(tmp_path, crawl):
+    pq = pytest.importorskip('pyarrow.parquet')
+    assert crawl(tmp_path, '--parquet', 'parquet').returncode == 0
+    schools = pq.read_table(tmp_path / 'parquet' / 'schools.parquet')
+    rows = read_csv(tmp_path / 'schools.csv')
+    assert schools.num_rows == len(rows)
+    assert str(schools.schema.field('立案日期').type) == 'date32[day]'
+    assert str(schools.schema.field('教室數').type) == 'int32'
+    first = schools.slice(0, 1).to_pylist()[0]
+    assert first['教室面積'] == scraper.to_float(rows[0]['教室面積'])
+    assert first['立案日期'] == scraper.to_date(rows[0]['立案日期'])
+    subjects = pq.read_table(tmp_path / 'parquet' / 'subjects.parquet')
+    assert subjects.num_rows == len(read_csv(tmp_path / 'subjects.csv'))
+
+
+def test_export_matches_crawl_output(tmp_path, crawl, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    assert crawl(tmp_path, '--parquet', 'parquet').returncode == 0
+    monkeypatch.chdir(tmp_path)
+    assert scraper.export_parquet('exported') == len(read_csv('schools.csv'))
+    for name in os.listdir('parquet'):
+        assert pq.read_table(os.path.join('exported', name)).equals(pq.read_table(os.path.join('parquet', name)))
@@ -0,0 +1,80 @@
+"""各詳細頁解析後端與 parse_school_details_legacy (原始 html.parser 逐欄位查找) 的一致性，同 `scraper.py parity`"""
+import re
+
+import pytest
+
+import benchmark
+import scraper
+from conftest import read_outputs
+
+SITE = benchmark.SyntheticSite(300, seed=7)
+SCHOOL_IDS = [str(i) for i in range(0, 300, 11)]
+
+# 真實網站的寫法：單引號屬性、科目表沒有 thead、無資料列、字元參照
+HANDWRITTEN = """<html><body><table><tr><th id='th-sqnum'>x</th><td headers='th-sqnum'>8001</td></tr>
+<tr><td headers='th-cataname'>文理類,其他類</td><td headers='th-email'>a1@x.tw</td><td headers='th-roomcount'>3</td>
+<td headers='th-roomarea'>30.42平方公尺</td><td headers='th-incharge'>王 小明</td></tr></table>
+<table><caption>核准科目資料</caption><tbody><tr><td headers='th-course-name'>數學</td><td headers='th-allow-class'>2</td>
+<td headers='th-allow-person'>20</td><td headers='th-allow-recruiter'>國中</td></tr>
+<tr><td headers='th-course-name'>英文 &amp; 作文</td><td headers='th-allow-class'>1</td></tr></tbody></table>
+<table><caption>交通車資料</caption><tbody><tr><td>無資料</td></tr></tbody></table></body></html>"""
+
+INLINE_SCRIPT = ("<script>var row = '<tr><td headers=\"th-email\">fake@x.tw</td></tr>';"
+                 " if (a < b && b > c) { document.write('<table><caption>交通車資料</caption></table>'); }</script>")
+
+
+def variants(html):
+    yield 'plain', html
+    yield 'inline-script', html.replace('<body>', '<body>' + INLINE_SCRIPT, 1)
+    yield 'entities', html.replace('負責人', '負責人 &amp; ')
+    yield 'no-tbody', re.sub(r'</?tbody>', '', html)
+
+
+def pages():
+    for school_id in SCHOOL_IDS:
+        for name, html in variants(SITE.detail_page(school_id)):
+            yield f"{school_id}-{name}", school_id, html
+    for name, html in variants(HANDWRITTEN):
+        yield f"handwritten-{name}", '2026010100001', html
+
+
+PAGES = list(pages())
+
+
+@pytest.mark.parametrize('backend', scraper.available_parsers())
+@pytest.mark.parametrize('label, school_id, html', PAGES, ids=[label for label, _, _ in PAGES])
+def test_backend_matches_legacy(backend, label, school_id, html):
+    expected = scraper.parse_school_details_legacy(html, school_id)
+    assert scraper.parse_school_details(html, school_id, backend) == expected
+
+
+def test_pages_are_not_trivial():
+    # 比對空結果沒有意義：確認樣本確實含有詳細欄位、科目與交通車
+    parsed = [scraper.parse_school_details_legacy(html, school_id) for _, school_id, html in PAGES]
+    assert all(info.get('主管機關文件單位代碼') for info, _, _ in parsed)
+    assert sum(len(subjects) for _, subjects, _ in parsed) > len(PAGES)
+    assert any(vehicles for _, _, vehicles in parsed)
+    info, subjects, vehicles = scraper.parse_school_details_legacy(HANDWRITTEN, '2026010100001')
+    assert info['負責人姓名'] == '王 小明'
+    assert [s['核准科目名稱'] for s in subjects] == ['數學', '英文 & 作文']
+    assert vehicles == []
+
+
+def test_parity_command(tmp_path, capsys):
+    paths = []
+    for school_id in SCHOOL_IDS[:5]:
+        path = tmp_path / f"{school_id}.html"
+        path.write_text(SITE.detail_page(school_id).replace('<body>', '<body>' + INLINE_SCRIPT, 1), encoding='utf-8')
+        paths.append(str(path))
+    assert scraper.parity(paths) == 0
+    assert "共比對 5 頁詳細資料" in capsys.readouterr().out
+
+
+def test_process_pool_matches_threaded_parse(tmp_path, crawl):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    for backend in scraper.available_parsers():
+        work = tmp_path / backend
+        result = crawl(work, '--parse-procs', '2', '--parser', backend)
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert read_outputs(work) == read_outputs(reference), backend
@@ -0,0 +1,53 @@
+"""Pipeline：以產生器串流抓取，結果與命令列抓取相同，呼叫端較慢時上游會暫停"""
+import csv
+import time
+
+import pytest
+
+import scraper
+from conftest import read_outputs
+
+
+@pytest.fixture
+def session(server, monkeypatch):
+    # configure_base_url 會改寫模組層級的網址，測試結束後還原
+    for name in [n for n in vars(scraper) if n.endswith('_URL')]:
+        monkeypatch.setattr(scraper, name, getattr(scraper, name))
+    scraper.configure_base_url(server.url)
+    session = scraper.get_session(4)
+    yield session
+    session.close()
+
+
+def test_run_matches_command_line_crawl(tmp_path, crawl, session, monkeypatch):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    work = tmp_path / 'work'
+    work.mkdir()
+    monkeypatch.chdir(work)
+    with scraper.Pipeline(session, workers=4) as pipe:
+        assert pipe.run(scraper.CsvOutput()) == 120
+    assert read_outputs(work) == read_outputs(reference)
+
+
+def test_records_and_flattened_children(tmp_path, crawl, session):
+    crawl(tmp_path)
+    with open(tmp_path / 'subjects.csv', newline='', encoding='utf-8-sig') as f:
+        expected = list(csv.DictReader(f))
+    with scraper.Pipeline(session, workers=4) as pipe:
+        assert [dict(row) for row in pipe.subjects()] == expected
+    code = scraper.COUNTIES['臺北市']
+    with scraper.Pipeline(session, workers=4, filters={'p_city': code}) as pipe:
+        records = list(pipe.records())
+    assert records and all(record.school['縣市'] == '臺北市' for record in records)
+    assert all(row['補習班代碼'] == record.school['補習班代碼'] for record in records for row in record.subjects)
+
+
+def test_slow_consumer_pauses_upstream(session, server):
+    with scraper.Pipeline(session, workers=2, window=4, queue_size=2) as pipe:
+        records = pipe.records()
+        next(records)
+        time.sleep(0.5)
+        # 上游只會多抓佇列與抓取視窗容納的量，遠少於全部 120 間
+        assert server.counts.get('detail.jsp', 0) < 20
+        assert sum(1 for _ in records) == 119
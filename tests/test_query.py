@@ -0,0 +1,238 @@
+"""query：索引查詢的結果與直接掃描 CSV 相同；HTTP 服務與重新載入"""
+import csv
+import json
+import shutil
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+from urllib.parse import quote
+
+import pytest
+
+import benchmark
+import scraper
+from conftest import OUTPUTS, run
+
+
+@pytest.fixture(scope='module')
+def outputs(tmp_path_factory, site):
+    workdir = tmp_path_factory.mktemp('query')
+    server = benchmark.SiteServer(site).start()
+    try:
+        assert run(workdir, server=server).returncode == 0
+    finally:
+        server.stop()
+    return workdir
+
+
+@pytest.fixture(scope='module')
+def paths(outputs):
+    return tuple(str(outputs / name) for name in ('schools.csv', 'subjects.csv', 'vehicles.csv'))
+
+
+@pytest.fixture(scope='module')
+def index(paths):
+    return scraper.QueryIndex(scraper.iter_output_records(paths))
+
+
+@pytest.fixture(scope='module')
+def rows(paths):
+    with open(paths[0], newline='', encoding='utf-8-sig') as f:
+        schools = list(csv.DictReader(f))
+    with open(paths[1], newline='', encoding='utf-8-sig') as f:
+        subjects = list(csv.DictReader(f))
+    with open(paths[2], newline='', encoding='utf-8-sig') as f:
+        vehicles = list(csv.DictReader(f))
+    return schools, subjects, vehicles
+
+
+def scan(rows, predicate):
+    return [row['補習班代碼'] for row in rows[0] if predicate(row)]
+
+
+def ids(results):
+    return [school['補習班代碼'] for school in results]
+
+
+def search_all(index, **filters):
+    total, results = index.search(limit=10_000, **filters)
+    assert total == len(results)
+    return ids(results)
+
+
+def test_term_filters_match_scan(index, rows):
+    schools, subjects, _ = rows
+    county = schools[0]['縣市']
+    category = scraper.split_values(schools[0]['補習班類別/科目'])[0]
+    subject = subjects[0]['核准科目名稱']
+    with_subject = {row['補習班代碼'] for row in subjects if row['核准科目名稱'] == subject}
+
+    assert search_all(index, county=county) == scan(rows, lambda r: r['縣市'] == county)
+    assert search_all(index, county=county.replace('臺', '台')) == scan(rows, lambda r: r['縣市'] == county)
+    assert search_all(index, category=category) == scan(
+        rows, lambda r: category in scraper.split_values(r['補習班類別/科目']))
+    assert search_all(index, subject=subject) == scan(rows, lambda r: r['補習班代碼'] in with_subject)
+    assert search_all(index, county=county, subject=subject) == scan(
+        rows, lambda r: r['縣市'] == county and r['補習班代碼'] in with_subject)
+    assert search_all(index, county='不存在') == []
+
+
+@pytest.mark.parametrize('length', [1, 2, 3, 5])
+def test_substring_search_matches_scan(index, rows, length):
+    for row in rows[0][:10]:
+        for key, field in (('name', '補習班名稱'), ('address', '班址')):
+            needle = row[field][1:1 + length]
+            expected = scan(rows, lambda r: needle.lower() in r[field].lower())
+            assert search_all(index, **{key: needle}) == expected, (key, needle)
+
+
+def test_id_lookup(index, rows):
+    schools, _, vehicles = rows
+    for row in schools:
+        assert index.get(school_id=row['補習班代碼'])['補習班名稱'] == row['補習班名稱']
+        assert search_all(index, id=row['補習班代碼']) == [row['補習班代碼']]
+    assert index.get(school_id='不存在') is None
+    assert search_all(index, id=vehicles[0]['補習班代碼'], plate=vehicles[0]['牌照號碼']) == [vehicles[0]['補習班代碼']]
+    other = next(row['補習班代碼'] for row in schools if row['補習班代碼'] != vehicles[0]['補習班代碼'])
+    assert search_all(index, id=other, plate=vehicles[0]['牌照號碼']) == []
+    county = schools[0]['縣市']
+    assert search_all(index, id=schools[0]['補習班代碼'], county=county) == [schools[0]['補習班代碼']]
+    assert search_all(index, id=schools[0]['補習班代碼'], county='不存在') == []
+
+
+def test_plate_lookup(index, rows):
+    _, _, vehicles = rows
+    assert vehicles
+    for vehicle in vehicles[:20]:
+        record = index.get(plate=vehicle['牌照號碼'])
+        assert record['補習班代碼'] == vehicle['補習班代碼']
+        assert vehicle['牌照號碼'] in [v['牌照號碼'] for v in record['vehicles']]
+        assert search_all(index, plate=vehicle['牌照號碼']) == [vehicle['補習班代碼']]
+    assert index.get(plate='不存在') is None
+
+
+def test_pagination_is_stable_and_complete(index, rows):
+    county = rows[0][0]['縣市']
+    expected = scan(rows, lambda r: r['縣市'] == county)
+    pages = []
+    for page in range(1, len(expected) // 3 + 3):
+        total, results = index.search(county=county, page=page, limit=3)
+        assert total == len(expected)
+        pages.extend(ids(results))
+    assert pages == expected
+    assert ids(index.search(page=1, limit=len(rows[0]))[1]) == scan(rows, lambda r: True)
+
+
+def test_record_includes_children(index, rows):
+    _, subjects, vehicles = rows
+    school_id = subjects[0]['補習班代碼']
+    (record,) = [r for r in index.search(limit=10_000)[1] if r['補習班代碼'] == school_id]
+    assert [s['核准科目名稱'] for s in record['subjects']] == [
+        row['核准科目名稱'] for row in subjects if row['補習班代碼'] == school_id]
+    assert [v['牌照號碼'] for v in record['vehicles']] == [
+        row['牌照號碼'] for row in vehicles if row['補習班代碼'] == school_id]
+
+
+def test_unknown_filter_is_rejected(index):
+    with pytest.raises(ValueError):
+        index.search(color='red')
+
+
+@pytest.fixture
+def http(paths):
+    service = scraper.QueryService(paths)
+    service.load()
+    handler = type('Handler', (scraper.QueryHandler,), {'service': service})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{httpd.server_port}{path}') as resp:
+                return resp.status, json.load(resp)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+    yield get
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_http_handler(http, index, rows):
+    county = rows[0][0]['縣市']
+    status, body = http(f'/search?county={quote(county)}&page=2&limit=2')
+    assert status == 200
+    assert (body['total'], body['page'], body['limit']) == (len(search_all(index, county=county)), 2, 2)
+    assert ids(body['results']) == search_all(index, county=county)[2:4]
+
+    school_id = rows[0][5]['補習班代碼']
+    status, body = http(f'/schools/{school_id}')
+    assert status == 200 and body['補習班代碼'] == school_id
+    assert http('/schools/none')[0] == 404
+
+    plate = rows[2][0]['牌照號碼']
+    status, body = http(f'/vehicles/{quote(plate)}')
+    assert status == 200 and body['補習班代碼'] == rows[2][0]['補習班代碼']
+    assert http('/vehicles/none')[0] == 404
+    assert http('/search?color=red')[0] == 400
+    assert http('/nowhere')[0] == 404
+    status, body = http('/info')
+    assert status == 200 and body['schools'] == len(rows[0]) and body['reloads'] == 0
+
+
+def test_search_command(outputs, rows):
+    county = rows[0][0]['縣市']
+    result = run(outputs, 'query', 'search', '--county', county, '--limit', '5')
+    assert result.returncode == 0, result.stdout + result.stderr
+    body = json.loads(result.stdout)
+    assert ids(body['results']) == scan(rows, lambda r: r['縣市'] == county)[:5]
+
+
+def test_reload_waits_for_completed_crawl(tmp_path, outputs, monkeypatch):
+    work = tmp_path / 'work'
+    shutil.copytree(outputs, work)
+    service = scraper.QueryService(tuple(str(work / name) for name in OUTPUTS))
+    service.load()
+    assert service.completed is not None
+    assert not service.poll()
+
+    # 新一次抓取開始：輸出檔先被截斷，journal 仍是上一次的 end
+    monkeypatch.chdir(work)
+    school = next(iter(service.index.search()[1]))
+    output = scraper.CsvOutput()
+    assert not service.poll()
+    journal = scraper.CrawlJournal('crawl.journal')
+    journal.open(False, output.checkpoint(sync=True), 'paged')
+    output.write(scraper.School({k: v for k, v in school.items() if k in scraper.HEADER_SCHOOLS}), [], [])
+    journal.school_done(1, school['補習班代碼'], output.checkpoint())
+    assert not service.poll()
+    assert len(service.index) == 120
+
+    journal.finished(output.checkpoint(sync=True))
+    output.close()
+    journal.close()
+    assert service.poll()
+    assert len(service.index) == 1 and service.reloads == 1
+    assert not service.poll()
+
+
+def test_interrupted_crawl_does_not_signal_completion(tmp_path, crawl):
+    assert crawl(tmp_path).returncode == 0
+    journal = tmp_path / 'crawl.journal'
+    assert scraper.CrawlJournal.completion(str(journal))['offsets'] == [
+        (tmp_path / name).stat().st_size for name in OUTPUTS]
+    # 模擬中斷：去掉最後的 end
+    lines = journal.read_text(encoding='utf-8').splitlines(keepends=True)
+    journal.write_text(''.join(lines[:-1]), encoding='utf-8')
+    assert scraper.CrawlJournal.completion(str(journal)) is None
+    assert crawl(tmp_path, '--resume').returncode == 0
+    assert scraper.CrawlJournal.completion(str(journal)) is not None
+
+
+def test_redrive_keeps_completion_signal(tmp_path, crawl, flaky_server):
+    crawl(tmp_path, '--retries', '0', server=flaky_server(['0000008']))
+    before = scraper.CrawlJournal.completion(str(tmp_path / 'crawl.journal'))
+    assert crawl(tmp_path, 'redrive').returncode == 0
+    after = scraper.CrawlJournal.completion(str(tmp_path / 'crawl.journal'))
+    assert after is not None and after != before
+    assert after['offsets'] == [(tmp_path / name).stat().st_size for name in OUTPUTS]
@@ -0,0 +1,115 @@
+"""School／Subject／Vehicle：與 dict 相同的 Mapping 行為、原文逐位元組還原，以及型別固定的欄位"""
+import csv
+import datetime
+import io
+import json
+import pickle
+
+import pytest
+
+import benchmark
+import scraper
+
+ROW = {
+    '縣市': '臺北市', '補習班名稱': '私立測試文理短期補習班', '補習班代碼': '2026010100001',
+    '主管機關文件單位代碼': '8001', '補習班類別/科目': '文理類', '班址': '某區某路1號', '電話': '(02)12345678',
+    '傳真號碼': '', '電子郵件': 'a@b.tw', '立案情形': '已立案', '立案文號': '府教終字第1號', '立案日期': '2025-01-06',
+    '教室數': '030', '飲用水設備維護管理': '', '教室面積': '30.50平方公尺', '班舍總面積': '約 80 平方公尺',
+    '停辦文號': '', '停辦生效日': '114-01-06', '停辦截止日': '', '負責人姓名': '王小明', '設立人姓名': '王小明', '班主任': '',
+}
+
+
+def test_csv_round_trip_is_byte_identical():
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=scraper.HEADER_SCHOOLS)
+    writer.writeheader()
+    writer.writerow(scraper.School(ROW))
+    expected = io.StringIO()
+    writer = csv.DictWriter(expected, fieldnames=scraper.HEADER_SCHOOLS)
+    writer.writeheader()
+    writer.writerow(ROW)
+    assert out.getvalue() == expected.getvalue()
+    assert scraper.School(next(csv.DictReader(io.StringIO(out.getvalue())))) == ROW
+
+
+def test_slots_hold_values_unless_text_would_not_round_trip():
+    school = scraper.School(ROW)
+    assert school.registered == datetime.date(2025, 1, 6)
+    # 非標準寫法保留原文
+    assert school.classrooms == '030' and school.classroom_area == '30.50平方公尺'
+    assert school.suspended_from == '114-01-06'
+    assert scraper.School({'教室數': '30', '教室面積': '30.5平方公尺'}).classrooms == 30
+    assert scraper.School({'教室面積': '30.5平方公尺'}).classroom_area == 30.5
+    assert scraper.Subject({'每週總節(時)數': '2'}).weekly_hours == 2.0
+    school['教室數'] = 4
+    school['立案日期'] = datetime.date(2026, 1, 6)
+    school['教室面積'] = 12.5
+    assert (school.classrooms, school.registered, school.classroom_area) == (4, datetime.date(2026, 1, 6), 12.5)
+    assert (school['教室數'], school['立案日期'], school['教室面積']) == ('4', '2026-01-06', '12.5平方公尺')
+    assert all(type(value) is str for value in school.values())
+
+
+def test_text_fields_share_one_string():
+    school = scraper.School(ROW)
+    assert (school.name, school.address, school.director) == ('私立測試文理短期補習班', '某區某路1號', '')
+    assert school.fax == '' and school.suspension_no == ''
+    school.address = '某區某路2號之1'
+    school['班主任'] = None
+    assert school['班址'] == '某區某路2號之1' and school['負責人姓名'] == '王小明'
+    assert '班主任' not in school and school.director is None
+    assert list(school) == [column for column in scraper.HEADER_SCHOOLS if column != '班主任']
+    empty = scraper.School({'電話': ''})
+    assert dict(empty) == {'電話': ''} and empty.name is None
+
+
+def test_records_use_a_third_of_the_dict_memory():
+    result = benchmark.bench_memory(benchmark.SyntheticSite(300, seed=3), 300)
+    assert result['ratio'] >= 3
+
+
+def test_typed_values_have_one_type_per_field():
+    school = scraper.School(ROW)
+    assert school.typed('classrooms') == 30
+    assert school.typed('classroom_area') == 30.5
+    assert school.typed('total_area') == 80.0
+    assert school.typed('registered') == datetime.date(2025, 1, 6)
+    # 民國年
+    assert school.typed('suspended_from') == datetime.date(2025, 1, 6)
+    assert school.typed('suspended_until') is None
+    assert school.typed('name') == ROW['補習班名稱']
+    other = scraper.School({'教室數': '3'})
+    assert type(other.typed('classrooms')) is type(school.typed('classrooms')) is int
+    assert scraper.Subject({'每週總節(時)數': '2'}).typed('weekly_hours') == 2.0
+
+
+def test_mapping_behaves_like_dict():
+    school = scraper.School({'補習班名稱': 'A', '備註': 'x'})
+    assert list(school) == ['補習班名稱', '備註'] and len(school) == 2
+    assert school.name == 'A' and school.county is None
+    assert 'county' not in school and '縣市' not in school
+    with pytest.raises(KeyError):
+        school['縣市']
+    school['縣市'] = None
+    del school['備註']
+    assert dict(school) == {'補習班名稱': 'A'}
+    with pytest.raises(KeyError):
+        del school['備註']
+    copy = school.copy()
+    copy['補習班名稱'] = 'B'
+    assert school['補習班名稱'] == 'A'
+    assert scraper.School(school, 電話='1') == {'補習班名稱': 'A', '電話': '1'}
+
+
+def test_repeated_values_are_interned():
+    a = scraper.School({'縣市': ''.join(['臺北', '市'])})
+    b = scraper.School({'縣市': ''.join(['臺', '北市'])})
+    assert a.county is b.county
+
+
+def test_serialization_round_trips():
+    subject = scraper.Subject({'補習班代碼': '1', '核准科目名稱': '數學', '核准班級數': '2'})
+    assert pickle.loads(pickle.dumps(subject)) == subject
+    text = json.dumps([scraper.School(ROW), [subject]], ensure_ascii=False, default=dict)
+    school, subjects = json.loads(text)
+    assert scraper.School(school) == scraper.School(ROW)
+    assert scraper.Subject(subjects[0]) == subject
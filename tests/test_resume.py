@@ -0,0 +1,56 @@
+"""--resume：依 crawl.journal 的檢查點截斷輸出檔並接續抓取，結果與一次抓完完全相同"""
+import json
+import os
+
+from conftest import read_outputs
+
+
+def interrupt(workdir, keep):
+    """模擬中斷：journal 只留前 keep 筆記錄加上寫了一半的一行，輸出檔尾端多出未記錄的資料列"""
+    path = os.path.join(workdir, 'crawl.journal')
+    with open(path, encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(lines[:keep])
+        f.write('{"type": "school", "pa')
+    with open(os.path.join(workdir, 'schools.csv'), 'a', encoding='utf-8') as f:
+        f.write('臺北市,寫了一半的資料列')
+    return [json.loads(line) for line in lines[:keep]]
+
+
+def test_resume_matches_uninterrupted_crawl(tmp_path, crawl, server, site):
+    reference = tmp_path / 'reference'
+    assert crawl(reference).returncode == 0
+    expected = read_outputs(reference)
+
+    resumed = tmp_path / 'resumed'
+    assert crawl(resumed).returncode == 0
+    kept = interrupt(resumed, 50)
+    done = sum(1 for rec in kept if rec['type'] == 'school')
+
+    server.reset()
+    result = crawl(resumed, '--resume')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "續抓" in result.stdout
+    assert read_outputs(resumed) == expected
+    # 已完成的補習班不再抓取詳細頁
+    assert server.counts['detail.jsp'] == site.schools - done
+
+
+def test_resume_without_checkpoint_starts_over(tmp_path, crawl):
+    result = crawl(tmp_path, '--resume')
+    assert result.returncode == 0
+    assert "找不到可續抓的檢查點" in result.stdout
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    assert read_outputs(tmp_path) == read_outputs(reference)
+
+def test_resume_ignores_checkpoint_from_other_mode(tmp_path, crawl):
+    assert crawl(tmp_path, '--bulk-list').returncode == 0
+    interrupt(tmp_path, 20)
+    result = crawl(tmp_path, '--resume')
+    assert result.returncode == 0
+    assert "改為重新抓取" in result.stdout
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    assert read_outputs(tmp_path) == read_outputs(reference)
@@ -0,0 +1,86 @@
+"""Session 暖機：驗證頁 (缺少結構標記的 200 回應) 會觸發重新暖機，而不是被當成空結果寫出"""
+from http.cookies import SimpleCookie
+
+import pytest
+
+import benchmark
+import scraper
+from conftest import read_outputs
+
+
+class BlockingServer(benchmark.SiteServer):
+    """模擬 TS cookie；blocked(cookie 序號) 為真的 cookie 一律收到驗證頁"""
+
+    def __init__(self, site, blocked, cookie_budget=10_000):
+        super().__init__(site, cookie_budget=cookie_budget)
+        self.blocked = blocked
+
+    def check_cookie(self, handler, endpoint):
+        allowed, cookie = super().check_cookie(handler, endpoint)
+        morsel = SimpleCookie(handler.headers.get('Cookie', '')).get('TS01')
+        if endpoint != 'index' and morsel and self.blocked(int(morsel.value)):
+            return False, None
+        return allowed, cookie
+
+
+@pytest.fixture
+def start(site):
+    servers = []
+
+    def start(server):
+        servers.append(server.start())
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def base_url(monkeypatch):
+    # configure_base_url 會改寫模組層級的網址，測試結束後還原
+    for name in [n for n in vars(scraper) if n.endswith('_URL')]:
+        monkeypatch.setattr(scraper, name, getattr(scraper, name))
+    return scraper.configure_base_url
+
+
+def test_expected_page_markers():
+    assert scraper.is_expected_page('https://x/afterschool/showpage.jsp?pageno=1', b'<caption id="result-list">')
+    assert not scraper.is_expected_page('https://x/afterschool/detail.jsp?u=1', '請稍候'.encode('utf-8'))
+    # 未列出的端點不檢查
+    assert scraper.is_expected_page('https://x/afterschool/', b'')
+
+
+@pytest.mark.parametrize('args', [(), ('--sessions', '1'), ('--sessions', '3'), ('--bulk-list',)])
+def test_expiring_cookies_do_not_lose_rows(tmp_path, crawl, site, start, args):
+    reference = tmp_path / 'reference'
+    assert crawl(reference, *args).returncode == 0
+    server = start(benchmark.SiteServer(site, cookie_budget=15))
+    work = tmp_path / 'work'
+    result = crawl(work, *args, server=server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert server.counts['interstitial'] > 0
+    assert read_outputs(work) == read_outputs(reference)
+
+
+def test_persistent_interstitial_raises(site, start, base_url):
+    server = start(BlockingServer(site, blocked=lambda cookie: True))
+    base_url(server.url)
+    session = scraper.get_session(1, rps=0)
+    with pytest.raises(scraper.InterstitialError):
+        session.get(scraper.DETAIL_URL, params={'u': '1'})
+    # 初次暖機加上一次重新暖機
+    assert server.counts['index'] == 2
+    session.close()
+
+
+def test_pool_rotates_to_a_working_session(site, start, base_url):
+    # 第一個 Session 的 cookie (1，重新暖機後為 3) 都被擋，第二個 (2) 正常
+    server = start(BlockingServer(site, blocked=lambda cookie: cookie % 2 == 1))
+    base_url(server.url)
+    pool = scraper.get_session(2, rps=0, sessions=2)
+    assert isinstance(pool, scraper.SessionPool)
+    response = pool.get(scraper.DETAIL_URL, params={'u': '1'})
+    assert scraper.is_expected_page(scraper.DETAIL_URL, response.content)
+    assert pool.local.index == 1
+    assert server.counts['index'] == 3
+    pool.close()
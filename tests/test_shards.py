@@ -0,0 +1,113 @@
+"""依縣市分片抓取：各分片有自己的 manifest，merge 依 COUNTIES 順序合併，重複的補習班只保留第一筆"""
+import csv
+import json
+import os
+import shutil
+
+import pytest
+
+import benchmark
+import scraper
+from conftest import OUTPUTS, run
+
+
+def read_rows(workdir):
+    result = []
+    for name in OUTPUTS:
+        with open(os.path.join(workdir, name), newline='', encoding='utf-8-sig') as f:
+            result.append(list(csv.DictReader(f)))
+    return result
+
+
+def by_id(tables):
+    return [sorted(rows, key=lambda row: row['補習班代碼']) for rows in tables]
+
+
+def manifest(workdir, code):
+    with open(os.path.join(workdir, 'shards', str(code), 'manifest.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def shard_server(site):
+    server = benchmark.SiteServer(site).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='module')
+def sharded_once(tmp_path_factory, shard_server):
+    # 22 個分片各是一個子行程，整個模組只抓一次
+    work = tmp_path_factory.mktemp('sharded')
+    result = run(work, 'shards', '--procs', '4', '--merge', server=shard_server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return work
+
+
+@pytest.fixture
+def sharded(tmp_path, sharded_once):
+    work = tmp_path / 'work'
+    shutil.copytree(sharded_once, work)
+    return work
+
+
+def test_merged_shards_match_full_crawl(tmp_path, crawl, sharded, site):
+    reference = tmp_path / 'reference'
+    crawl(reference)
+    merged = read_rows(sharded)
+    assert by_id(merged) == by_id(read_rows(reference))
+    # 依 COUNTIES 順序排列
+    order = list(scraper.COUNTIES)
+    positions = [order.index(row['縣市']) for row in merged[0]]
+    assert positions == sorted(positions)
+    total = 0
+    for code in scraper.COUNTIES.values():
+        info = manifest(sharded, code)
+        assert info['complete']
+        total += info['rows']['schools.csv']
+    assert total == site.schools
+
+
+def test_rerun_skips_complete_shards(sharded, shard_server):
+    shard_server.reset()
+    result = run(sharded, 'shards', '--procs', '4', server=shard_server)
+    assert result.returncode == 0
+    assert f"略過 {len(scraper.COUNTIES)} 個已完成的分片" in result.stdout
+    assert shard_server.counts == {}
+
+
+def test_merge_refuses_incomplete_shards_unless_partial(sharded):
+    expected = read_rows(sharded)
+    code = next(iter(scraper.COUNTIES.values()))
+    path = sharded / 'shards' / str(code) / 'manifest.json'
+    info = json.loads(path.read_text(encoding='utf-8'))
+    info['complete'] = False
+    path.write_text(json.dumps(info), encoding='utf-8')
+
+    result = run(sharded, 'merge')
+    assert result.returncode == 1
+    assert "1 個分片缺漏或未完成" in result.stdout
+    assert read_rows(sharded) == expected
+
+    result = run(sharded, 'merge', '--partial')
+    assert result.returncode == 1
+    schools = read_rows(sharded)[0]
+    assert len(schools) == len(expected[0]) - info['rows']['schools.csv']
+
+
+def test_duplicates_keep_first_shard(sharded):
+    codes = list(scraper.COUNTIES.values())
+    first = sharded / 'shards' / str(codes[0]) / 'schools.csv'
+    second = sharded / 'shards' / str(codes[1]) / 'schools.csv'
+    with open(first, newline='', encoding='utf-8-sig') as f:
+        row = next(csv.DictReader(f))
+    duplicate = dict(row, 電話='(02)00000000')
+    with open(second, 'a', newline='', encoding='utf-8-sig') as f:
+        csv.DictWriter(f, fieldnames=scraper.HEADER_SCHOOLS).writerow(duplicate)
+
+    expected = read_rows(sharded)
+    result = run(sharded, 'merge')
+    assert result.returncode == 0
+    assert f"重複且內容不同：{row['補習班代碼']}" in result.stdout
+    assert "略過重複 1 筆 (其中內容不同 1 筆)" in result.stdout
+    assert read_rows(sharded) == expected
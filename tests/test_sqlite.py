@@ -0,0 +1,96 @@
+"""SQLite 輸出：內容與 CSV 相同、外鍵與索引、重複執行就地更新，續抓後仍完整"""
+import csv
+import os
+import sqlite3
+
+import scraper
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def table(db, name, header):
+    conn = sqlite3.connect(db)
+    try:
+        cols = ', '.join(f'"{c}"' for c in header)
+        order = 'rowid' if name == 'schools' else 'id'
+        return [dict(zip(header, row)) for row in conn.execute(f"SELECT {cols} FROM {name} ORDER BY {order}")]
+    finally:
+        conn.close()
+
+
+def assert_matches_csv(db, workdir):
+    for name, header in (('schools', scraper.HEADER_SCHOOLS), ('subjects', scraper.HEADER_SUBJECTS),
+                         ('vehicles', scraper.HEADER_VEHICLES)):
+        assert table(db, name, header) == read_csv(workdir / f"{name}.csv"), name
+
+
+def test_sqlite_matches_csv_output(tmp_path, crawl):
+    assert crawl(tmp_path, '--sqlite', 'schools.db').returncode == 0
+    assert_matches_csv(tmp_path / 'schools.db', tmp_path)
+
+
+def test_foreign_keys_and_indexes(tmp_path, crawl):
+    crawl(tmp_path, '--sqlite', 'schools.db')
+    conn = sqlite3.connect(tmp_path / 'schools.db')
+    conn.execute("PRAGMA foreign_keys=ON")
+    try:
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'idx_subjects_school', 'idx_vehicles_school', 'idx_schools_city',
+                'idx_vehicles_plate', 'idx_subjects_name'} <= indexes
+        school_id = conn.execute('SELECT "補習班代碼" FROM subjects LIMIT 1').fetchone()[0]
+        with conn:
+            conn.execute('DELETE FROM schools WHERE "補習班代碼" = ?', (school_id,))
+        assert conn.execute('SELECT count(*) FROM subjects WHERE "補習班代碼" = ?', (school_id,)).fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_rerun_updates_in_place(tmp_path, crawl):
+    crawl(tmp_path, '--sqlite', 'schools.db')
+    crawl(tmp_path, '--sqlite', 'schools.db')
+    assert_matches_csv(tmp_path / 'schools.db', tmp_path)
+
+
+def test_export_sqlite_from_csv(tmp_path, crawl, monkeypatch):
+    crawl(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    assert scraper.main(['export-sqlite', '--output', 'exported.db']) == 0
+    assert_matches_csv(tmp_path / 'exported.db', tmp_path)
+
+
+def test_small_batches_match_csv(tmp_path, crawl, monkeypatch):
+    crawl(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    output = scraper.SqliteOutput('batched.db', batch_size=7)
+    for school, subjects, vehicles in scraper.iter_output_records():
+        output.write(school, subjects, vehicles)
+    output.close()
+    assert_matches_csv(tmp_path / 'batched.db', tmp_path)
+
+
+def test_resume_reimports_rows_lost_with_the_last_batch(tmp_path, crawl):
+    crawl(tmp_path, '--sqlite', 'schools.db')
+    # 模擬 SIGKILL：journal 已記錄前幾十間完成，但這一批還在記憶體中、沒有寫入資料庫
+    journal = tmp_path / 'crawl.journal'
+    lines = journal.read_text(encoding='utf-8').splitlines(keepends=True)
+    journal.write_text(''.join(lines[:50]), encoding='utf-8')
+    os.remove(tmp_path / 'schools.db')
+    result = crawl(tmp_path, '--resume', '--sqlite', 'schools.db')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "續抓" in result.stdout
+    assert_matches_csv(tmp_path / 'schools.db', tmp_path)
+
+
+def test_duplicate_ids_in_one_batch_keep_the_last(tmp_path):
+    output = scraper.SqliteOutput(str(tmp_path / 'dup.db'))
+    subject = {'補習班代碼': '1', '核准科目名稱': '數學'}
+    output.write({'補習班代碼': '1', '補習班名稱': '舊'}, [subject], [])
+    output.write({'補習班代碼': '1', '補習班名稱': '新'}, [subject, dict(subject, 核准科目名稱='英文')], [])
+    output.close()
+    db = tmp_path / 'dup.db'
+    assert [row['補習班名稱'] for row in table(db, 'schools', scraper.HEADER_SCHOOLS)] == ['新']
+    assert [row['核准科目名稱'] for row in table(db, 'subjects', scraper.HEADER_SUBJECTS)] == ['數學', '英文']
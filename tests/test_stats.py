@@ -0,0 +1,80 @@
+"""stats：單次串流統計的結果與逐列計數相同，並能只改寫 README 的統計章節"""
+import csv
+import json
+import os
+import shutil
+from collections import Counter
+
+import pytest
+
+import scraper
+from conftest import ROOT, run
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.fixture
+def crawled(tmp_path, crawl):
+    assert crawl(tmp_path).returncode == 0
+    return tmp_path
+
+
+def test_stats_match_row_counts(crawled):
+    result = run(crawled, 'stats', '--top', '100', '--json', 'stats.json')
+    assert result.returncode == 0, result.stdout + result.stderr
+    with open(crawled / 'stats.json', encoding='utf-8') as f:
+        report = json.load(f)
+
+    schools = read_csv(crawled / 'schools.csv')
+    subjects = read_csv(crawled / 'subjects.csv')
+    vehicles = read_csv(crawled / 'vehicles.csv')
+    categories = Counter(part.strip() for row in schools for part in row['補習班類別/科目'].split(','))
+    per_school = Counter(row['補習班代碼'] for row in vehicles)
+    assert report['schools'] == len(schools)
+    assert report['subject_rows'] == len(subjects)
+    assert report['vehicles'] == len(vehicles)
+    assert dict(report['categories']) == dict(categories)
+    assert dict(report['subjects']) == dict(Counter(row['核准科目名稱'] for row in subjects))
+    assert dict(report['counties']) == dict(Counter(row['縣市'] for row in schools))
+    assert sum(count for _, count in report['years']) == len(schools)
+    assert dict(map(tuple, report['vehicles_per_school'])) == dict(Counter(per_school.values()))
+
+
+def test_concatenated_snapshots_skip_repeated_headers(crawled):
+    single = scraper.collect_stats([crawled / 'schools.csv'], [crawled / 'subjects.csv'], [crawled / 'vehicles.csv'])
+    combined = crawled / 'combined.csv'
+    with open(combined, 'w', encoding='utf-8-sig') as f:
+        text = (crawled / 'schools.csv').read_text(encoding='utf-8-sig')
+        f.write(text + text)
+    double = scraper.collect_stats([combined, crawled / 'schools.csv'], [], [])
+    assert double.schools == 3 * single.schools
+    assert double.counties == Counter({k: 3 * v for k, v in single.counties.items()})
+
+
+def test_stats_sink_matches_csv_stats(crawled, monkeypatch):
+    monkeypatch.chdir(crawled)
+    sink = scraper.Stats()
+    for record in scraper.iter_output_records():
+        sink.write(*record)
+    expected = scraper.collect_stats(['schools.csv'], ['subjects.csv'], ['vehicles.csv'])
+    assert sink.report() == expected.report()
+
+
+def test_update_readme_replaces_only_the_stats_section(crawled):
+    readme = crawled / 'README.md'
+    shutil.copy(os.path.join(ROOT, 'README.md'), readme)
+    before = readme.read_text(encoding='utf-8')
+    assert run(crawled, 'stats', '--update-readme').returncode == 0
+    after = readme.read_text(encoding='utf-8')
+
+    start = before.index(scraper.README_STATS_HEADING)
+    end = before.index('\n## ', start + 1)
+    assert after.startswith(before[:start])
+    assert after.endswith(before[end:])
+    assert "共 120 間補習班" in after
+    # 再次執行結果相同
+    run(crawled, 'stats', '--update-readme')
+    assert readme.read_text(encoding='utf-8') == after